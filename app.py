@@ -11,17 +11,26 @@ import matplotlib.pyplot as plt
 from datetime import datetime, timezone
 from flask import Response
 import io
-import boto3
 import pandas as pd
-from stock_correlations import find_top_correlations
+from stock_correlations import find_top_correlations, load_stock_data_s3, LOAD_WORKERS
+from concurrent.futures import ThreadPoolExecutor
+from correlation_matrix import MATRIX_DIR, CorrelationMatrix, compute_matrix
+from aws_clients import get_s3_client, pool_stats, warm_up
+from price_store import load_prices
+from frame_cache import FRAME_CACHE
+from shared_price_cache import SHARED_CACHE
 import uuid
 import threading
 import time
 from functools import wraps
 from token_gen import add_token, delete_token
-from transaction_logger import load_transactions, save_transaction
-from datetime import timedelta
-from transactions import run_transactions
+from token_store import TOKEN_STORE, parse_iso_utc
+from transaction_logger import load_transactions, reset_transactions, save_transaction
+from transactions import format_report
+from portfolio import load_portfolio, result_to_dict
+from schedules import dca_transactions, fqr_transactions, normalize_rule, rule_transactions
+from sweep import best_by, expand_grid, run_sweep
+from pairs_scan import DEFAULT_ALPHA, DEFAULT_MIN_CORRELATION, DEFAULT_NEIGHBOURS, load_scan, scan_pairs
 import statsmodels.api as sm
 import base64
 
@@ -32,16 +41,14 @@ S3_BUCKET = 'stonks-1'
 S3_PREFIX = 'stock_data/'
 job_statuses = {}
 job_results = {}
+# Worker processes one background job may start; every web worker runs its own jobs
+JOB_WORKERS = int(os.environ.get("STONKS_JOB_WORKERS", "2"))
+
+# Build the shared S3 client (and resolve credentials) before the first request arrives
+warm_up()
 
 def load_valid_tokens():
-    try:
-        s3 = boto3.client('s3')
-        response = s3.get_object(Bucket='stonk-api-storage', Key='tokens.json')
-        data = json.loads(response['Body'].read())
-        return data.get("tokens", [])  # list of dicts now
-    except Exception as e:
-        print(f"Error loading API tokens from S3: {e}")
-        return []
+    return TOKEN_STORE.tokens()
 
 def require_admin_token(func):
     @wraps(func)
@@ -50,42 +57,28 @@ def require_admin_token(func):
         if not token_value:
             return jsonify({"error": "Missing API token"}), 401
 
-        tokens = load_valid_tokens()
-        now = datetime.now(timezone.utc)
-
-        for token in tokens:
-            if token.get("token") != token_value:
-                continue
+        entry = TOKEN_STORE.lookup(token_value)
+        if entry is None:
+            return jsonify({"error": "Invalid API token"}), 403
 
-            try:
-                valid_from = datetime.fromisoformat(token["valid_from"].replace("Z", "+00:00"))
-                expires_at = datetime.fromisoformat(token["expires_at"].replace("Z", "+00:00"))
-            except Exception:
-                return jsonify({"error": "Invalid token time format"}), 500
+        if entry.valid_from is None:
+            return jsonify({"error": "Invalid token time format"}), 500
 
-            if not (valid_from <= now <= expires_at):
-                return jsonify({"error": "Token expired or not yet valid"}), 403
+        if not (entry.valid_from <= datetime.now(timezone.utc) <= entry.expires_at):
+            return jsonify({"error": "Token expired or not yet valid"}), 403
 
-            if token.get("type") != "admin":
-                return jsonify({"error": "Admin privileges required"}), 403
+        if entry.record.get("type") != "admin":
+            return jsonify({"error": "Admin privileges required"}), 403
 
-            request.token_info = token
-            return func(*args, **kwargs)
-
-        return jsonify({"error": "Invalid API token"}), 403
+        request.token_info = entry.record
+        return func(*args, **kwargs)
 
     return wrapper
 
 @app.route('/admin', methods=['GET'])
 @require_admin_token
 def admin_dashboard():
-    s3 = boto3.client('s3')
-    try:
-        response = s3.get_object(Bucket='stonk-api-storage', Key='tokens.json')
-        tokens_data = json.loads(response['Body'].read())
-        tokens = tokens_data.get("tokens", [])
-    except Exception as e:
-        return f"<h3>Error loading tokens: {e}</h3>", 500
+    tokens = load_valid_tokens()
 
     token_rows = ""
     for t in tokens:
@@ -161,9 +154,10 @@ def admin_dashboard():
 @app.route('/admin/add_token', methods=['POST'])
 def admin_add_token():
     admin_token = request.form.get("admin_token")
-    tokens = load_valid_tokens()
-    admin = next((t for t in tokens if t['token'] == admin_token and t['type'] == 'admin'), None)
-    if not admin:
+    if not admin_token:
+        return "Unauthorized", 403
+    admin = TOKEN_STORE.lookup(admin_token)
+    if admin is None or admin.record.get('type') != 'admin':
         return "Unauthorized", 403
 
     username = request.form.get("username")
@@ -178,30 +172,24 @@ def admin_add_token():
 def admin_delete_token():
     token_to_delete = request.form.get("token")
     admin_token = request.form.get("admin_token")
+    if not admin_token:
+        return "Unauthorized", 403
 
-    tokens = load_valid_tokens()
-    admin = next((t for t in tokens if t['token'] == admin_token and t['type'] == 'admin'), None)
-    if not admin:
+    admin = TOKEN_STORE.lookup(admin_token)
+    if admin is None or admin.record.get('type') != 'admin':
         return "Unauthorized", 403
 
     delete_token(token_to_delete)
     return redirect(f"/admin?token={admin_token}")
 
-# Parses datetime string into datetime object with UTC timezone. 
-# This is necessary, since the user input from the browser is set to local timezone, 
-# this function helps normalize the time zones between the token json data and browser timezones.
-# Example testcase: 
-# dt_str = "2023-10-27T10:00:00Z" # ISO 8601 with 'Z' for UTC
-# expected_dt = datetime(2023, 10, 27, 10, 0, 0, tzinfo=timezone.utc)
-# self.assertEqual(parse_iso_utc(dt_str), expected_dt)
-def parse_iso_utc(dt_str):
-    if dt_str.endswith('Z'):
-        dt_str = dt_str[:-1] + '+00:00'
-    dt = datetime.fromisoformat(dt_str)
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt
-
+@app.route('/admin/stats', methods=['GET'])
+@require_admin_token
+def admin_stats():
+    return jsonify({
+        "s3_pool": pool_stats(),
+        "frames": FRAME_CACHE.stats(),
+        "shared": SHARED_CACHE.stats() if SHARED_CACHE else None
+    })
 
 def require_api_token(func):
     @wraps(func)
@@ -210,28 +198,19 @@ def require_api_token(func):
         if not token_value:
             return jsonify({"error": "Missing API token"}), 401
 
-        tokens = load_valid_tokens()
-        now = datetime.now(timezone.utc)
-
-        # Find matching token with validity checks
-        for token in tokens:
-            if token.get("token") != token_value:
-                continue
+        entry = TOKEN_STORE.lookup(token_value)
+        if entry is None:
+            return jsonify({"error": "Invalid API token"}), 403
 
-            try:
-                valid_from = parse_iso_utc(token["valid_from"]) 
-                expires_at = parse_iso_utc(token["expires_at"])
-            except Exception:
-                return jsonify({"error": "Invalid timestamp format in token data"}), 500
+        if entry.valid_from is None:
+            return jsonify({"error": "Invalid timestamp format in token data"}), 500
 
-            if not (valid_from <= now <= expires_at):
-                return jsonify({"error": "Token expired or not yet valid"}), 403
+        if not (entry.valid_from <= datetime.now(timezone.utc) <= entry.expires_at):
+            return jsonify({"error": "Token expired or not yet valid"}), 403
 
-            # Optional: attach user info to request context (Flask `g`)
-            request.token_info = token
-            return func(*args, **kwargs)
-
-        return jsonify({"error": "Invalid API token"}), 403
+        # Optional: attach user info to request context (Flask `g`)
+        request.token_info = entry.record
+        return func(*args, **kwargs)
 
     return wrapper
 
@@ -415,16 +394,11 @@ def pairs_trading():
 
     # ----- Load both tickers directly from S3 -----
     S3_BUCKET = "stonks-1"
-    S3_PREFIX = "stock_data/"
-    s3 = boto3.client("s3")
+    s3 = get_s3_client()
 
     df_list = {}
     for ticker in [ticker1, ticker2]:
-        key = f"{S3_PREFIX}{ticker.lower()}_data.json"
-        obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
-        data = json.loads(obj["Body"].read().decode("utf-8"))
-        df_temp = pd.DataFrame(data)
-        df_temp["date"] = pd.to_datetime(df_temp["date"])
+        df_temp = load_prices(ticker, columns=["close"], bucket_name=S3_BUCKET, s3=s3)
         df_temp = df_temp.set_index("date")
         df_list[ticker] = df_temp["close"]
 
@@ -560,38 +534,14 @@ def plot():
 @app.route('/<stock_symbol>_data')
 @require_api_token
 def stock_data_plot(stock_symbol):
-    # Define S3 parameters
-    bucket_name = 'stonks-1'
-    s3_key = f'stock_data/{stock_symbol.lower()}_data.json'  # Convert to lowercase
-
     try:
-        # Connect to S3 and fetch JSON
-        s3 = boto3.client('s3')
-        response = s3.get_object(Bucket=bucket_name, Key=s3_key)
-        json_data = json.loads(response['Body'].read().decode('utf-8'))
-
+        # Split-adjusted open prices are precomputed at ingest time
+        df = load_prices(stock_symbol, columns=['splitAdjOpen'], bucket_name=S3_BUCKET)
     except Exception as e:
-        return f"Error reading JSON file from S3: {str(e)}", 500
-
-    # Sort and adjust data
-    sorted_data = sorted(json_data, key=lambda x: x['date'], reverse=True)
-
-    cumulative_split = 1.0
-    adjusted_dates = []
-    adjusted_open_prices = []
-
-    for item in sorted_data:
-        date = datetime.strptime(item['date'], '%Y-%m-%dT%H:%M:%S.%fZ')
-        split_factor = item.get('splitFactor', 1.0)
-        adjusted_open = item['open'] * cumulative_split
-
-        adjusted_dates.append(date)
-        adjusted_open_prices.append(adjusted_open)
-
-        cumulative_split /= split_factor
+        return f"Error reading stock data from S3: {str(e)}", 500
 
-    adjusted_dates.reverse()
-    adjusted_open_prices.reverse()
+    adjusted_dates = df['date']
+    adjusted_open_prices = df['splitAdjOpen']
 
     # Plotting
     plt.figure(figsize=(10, 6))
@@ -622,6 +572,7 @@ def stock_correlations(stock_symbol):
         max_date = request.args.get("max_date", "2024-01-01")
         bucket_name = S3_BUCKET      # use your actual bucket variable
         data_prefix = S3_PREFIX.rstrip('/')  # remove trailing slash for consistency
+        timings = {}
 
         top_correlations = find_top_correlations(
             stock_to_compare=stock_symbol,
@@ -629,19 +580,22 @@ def stock_correlations(stock_symbol):
             min_date=min_date,
             max_date=max_date,
             bucket_name=bucket_name,
-            data_prefix=data_prefix
+            data_prefix=data_prefix,
+            timings=timings,
+            use_universe=not request.args.get("all_tickers")
         )
 
-        return jsonify({"stock": stock_symbol.upper(), "correlations": top_correlations})
+        return jsonify({"stock": stock_symbol.upper(), "correlations": top_correlations, "timings": timings})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Request Testing
-def run_correlation_job(job_id, stock_symbol, num_stocks, min_date, max_date):
+def run_correlation_job(job_id, stock_symbol, num_stocks, min_date, max_date, use_universe=True):
     try:
         bucket_name = S3_BUCKET
         data_prefix = S3_PREFIX.rstrip('/')
+        timings = {}
 
         top_correlations = find_top_correlations(
             stock_to_compare=stock_symbol,
@@ -649,14 +603,17 @@ def run_correlation_job(job_id, stock_symbol, num_stocks, min_date, max_date):
             min_date=min_date,
             max_date=max_date,
             bucket_name=bucket_name,
-            data_prefix=data_prefix
+            data_prefix=data_prefix,
+            timings=timings,
+            use_universe=use_universe
         )
 
         # Save results for retrieval after job finishes
         job_statuses[job_id] = "success"
         job_results[job_id] = {
             "stock": stock_symbol.upper(),
-            "correlations": top_correlations
+            "correlations": top_correlations,
+            "timings": timings
         }
         print(f"[✓] Job {job_id} completed for {stock_symbol}")
     except Exception as e:
@@ -678,7 +635,7 @@ def submit_correlation_job():
     job_statuses[job_id] = "processing"
 
     threading.Thread(target=run_correlation_job, args=(
-        job_id, stock_symbol, num_stocks, min_date, max_date
+        job_id, stock_symbol, num_stocks, min_date, max_date, not request.args.get("all_tickers")
     )).start()
 
     return render_template_string("""
@@ -728,6 +685,12 @@ def get_job_status(job_id):
         if status == "failed":
             return f"<h2>❌ Job failed: {result.get('error')}</h2>", 500
 
+        if "matrix" in result:
+            return f"""
+                <h1>✅ Correlation matrix {result['min_date']} to {result['max_date']} is ready</h1>
+                <p>Query it at /correlation/matrix/{job_id}/&lt;symbol&gt;</p>
+            """
+
         rows = "".join([
             f"<tr><td>{r[0]}</td><td>{r[1]:.4f}</td></tr>"
             for r in result['correlations']
@@ -742,6 +705,186 @@ def get_job_status(job_id):
         """
 
 
+def run_correlation_matrix_job(job_id, min_date, max_date, top_k):
+    try:
+        path = compute_matrix(min_date, max_date, top_k=top_k, name=job_id)
+        job_statuses[job_id] = "success"
+        job_results[job_id] = {"matrix": path, "min_date": min_date, "max_date": max_date, "top_k": top_k}
+        print(f"[✓] Correlation matrix job {job_id} completed")
+    except Exception as e:
+        job_statuses[job_id] = "failed"
+        job_results[job_id] = {"error": str(e)}
+
+@app.route('/correlation/matrix/submit', methods=['GET', 'POST'])
+@require_api_token
+def submit_correlation_matrix_job():
+    min_date = request.args.get("min_date", "2023-01-01")
+    max_date = request.args.get("max_date", "2024-01-01")
+    try:
+        top_k = int(request.args.get("top_k", 50))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if top_k < 0:
+        return jsonify({"error": "top_k must not be negative"}), 400
+
+    job_id = str(uuid.uuid4())
+    job_statuses[job_id] = "processing"
+
+    threading.Thread(target=run_correlation_matrix_job, args=(
+        job_id, min_date, max_date, top_k
+    )).start()
+
+    return jsonify({"job_id": job_id, "status": "processing"}), 202
+
+@app.route('/correlation/matrix/<job_id>/<stock_symbol>', methods=['GET'])
+@require_api_token
+def query_correlation_matrix(job_id, stock_symbol):
+    try:
+        top = int(request.args.get("top", 10))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if top < 0:
+        return jsonify({"error": "top must not be negative"}), 400
+
+    status = job_statuses.get(job_id)
+    if status is not None and status != "success":
+        return jsonify({"job_id": job_id, "status": status, "error": job_results.get(job_id, {}).get("error")}), 409
+
+    # Finished matrices stay queryable from other workers and after a restart; meta.json is written last
+    path = job_results[job_id]["matrix"] if status == "success" else os.path.join(MATRIX_DIR, os.path.basename(job_id))
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return jsonify({"error": "Job ID not found"}), 404
+
+    matrix = CorrelationMatrix(path)
+    top_correlations = matrix.top(stock_symbol, top)
+    if top_correlations is None:
+        return jsonify({"error": f"{stock_symbol.upper()} is not in the matrix"}), 404
+    return jsonify({"stock": stock_symbol.upper(), "correlations": top_correlations})
+
+
+def run_sweep_job(job_id, grid):
+    try:
+        sweep = run_sweep(grid, max_workers=JOB_WORKERS)
+        job_statuses[job_id] = "success"
+        job_results[job_id] = sweep
+        print(f"[✓] Sweep job {job_id} evaluated {sweep['combinations']} combinations in {sweep['seconds']}s")
+    except Exception as e:
+        job_statuses[job_id] = "failed"
+        job_results[job_id] = {"error": str(e)}
+
+@app.route('/sweep/submit', methods=['POST'])
+@require_api_token
+def submit_sweep_job():
+    grid = request.get_json(silent=True) or {}
+    try:
+        combinations = len(expand_grid(grid))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    job_id = str(uuid.uuid4())
+    job_statuses[job_id] = "processing"
+
+    threading.Thread(target=run_sweep_job, args=(job_id, grid)).start()
+
+    return jsonify({"job_id": job_id, "status": "processing", "combinations": combinations}), 202
+
+@app.route('/sweep/<job_id>', methods=['GET'])
+@require_api_token
+def query_sweep_job(job_id):
+    status = job_statuses.get(job_id)
+    if status is None:
+        return jsonify({"error": "Job ID not found"}), 404
+    if status != "success":
+        return jsonify({"job_id": job_id, "status": status, "error": job_results.get(job_id, {}).get("error")})
+
+    try:
+        top = int(request.args.get("top", 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if top < 0:
+        return jsonify({"error": "top must not be negative"}), 400
+
+    sweep = job_results[job_id]
+    top = top or len(sweep["results"])
+    return jsonify({
+        "job_id": job_id,
+        "status": status,
+        "combinations": sweep["combinations"],
+        "seconds": sweep["seconds"],
+        "errors": sweep["errors"],
+        "best_by_frequency": best_by(sweep["results"], "frequency"),
+        "best_by_start_date": best_by(sweep["results"], "start_date"),
+        "results": sweep["results"][:top]
+    })
+
+
+def run_pairs_scan_job(job_id, min_date, max_date, tickers, sector, min_correlation, neighbours, alpha):
+    try:
+        path = scan_pairs(min_date, max_date, tickers=tickers, sector=sector, min_correlation=min_correlation,
+                          neighbours=neighbours, alpha=alpha, max_workers=JOB_WORKERS, name=job_id)
+        job_statuses[job_id] = "success"
+        job_results[job_id] = {"path": path}
+        print(f"[✓] Pairs scan job {job_id} completed")
+    except Exception as e:
+        job_statuses[job_id] = "failed"
+        job_results[job_id] = {"error": str(e)}
+
+@app.route('/pairs/scan/submit', methods=['POST'])
+@require_api_token
+def submit_pairs_scan_job():
+    spec = request.get_json(silent=True) or {}
+
+    def param(name, default=None):
+        return spec.get(name, request.values.get(name, default))
+
+    tickers = param("tickers") or []
+    if isinstance(tickers, str):
+        tickers = [t for t in tickers.replace(" ", "").split(",") if t]
+    sector = param("sector")
+    if not tickers and not sector:
+        return jsonify({"error": "Provide a list of tickers or a sector"}), 400
+    try:
+        min_correlation = float(param("min_correlation", DEFAULT_MIN_CORRELATION))
+        neighbours = int(param("neighbours", DEFAULT_NEIGHBOURS))
+        alpha = float(param("alpha", DEFAULT_ALPHA))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    job_id = str(uuid.uuid4())
+    job_statuses[job_id] = "processing"
+
+    threading.Thread(target=run_pairs_scan_job, args=(
+        job_id, param("min_date", "2023-01-01"), param("max_date", "2024-01-01"),
+        tickers, sector, min_correlation, neighbours, alpha
+    )).start()
+
+    return jsonify({"job_id": job_id, "status": "processing"}), 202
+
+@app.route('/pairs/scan/<job_id>', methods=['GET'])
+@require_api_token
+def query_pairs_scan_job(job_id):
+    status = job_statuses.get(job_id)
+    if status is not None and status != "success":
+        return jsonify({"job_id": job_id, "status": status, "error": job_results.get(job_id, {}).get("error")})
+
+    try:
+        top = int(request.args.get("top", 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if top < 0:
+        return jsonify({"error": "top must not be negative"}), 400
+
+    # Stored scans stay available after a restart
+    scan = load_scan(job_id)
+    if scan is None:
+        return jsonify({"error": "Job ID not found"}), 404
+    top = top or len(scan["pairs"])
+    pairs = scan["pairs"]
+    if request.args.get("cointegrated"):
+        pairs = [p for p in pairs if p["cointegrated"]]
+    return jsonify({"job_id": job_id, "status": "success", **scan["meta"], "pairs": pairs[:top]})
+
+
 @app.route('/routes')
 def list_routes():
     return jsonify([str(rule) for rule in app.url_map.iter_rules()])
@@ -750,11 +893,12 @@ def list_routes():
 @app.route('/transactions', methods=['GET', 'POST'])
 @require_api_token
 def transactions():
-    s3_client = boto3.client('s3')
+    s3_client = get_s3_client()
     S3_BUCKET = "stonks-1"
     token = request.form.get('token') or request.args.get('token')
     calculation_output = None
     transaction_plot = None  # <--- now holds base64 image string
+    portfolio = None
 
     # --- Identify user & directory ---
     user_id = request.token_info.get("username")
@@ -762,7 +906,8 @@ def transactions():
 
     # --- List available files ---
     existing_files = []
-    resp = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=user_prefix)
+    # Delimiter keeps each file's .segments/ folder out of the listing
+    resp = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=user_prefix, Delimiter='/')
     if "Contents" in resp:
         existing_files = [obj["Key"].split("/")[-1] for obj in resp["Contents"]]
 
@@ -772,7 +917,7 @@ def transactions():
 
     if new_file:  # user creating new file
         selected_file = new_file if new_file.endswith(".json") else f"{new_file}.json"
-        s3_client.put_object(Bucket=S3_BUCKET, Key=f"{user_prefix}{selected_file}", Body="[]")
+        reset_transactions(S3_BUCKET, f"{user_prefix}{selected_file}")
 
     if not selected_file and existing_files:  # default: first file if exists
         selected_file = existing_files[0]
@@ -782,11 +927,15 @@ def transactions():
     # --- Handle POST actions ---
     if request.method == 'POST' and transactions_key:
         if 'calculate' in request.form:
-            calculation_output = run_transactions(transactions_key)
+            # One replay of the file feeds both the report and the plot
+            portfolio = load_portfolio(transactions_key, bucket_name=S3_BUCKET, s3=s3_client)
+            if (request.form.get('format') or request.args.get('format')) == 'json':
+                return jsonify(result_to_dict(portfolio))
+            calculation_output = format_report(portfolio)
 
             # generate portfolio plot only when calculating
             from transaction_plot import generate_transaction_plot
-            transaction_plot = generate_transaction_plot(transactions_key)
+            transaction_plot = generate_transaction_plot(transactions_key, result=portfolio)
             print(transaction_plot[:100])
 
         else:
@@ -806,7 +955,10 @@ def transactions():
                 return redirect(url_for('transactions', token=token, selected_file=selected_file))
 
     # --- Load transactions ---
-    all_transactions = load_transactions(S3_BUCKET, transactions_key) if transactions_key else []
+    if portfolio is not None:
+        all_transactions = portfolio.transactions
+    else:
+        all_transactions = load_transactions(S3_BUCKET, transactions_key) if transactions_key else []
 
     # --- Render ---
     return render_template_string("""
@@ -879,6 +1031,15 @@ def transactions():
             </thead>
             <tbody>
                 {% for tx in transactions %}
+                {% if tx.rule %}
+                <tr>
+                    <td>{{ loop.index }}</td>
+                    <td>{{ tx.rule.stock | upper }}</td>
+                    <td>{{ (tx.rule.start_date or '')[:10] }} – {{ tx.rule.end_date[:10] if tx.rule.end_date else 'open' }}</td>
+                    <td class="text-primary">{{ tx.rule.type | upper }} rule</td>
+                    <td>{{ tx.rule.frequency }}, {{ tx.rule.fixed_dollar_amount ~ ' USD' if tx.rule.type == 'dca' else tx.rule.fixed_quantity ~ ' shares' }}</td>
+                </tr>
+                {% else %}
                 <tr>
                     <td>{{ loop.index }}</td>
                     <td>{{ tx.stock.upper() }}</td>
@@ -888,6 +1049,7 @@ def transactions():
                     </td>
                     <td>{{ tx.quantity }}</td>
                 </tr>
+                {% endif %}
                 {% endfor %}
             </tbody>
         </table>
@@ -936,66 +1098,26 @@ def dca_rule():
             FIXED_DOLLAR_AMOUNT = float(request.form.get("dollar_amount", 100))
             FREQUENCY = request.form.get("frequency", "weekly")
             START_DATE = pd.to_datetime(request.form.get("start_date", "2020-01-01"), utc=True)
-            END_DATE   = pd.to_datetime(request.form.get("end_date", "2025-01-01"), utc=True)
+            # An empty end date leaves the rule open-ended: it runs up to the latest bar
+            END_DATE   = request.form.get("end_date", "2025-01-01")
+            END_DATE   = pd.to_datetime(END_DATE, utc=True) if END_DATE else None
+            # Lazy rules are stored as a reference and expanded against current prices on every calculation
+            LAZY = request.form.get("lazy") == "on"
 
-            # Load stock data from S3
             S3_BUCKET = 'stonks-1'
-            S3_PREFIX = 'stock_data/'
-            s3_client = boto3.client('s3')
-            s3_key = f"{S3_PREFIX}{STOCK}_data.json"
-            obj = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-            stock_data = json.loads(obj['Body'].read().decode('utf-8'))
-            df = pd.DataFrame(stock_data)
-            df['date'] = pd.to_datetime(df['date'], utc=True)
-            df = df.sort_values(by='date').reset_index(drop=True)
-
-            # Initialize new transaction list
-            transactions = []
-
-            start_year = START_DATE.year
-            end_year = END_DATE.year
-
-            if FREQUENCY == 'monthly':
-                for year in range(start_year, end_year + 1):
-                    for month in range(1, 13):
-                        target_date = pd.Timestamp(year=year, month=month, day=1, tz='UTC')
-                        if target_date < df['date'].min() or target_date > df['date'].max():
-                            continue
-                        month_data = df[(df['date'].dt.year == year) & (df['date'].dt.month == month)]
-                        if month_data.empty:
-                            continue
-                        date_lookup = month_data['date'].min()
-                        close_price = df.loc[df['date'] == date_lookup, 'close'].iloc[0]
-                        quantity = round(FIXED_DOLLAR_AMOUNT / close_price, 6)
-
-                        transactions.append({
-                            "stock": STOCK,
-                            "date": date_lookup.strftime("%Y-%m-%d"),
-                            "action": "buy",
-                            "quantity": quantity
-                        })
-
-            elif FREQUENCY == 'weekly':
-                first_sunday = START_DATE + pd.offsets.Week(weekday=6)
-                current_date = first_sunday
-                while current_date <= END_DATE:
-                    if current_date > df['date'].max():
-                        break
-                    week_data = df[df['date'] >= current_date]
-                    if week_data.empty:
-                        break
-                    date_lookup = week_data['date'].min()
-                    close_price = df.loc[df['date'] == date_lookup, 'close'].iloc[0]
-                    quantity = round(FIXED_DOLLAR_AMOUNT / close_price, 6)
-
-                    transactions.append({
-                        "stock": STOCK,
-                        "date": date_lookup.strftime("%Y-%m-%d"),
-                        "action": "buy",
-                        "quantity": quantity
-                    })
-
-                    current_date += timedelta(weeks=1)
+            s3_client = get_s3_client()
+
+            if LAZY:
+                # Prices are only read when the rule is expanded
+                transactions = [{"rule": normalize_rule({
+                    "type": "dca", "stock": STOCK, "fixed_dollar_amount": FIXED_DOLLAR_AMOUNT, "frequency": FREQUENCY,
+                    "start_date": START_DATE, "end_date": END_DATE
+                })}]
+            else:
+                # Load stock data from S3
+                df = load_prices(STOCK, columns=['close'], bucket_name=S3_BUCKET, s3=s3_client)
+                transactions = dca_transactions(STOCK, df, FIXED_DOLLAR_AMOUNT, FREQUENCY, START_DATE,
+                                    END_DATE if END_DATE is not None else df['date'].max())
 
             # Save transactions to S3
             user_id = request.token_info.get("username")  # comes from the token
@@ -1016,7 +1138,7 @@ def dca_rule():
                 'fixed_dollar_amount': FIXED_DOLLAR_AMOUNT,
                 "frequency": FREQUENCY, 
                 "start_date": str(START_DATE), 
-                "end_date": str(END_DATE)  
+                "end_date": str(END_DATE) if END_DATE is not None else None
             }
 
             file_id_dca = file_id + "_dca.json"
@@ -1070,7 +1192,9 @@ UI_TEMPLATE = """
     <label>Frequency:
       <select name="frequency">
         <option value="weekly">Weekly</option>
+        <option value="biweekly">Biweekly</option>
         <option value="monthly">Monthly</option>
+        <option value="quarterly">Quarterly</option>
       </select>
     </label>
 
@@ -1078,8 +1202,12 @@ UI_TEMPLATE = """
       <input type="date" name="start_date" value="2020-01-01" required>
     </label>
 
-    <label>End Date:
-      <input type="date" name="end_date" value="2025-01-01" required>
+    <label>End Date (empty: open-ended):
+      <input type="date" name="end_date" value="2025-01-01">
+    </label>
+
+    <label>
+      <input type="checkbox" name="lazy"> Keep as a rule (recomputed from the latest prices)
     </label>
 
     <button type="submit">Apply Rule</button>
@@ -1092,6 +1220,87 @@ UI_TEMPLATE = """
 </html>
 """
 
+@app.route('/rules/batch', methods=['POST'])
+@require_api_token
+def apply_rules_batch():
+    """
+    Apply many DCA / FQR rules at once: JSON {"rules": [{"type": "dca", "stock": ..., ...}, ...]}.
+
+    Each ticker is loaded once (concurrently), every schedule is generated from the loaded
+    frames, and the result is written as one date-sorted transactions file plus one rule manifest.
+    With "lazy": true the file holds rule references instead, expanded at calculation time.
+    """
+    payload = request.get_json(silent=True) or {}
+    specs = payload.get("rules")
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"error": "Expected a JSON body with a non-empty 'rules' list"}), 400
+    try:
+        rules = [normalize_rule(spec) for spec in specs]
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Invalid rule: {e}"}), 400
+
+    S3_BUCKET = 'stonks-1'
+    s3_client = get_s3_client()
+
+    def load(stock):
+        try:
+            return stock, load_prices(stock, columns=['close'], bucket_name=S3_BUCKET, s3=s3_client), None
+        except Exception as e:
+            return stock, None, str(e)
+
+    stocks = sorted({rule["stock"] for rule in rules})
+    frames = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=min(LOAD_WORKERS, len(stocks))) as executor:
+        for stock, df, error in executor.map(load, stocks):
+            if error is None:
+                frames[stock] = df
+            else:
+                errors[stock.upper()] = f"Could not load prices: {error}"
+
+    applied = [rule for rule in rules if rule["stock"] in frames]
+    if not applied:
+        return jsonify({"error": "No rule could be applied", "errors": errors}), 400
+    if payload.get("lazy"):
+        # Rule references, expanded against current prices on every calculation
+        transactions = [{"rule": rule} for rule in applied]
+    else:
+        transactions = []
+        for rule in applied:
+            transactions += rule_transactions(rule, frames[rule["stock"]])
+        # Stable, so same-day buys keep the order of the rules
+        transactions.sort(key=lambda tx: tx["date"])
+
+    user_id = request.token_info.get("username")
+    file_id = str(uuid.uuid4())
+    file_id_tx = file_id + "_tx.json"
+    tx_key = f"user_data/{user_id}/tx/{file_id_tx}"
+    manifest_key = f"user_data/{user_id}/rules/{file_id}_rules.json"
+
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=tx_key,
+        Body=json.dumps(transactions, indent=2),
+        ContentType="application/json"
+    )
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=manifest_key,
+        Body=json.dumps(applied, indent=2),
+        ContentType="application/json"
+    )
+
+    return jsonify({
+        "transactions_file": file_id_tx,
+        "transactions_key": tx_key,
+        "manifest_key": manifest_key,
+        "rules": len(applied),
+        "transactions": len(transactions),
+        "lazy": bool(payload.get("lazy")),
+        "errors": errors
+    })
+
+
 @app.route('/fqr_rule', methods=['GET', 'POST'])
 @require_api_token
 def fqr_rule():
@@ -1101,68 +1310,26 @@ def fqr_rule():
             FIXED_QUANTITY = float(request.form.get("quantity", 1))
             FREQUENCY = request.form.get("frequency", "weekly")
             START_DATE = pd.to_datetime(request.form.get("start_date", "2020-01-01"), utc=True)
-            END_DATE   = pd.to_datetime(request.form.get("end_date", "2025-01-01"), utc=True)
+            # An empty end date leaves the rule open-ended: it runs up to the latest bar
+            END_DATE   = request.form.get("end_date", "2025-01-01")
+            END_DATE   = pd.to_datetime(END_DATE, utc=True) if END_DATE else None
+            # Lazy rules are stored as a reference and expanded against current prices on every calculation
+            LAZY = request.form.get("lazy") == "on"
 
-            # Load stock data from S3
             S3_BUCKET = 'stonks-1'
-            S3_PREFIX = 'stock_data/'
-            s3_client = boto3.client('s3')
-            s3_key = f"{S3_PREFIX}{STOCK}_data.json"
-            obj = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-            stock_data = json.loads(obj['Body'].read().decode('utf-8'))
-            df = pd.DataFrame(stock_data)
-            df['date'] = pd.to_datetime(df['date'], utc=True)
-            df = df.sort_values(by='date').reset_index(drop=True)
-
-            # Initialize new transaction list
-            transactions = []
-
-            start_year = START_DATE.year
-            end_year = END_DATE.year
-
-            if FREQUENCY == 'monthly':
-                for year in range(start_year, end_year + 1):
-                    for month in range(1, 13):
-                        target_date = pd.Timestamp(year=year, month=month, day=1, tz='UTC')
-                        if target_date < df['date'].min() or target_date > df['date'].max():
-                            continue
-                        month_data = df[(df['date'].dt.year == year) & (df['date'].dt.month == month)]
-                        if month_data.empty:
-                            continue
-                        date_lookup = month_data['date'].min()
-                        close_price = df.loc[df['date'] == date_lookup, 'close'].iloc[0]
-
-                        transactions.append({
-                            "stock": STOCK,
-                            "date": date_lookup.strftime("%Y-%m-%d"),
-                            "action": "buy",
-                            "quantity": FIXED_QUANTITY,
-                            "price": close_price,
-                            "total_cost": round(FIXED_QUANTITY * close_price, 2)
-                        })
-
-            elif FREQUENCY == 'weekly':
-                first_sunday = START_DATE + pd.offsets.Week(weekday=6)
-                current_date = first_sunday
-                while current_date <= END_DATE:
-                    if current_date > df['date'].max():
-                        break
-                    week_data = df[df['date'] >= current_date]
-                    if week_data.empty:
-                        break
-                    date_lookup = week_data['date'].min()
-                    close_price = df.loc[df['date'] == date_lookup, 'close'].iloc[0]
-
-                    transactions.append({
-                        "stock": STOCK,
-                        "date": date_lookup.strftime("%Y-%m-%d"),
-                        "action": "buy",
-                        "quantity": FIXED_QUANTITY,
-                        "price": close_price,
-                        "total_cost": round(FIXED_QUANTITY * close_price, 2)
-                    })
-
-                    current_date += timedelta(weeks=1)
+            s3_client = get_s3_client()
+
+            if LAZY:
+                # Prices are only read when the rule is expanded
+                transactions = [{"rule": normalize_rule({
+                    "type": "fqr", "stock": STOCK, "fixed_quantity": FIXED_QUANTITY, "frequency": FREQUENCY,
+                    "start_date": START_DATE, "end_date": END_DATE
+                })}]
+            else:
+                # Load stock data from S3
+                df = load_prices(STOCK, columns=['close'], bucket_name=S3_BUCKET, s3=s3_client)
+                transactions = fqr_transactions(STOCK, df, FIXED_QUANTITY, FREQUENCY, START_DATE,
+                                    END_DATE if END_DATE is not None else df['date'].max())
 
             # Save transactions to S3
             user_id = request.token_info.get("username")  # comes from the token
@@ -1183,7 +1350,7 @@ def fqr_rule():
                 'fixed_quantity': FIXED_QUANTITY,
                 "frequency": FREQUENCY, 
                 "start_date": str(START_DATE), 
-                "end_date": str(END_DATE)  
+                "end_date": str(END_DATE) if END_DATE is not None else None
             }
 
             file_id_fqr = file_id + "_fqr.json"
@@ -1237,7 +1404,9 @@ UI_TEMPLATE_FQR = """
     <label>Frequency:
       <select name="frequency">
         <option value="weekly">Weekly</option>
+        <option value="biweekly">Biweekly</option>
         <option value="monthly">Monthly</option>
+        <option value="quarterly">Quarterly</option>
       </select>
     </label>
 
@@ -1245,8 +1414,12 @@ UI_TEMPLATE_FQR = """
       <input type="date" name="start_date" value="2020-01-01" required>
     </label>
 
-    <label>End Date:
-      <input type="date" name="end_date" value="2025-01-01" required>
+    <label>End Date (empty: open-ended):
+      <input type="date" name="end_date" value="2025-01-01">
+    </label>
+
+    <label>
+      <input type="checkbox" name="lazy"> Keep as a rule (recomputed from the latest prices)
     </label>
 
     <button type="submit">Apply Rule</button>
@@ -1263,30 +1436,4 @@ if __name__ == '__main__':
     os.makedirs('static', exist_ok=True)
     app.run(host='0.0.0.0', port=5001, debug=True)
 
-s3 = boto3.client("s3")
-
-def load_stock_data_s3(bucket_name, object_key):
-    """Load stock data directly from an S3 JSON object into a DataFrame."""
-    try:
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        content = response["Body"].read()
-        data = json.loads(content)
-
-        if isinstance(data, dict):
-            data = data.get("data", [])
-
-        if not isinstance(data, list):
-            print(f"Skipping {object_key}: Unexpected JSON format.")
-            return None
-
-        df = pd.DataFrame(data)
-
-        if "date" not in df.columns:
-            print(f"Skipping {object_key}: 'date' column missing.")
-            return None
-
-        return df
-    except Exception as e:
-        print(f"Failed to load {object_key} from S3: {e}")
-        return None
 ### Request testing
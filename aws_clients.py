@@ -0,0 +1,116 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Sized for the app's request threads plus the loader pools (stock_correlations uses 16)
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("STONKS_S3_POOL", "50"))
+S3_MAX_ATTEMPTS = int(os.environ.get("STONKS_S3_MAX_ATTEMPTS", "10"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class PoolStats:
+    """Counts of S3 API calls in flight, recorded from botocore's before-call / after-call events."""
+
+    def __init__(self, max_pool_connections):
+        self.max_pool_connections = max_pool_connections
+        self.calls = 0
+        self.errors = 0
+        self.failed_attempts = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def before_call(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def after_call(self, http_response=None, **kwargs):
+        with self._lock:
+            self.in_flight -= 1
+            if http_response is not None and http_response.status_code >= 400:
+                self.errors += 1
+
+    def after_call_error(self, **kwargs):
+        with self._lock:
+            self.in_flight -= 1
+            self.errors += 1
+
+    def needs_retry(self, response=None, caught_exception=None, **kwargs):
+        # Fired after every HTTP attempt, count the ones that failed in a retryable way
+        status = response[0].status_code if response else None
+        if caught_exception is not None or status == 429 or (status is not None and status >= 500):
+            with self._lock:
+                self.failed_attempts += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "max_pool_connections": self.max_pool_connections,
+                "calls": self.calls,
+                "errors": self.errors,
+                "failed_attempts": self.failed_attempts,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight
+            }
+
+
+def get_s3_client(access_key=None, secret_key=None, max_pool_connections=S3_MAX_POOL_CONNECTIONS):
+    """
+    Shared S3 client for this process.
+
+    botocore clients are thread-safe once built, so one client per credentials/pool size is
+    reused everywhere instead of paying construction and credential resolution per call. It
+    uses adaptive retries (client-side rate limiting on throttling) and a connection pool of
+    max_pool_connections. A forked worker gets its own client, since connection pools must
+    not be shared across processes.
+
+    :param access_key: explicit AWS access key (default credential chain when omitted)
+    :param secret_key: explicit AWS secret key
+    :param max_pool_connections: HTTP connections kept for concurrent calls
+    """
+    key = (os.getpid(), access_key, secret_key, max_pool_connections)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # Sessions are not thread-safe, so each client is built from its own under the lock
+            session = boto3.session.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+            client = session.client("s3", config=Config(
+                max_pool_connections=max_pool_connections,
+                retries={"mode": "adaptive", "max_attempts": S3_MAX_ATTEMPTS}
+            ))
+            stats = PoolStats(max_pool_connections)
+            events = client.meta.events
+            events.register("before-call.s3", stats.before_call)
+            events.register("after-call.s3", stats.after_call)
+            events.register("after-call-error.s3", stats.after_call_error)
+            events.register("needs-retry.s3", stats.needs_retry)
+            client.pool_stats = stats
+            _clients[key] = client
+        return client
+
+
+def warm_up():
+    """Build the default client (resolving credentials) ahead of the first request."""
+    try:
+        get_s3_client()
+    except Exception as e:
+        print(f"Could not create the S3 client yet: {e}")
+
+
+def pool_stats():
+    """Usage of every client created in this process, to size S3_MAX_POOL_CONNECTIONS."""
+    pid = os.getpid()
+    return [
+        {"custom_credentials": access_key is not None, **client.pool_stats.as_dict()}
+        for (client_pid, access_key, _, _), client in list(_clients.items()) if client_pid == pid
+    ]
@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+
+
+class Checkpoint:
+    """
+    Durable progress record for a universe download.
+
+    Stores the universe snapshot the run started from, the tickers that completed and the tickers
+    that failed (with their last error), so an interrupted run can pick up where it stopped.
+    """
+
+    def __init__(self, path, universe, completed=None, failed=None, flush_every=50, flush_seconds=10.0):
+        self.path = path
+        self.universe = list(universe)
+        self.completed = set(completed or [])
+        self.failed = dict(failed or {})
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self._dirty = 0
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def load(cls, path):
+        """Load a checkpoint from disk, or return None if there is none."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable checkpoint {path}: {e}")
+            return None
+        return cls(path, data.get("universe", []), data.get("completed"), data.get("failed"))
+
+    def pending(self):
+        """Tickers of the universe snapshot that have not completed yet, in snapshot order."""
+        return [t for t in self.universe if t not in self.completed]
+
+    def record(self, ticker, error=None):
+        """Mark a ticker as completed (error is None) or failed, flushing to disk periodically."""
+        with self.lock:
+            if error is None:
+                self.completed.add(ticker)
+                self.failed.pop(ticker, None)
+            else:
+                self.failed[ticker] = error
+            self._dirty += 1
+            if self._dirty >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        data = {
+            "universe": self.universe,
+            "completed": sorted(self.completed),
+            "failed": self.failed
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._dirty = 0
+        self._last_flush = time.monotonic()
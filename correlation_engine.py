@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from price_panel import timestamp_ns
+
+# Tickers whose first return in the window comes later than this are skipped, as in find_top_correlations
+MAX_START_DELAY = pd.Timedelta(days=5)
+COLUMN_CHUNK = 1024
+
+
+def window_returns(panel, min_date, max_date):
+    """
+    Daily returns of every panel ticker inside [min_date, max_date].
+
+    Each ticker's first bar in the window has no predecessor inside it, so its return is blanked,
+    matching a pct_change taken on the windowed series.
+
+    :return: (row slice into the panel, T x N float64 array with NaN where there is no return)
+    """
+    rows = panel.date_slice(min_date, max_date)
+    returns = np.array(panel.returns[rows])
+    if len(returns) == 0:
+        # Window after the last bar, or min_date > max_date
+        return rows, returns
+    valid = panel.valid[rows]
+
+    has_bar = valid.any(axis=0)
+    first_bar = valid.argmax(axis=0)
+    cols = np.nonzero(has_bar)[0]
+    returns[first_bar[cols], cols] = np.nan
+    return rows, returns
+
+
+def eligible_columns(panel, rows, returns, min_date):
+    """Mask of tickers with at least one return in the window, the first within 5 days of min_date."""
+    if len(returns) == 0:
+        return np.zeros(returns.shape[1], dtype=bool)
+    has_return = ~np.isnan(returns)
+    any_return = has_return.any(axis=0)
+    first_row = has_return.argmax(axis=0)
+    first_date = np.asarray(panel.dates[rows])[first_row]
+    cutoff = timestamp_ns(min_date) + MAX_START_DELAY.value
+    return any_return & (first_date <= cutoff)
+
+
+def pairwise_correlation(y, X):
+    """
+    Pearson correlation of y with every column of X over pairwise-complete rows.
+
+    :param y: length-T vector, NaN where missing
+    :param X: T x N matrix, NaN where missing
+    :return: length-N vector, NaN where fewer than two common rows or zero variance
+    """
+    y_valid = ~np.isnan(y)
+    y = y[y_valid]
+    X = X[y_valid]
+    out = np.full(X.shape[1], np.nan)
+
+    for start in range(0, X.shape[1], COLUMN_CHUNK):
+        chunk = X[:, start:start + COLUMN_CHUNK]
+        both = ~np.isnan(chunk)
+        n = both.sum(axis=0)
+
+        x0 = np.where(both, chunk, 0.0)
+        y0 = np.where(both, y[:, None], 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            dx = np.where(both, x0 - x0.sum(axis=0) / n, 0.0)
+            dy = np.where(both, y0 - y0.sum(axis=0) / n, 0.0)
+            corr = (dx * dy).sum(axis=0) / np.sqrt((dx * dx).sum(axis=0) * (dy * dy).sum(axis=0))
+        corr[n < 2] = np.nan
+        out[start:start + COLUMN_CHUNK] = corr
+
+    return out
+
+
+def top_correlations(panel, stock_to_compare, num_stocks, min_date, max_date, tickers=None):
+    """
+    Rank the panel's tickers by correlation of daily returns with stock_to_compare.
+
+    Same semantics as find_top_correlations: returns are taken within the window, each pair uses
+    the dates both tickers traded, and tickers starting more than 5 days after min_date are skipped.
+
+    :param panel: PricePanel
+    :param tickers: optional universe to restrict the comparison to
+    :return: list of (TICKER, correlation), highest first
+    """
+    target = panel.column(stock_to_compare)
+    if target is None:
+        raise ValueError(f"Error: {stock_to_compare} data could not be loaded.")
+
+    rows, returns = window_returns(panel, min_date, max_date)
+    corr = pairwise_correlation(returns[:, target], returns)
+
+    keep = eligible_columns(panel, rows, returns, min_date) & ~np.isnan(corr)
+    keep[target] = False
+    if tickers is not None:
+        universe = {t.lower() for t in tickers}
+        keep &= np.array([t in universe for t in panel.tickers], dtype=bool)
+
+    candidates = np.nonzero(keep)[0]
+    if len(candidates) > num_stocks > 0:
+        # O(N) selection of the top N, then sort only those
+        candidates = candidates[np.argpartition(-corr[candidates], num_stocks - 1)[:num_stocks]]
+    candidates = candidates[np.argsort(-corr[candidates], kind="stable")][:max(num_stocks, 0)]
+
+    return [(panel.tickers[j].upper(), float(corr[j])) for j in candidates]
@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from correlation_engine import eligible_columns, window_returns
+from price_panel import PANEL_DIR, open_panel
+
+MATRIX_DIR = os.environ.get("STONKS_MATRIX_DIR", os.path.join(os.path.expanduser("~"), ".stonks", "matrix"))
+BLOCK_SIZE = 512
+DEFAULT_TOP_K = 50
+
+
+def _block_stats(returns, cols):
+    """Zero-filled values, their squares and the float validity mask of a column block."""
+    block = returns[:, cols]
+    mask = ~np.isnan(block)
+    values = np.where(mask, block, 0.0)
+    return values, values * values, mask.astype("float64")
+
+
+def correlation_block(a, b):
+    """
+    Pairwise-complete Pearson correlation between every column of block a and every column of block b.
+
+    Each argument is the (values, squares, mask) triple of _block_stats. All sums over the dates
+    both tickers traded come out of six matrix products, so the work runs in BLAS.
+
+    :return: a x b float64 array, NaN where fewer than two common dates or zero variance
+    """
+    xa, xxa, ma = a
+    xb, xxb, mb = b
+    n = ma.T @ mb
+    sx = xa.T @ mb
+    sy = ma.T @ xb
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = xa.T @ xb - sx * sy / n
+        var_x = xxa.T @ mb - sx * sx / n
+        var_y = ma.T @ xxb - sy * sy / n
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[n < 2] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def compute_matrix(min_date, max_date, out_dir=MATRIX_DIR, panel_dir=PANEL_DIR, top_k=DEFAULT_TOP_K,
+                   block_size=BLOCK_SIZE, max_workers=None, name=None):
+    """
+    Compute the all-pairs correlation of daily returns over [min_date, max_date].
+
+    The matrix is built one row strip of block_size tickers at a time, so memory stays at a few
+    strips regardless of the universe size, and strips are computed on a thread pool (numpy
+    releases the GIL inside the matrix products). Pairs follow find_top_correlations: returns are
+    taken within the window, each pair uses the dates both traded, and tickers starting more than
+    5 days after min_date are left out.
+
+    :param top_k: keep only the K highest correlations per ticker (sparse form); 0 writes the dense matrix
+    :param name: artifact folder name, defaults to a timestamp
+    :return: path of the artifact folder
+    """
+    start = time.monotonic()
+    panel = open_panel(panel_dir)
+    rows, returns = window_returns(panel, min_date, max_date)
+    keep = np.nonzero(eligible_columns(panel, rows, returns, min_date))[0]
+    returns = returns[:, keep]
+    tickers = [panel.tickers[j] for j in keep]
+    n = len(tickers)
+
+    path = os.path.join(out_dir, name or f"matrix-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(path, exist_ok=True)
+
+    if n == 0:
+        print(f"[WARN] No ticker has returns between {min_date} and {max_date}; writing an empty matrix")
+    # With fewer than two tickers there is nothing to rank, so the (empty or 1 x 1) dense form is stored
+    top_k = max(0, min(top_k, n - 1)) if top_k else 0
+    if top_k:
+        index_out = np.lib.format.open_memmap(os.path.join(path, "topk_index.npy"), mode="w+",
+                                              dtype="int32", shape=(n, top_k))
+        value_out = np.lib.format.open_memmap(os.path.join(path, "topk_value.npy"), mode="w+",
+                                              dtype="float32", shape=(n, top_k))
+    else:
+        dense_out = np.lib.format.open_memmap(os.path.join(path, "corr.npy"), mode="w+",
+                                              dtype="float32", shape=(n, n))
+
+    blocks = [slice(lo, min(lo + block_size, n)) for lo in range(0, n, block_size)]
+
+    def compute_strip(rows_block):
+        a = _block_stats(returns, rows_block)
+        strip = np.empty((rows_block.stop - rows_block.start, n))
+        for cols_block in blocks:
+            strip[:, cols_block] = correlation_block(a, _block_stats(returns, cols_block))
+
+        if not top_k:
+            dense_out[rows_block] = strip
+            return
+        # A ticker is not its own neighbour, and missing pairs rank last
+        strip[np.arange(strip.shape[0]), np.arange(rows_block.start, rows_block.stop)] = np.nan
+        ranked = np.where(np.isnan(strip), -np.inf, strip)
+        top = np.argpartition(-ranked, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-np.take_along_axis(ranked, top, axis=1), axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        index_out[rows_block] = top
+        value_out[rows_block] = np.take_along_axis(strip, top, axis=1)
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        list(executor.map(compute_strip, blocks))
+
+    for array in ((index_out, value_out) if top_k else (dense_out,)):
+        array.flush()
+
+    meta = {"min_date": str(min_date), "max_date": str(max_date), "top_k": top_k,
+            "tickers": n, "panel": os.path.basename(panel.path)}
+    with open(os.path.join(path, "tickers.json"), "w") as f:
+        json.dump(tickers, f)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Correlation matrix of {n} tickers in {time.monotonic() - start:.1f}s: {path}")
+    return path
+
+
+class CorrelationMatrix:
+    """Read-only, memory-mapped view of an artifact written by compute_matrix."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "tickers.json"), "r") as f:
+            self.tickers = json.load(f)
+        self.ticker_index = {t: j for j, t in enumerate(self.tickers)}
+        if self.meta["top_k"]:
+            self.top_index = np.load(os.path.join(path, "topk_index.npy"), mmap_mode="r")
+            self.top_value = np.load(os.path.join(path, "topk_value.npy"), mmap_mode="r")
+        else:
+            self.corr = np.load(os.path.join(path, "corr.npy"), mmap_mode="r")
+
+    def correlation(self, ticker_a, ticker_b):
+        """Correlation of one pair, or None if it was not kept."""
+        i = self.ticker_index.get(ticker_a.lower())
+        j = self.ticker_index.get(ticker_b.lower())
+        if i is None or j is None:
+            return None
+        if not self.meta["top_k"]:
+            value = float(self.corr[i, j])
+            return None if np.isnan(value) else value
+        hits = np.nonzero(self.top_index[i] == j)[0]
+        return float(self.top_value[i, hits[0]]) if len(hits) else None
+
+    def top(self, ticker, num_stocks=10):
+        """
+        Highest correlations of a ticker.
+
+        :return: list of (TICKER, correlation), highest first, or None if the ticker is not in the matrix
+        """
+        i = self.ticker_index.get(ticker.lower())
+        if i is None:
+            return None
+        if self.meta["top_k"]:
+            index, value = self.top_index[i, :num_stocks], self.top_value[i, :num_stocks]
+        else:
+            row = np.array(self.corr[i], dtype="float64")
+            row[i] = np.nan
+            candidates = np.nonzero(~np.isnan(row))[0]
+            index = candidates[np.argsort(-row[candidates], kind="stable")][:num_stocks]
+            value = row[index]
+        return [(self.tickers[j].upper(), float(v)) for j, v in zip(index, value) if not np.isnan(v)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute the all-pairs return correlation matrix from the price panel.")
+    parser.add_argument("-min_date", type=str, required=True, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("-max_date", type=str, required=True, help="End date (YYYY-MM-DD)")
+    parser.add_argument("-top_k", type=int, default=DEFAULT_TOP_K, help="Correlations kept per ticker (0 for the dense matrix)")
+    parser.add_argument("-panel", type=str, default=PANEL_DIR, help="Price panel folder")
+    parser.add_argument("-out", type=str, default=MATRIX_DIR, help="Output folder")
+    parser.add_argument("-block", type=int, default=BLOCK_SIZE, help="Tickers per block")
+    parser.add_argument("-workers", type=int, help="Number of blocks computed concurrently (default: CPU count)")
+
+    args = parser.parse_args()
+    compute_matrix(args.min_date, args.max_date, args.out, args.panel, args.top_k, args.block, args.workers)
@@ -0,0 +1,128 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to keep workers inside the provider's request quota."""
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: tokens (requests) added per second
+        :param capacity: maximum burst size, defaults to one second worth of tokens
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DownloadStats:
+    """Per-ticker timings and failures collected while a pool runs."""
+
+    def __init__(self):
+        self.timings = {}
+        self.failures = {}
+        self.started = time.monotonic()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def record(self, ticker, seconds, error=None):
+        with self.lock:
+            self.timings[ticker] = seconds
+            if error is not None:
+                self.failures[ticker] = error
+
+    @property
+    def succeeded(self):
+        return len(self.timings) - len(self.failures)
+
+    def report(self):
+        """Print a summary of the run: counts, wall time and the latency distribution."""
+        elapsed = (self.finished or time.monotonic()) - self.started
+        print(f"\nDownloaded {self.succeeded} tickers, {len(self.failures)} failed, in {elapsed:.1f}s")
+
+        if self.timings:
+            durations = sorted(self.timings.values())
+            p50 = durations[len(durations) // 2]
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            print(f"Per-ticker time: mean {sum(durations) / len(durations):.2f}s, "
+                  f"p50 {p50:.2f}s, p95 {p95:.2f}s, max {durations[-1]:.2f}s")
+
+            slowest = sorted(self.timings.items(), key=lambda x: x[1], reverse=True)[:5]
+            print("Slowest: " + ", ".join(f"{t} ({s:.2f}s)" for t, s in slowest))
+
+        for ticker, error in sorted(self.failures.items()):
+            print(f"  FAILED {ticker}: {error}")
+
+
+def retry_with_backoff(func, retries=3, base_delay=1.0, max_delay=60.0):
+    """
+    Call func() until it returns True, sleeping base_delay * 2**attempt (with jitter) between attempts.
+
+    :return: the result of the last attempt
+    """
+    ok = False
+    for attempt in range(retries + 1):
+        if attempt:
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+        ok = func()
+        if ok:
+            break
+    return ok
+
+
+def run_pool(tickers, worker, max_workers=1, checkpoint=None):
+    """
+    Run worker(ticker) for every ticker on a bounded thread pool.
+
+    The worker returns True on success and False (after printing its own warning) on failure;
+    an exception raised by the worker is also counted as a failure.
+
+    :param tickers: iterable of ticker symbols
+    :param worker: callable taking a single ticker
+    :param max_workers: maximum number of concurrent workers
+    :param checkpoint: optional Checkpoint updated as each ticker finishes
+    :return: DownloadStats for the run
+    """
+    stats = DownloadStats()
+
+    def timed(ticker):
+        start = time.monotonic()
+        try:
+            ok = worker(ticker)
+            error = None if ok else "download failed"
+        except Exception as e:
+            print(f"Error processing {ticker}: {e}")
+            error = str(e)
+        stats.record(ticker, time.monotonic() - start, error)
+        if checkpoint is not None:
+            checkpoint.record(ticker, error)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(timed, ticker) for ticker in tickers]
+        for future in as_completed(futures):
+            future.result()
+
+    stats.finished = time.monotonic()
+    if checkpoint is not None:
+        checkpoint.save()
+    return stats
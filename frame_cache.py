@@ -0,0 +1,77 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+FRAME_CACHE_MB = int(os.environ.get("STONKS_FRAME_CACHE_MB", "512"))
+# pandas 3 always copies on write, so a shallow copy is enough to keep callers off the cached data
+COPY_ON_WRITE = int(pd.__version__.split(".")[0]) >= 3
+
+
+class FrameCache:
+    """
+    In-process LRU cache of prepared price frames, bounded by their memory footprint.
+
+    Keys should carry the stored object's version (ETag or mtime) so a rewritten object is never
+    served from an old entry. Frames are handed out as copies: shallow ones under copy-on-write,
+    so callers can modify what they get without touching the shared entry.
+    """
+
+    def __init__(self, max_mb=FRAME_CACHE_MB):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """A copy of the cached frame, or None on a miss."""
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+        return _hand_out(entry[0])
+
+    def put(self, key, df):
+        """Cache a frame (frames larger than the whole budget are not kept) and return a copy of it."""
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if key in self._frames:
+                self.bytes -= self._frames.pop(key)[1]
+            if size <= self.max_bytes:
+                self._frames[key] = (df, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._frames.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return _hand_out(df)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._frames),
+                "mb": round(self.bytes / (1024 * 1024), 2),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def _hand_out(df):
+    return df.copy(deep=not COPY_ON_WRITE)
+
+
+FRAME_CACHE = FrameCache()
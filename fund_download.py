@@ -1,93 +1,115 @@
 import argparse
 import requests
-import zipfile
-import io
-import pandas as pd
 import json
 import os
-import boto3
 from botocore.exceptions import NoCredentialsError
+from aws_clients import get_s3_client
+from checkpoint import Checkpoint
+from download_pool import retry_with_backoff, run_pool
+from universe import load_universe
 
-def download_fundamental_data(api_token, directory, num_stocks, access_key, secret_key, bucket_name):
-    url = "https://apimedia.tiingo.com/docs/tiingo/daily/supported_tickers.zip"
+CHECKPOINT_NAME = "_checkpoint_fundamentals.json"
 
-    response = requests.get(url)
-    if response.status_code == 200:
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            file_names = z.namelist()
-            with z.open(file_names[0]) as csv_file:
-                df = pd.read_csv(csv_file)
-    else:
-        print(f"Failed to download file: {response.status_code}")
-        return
+def fetch_fundamentals(ticker, api_token, directory, bucket_name, s3):
+    """Download one ticker's daily fundamentals and store them in S3 or locally. Returns True on success."""
+    headers = {'Content-Type': 'application/json'}
 
-    df = df[df['priceCurrency'] == 'USD']
-    df = df[df['exchange'].isin(['NASDAQ', 'NYSE'])]
-    df = df[df['startDate'].notna()]
-    df = df[df['endDate'].notna()]
-    df = df[df['endDate'].str[:4] == '2025']
-    df = df.reset_index(drop=True)
+    try:
+        # Request fundamentals data
+        requestResponse = requests.get(
+            f"https://api.tiingo.com/tiingo/fundamentals/{ticker}/daily?token={api_token}",
+            headers=headers,
+            timeout=10
+        )
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data for {ticker}: {e}")
+        return False
 
-    os.makedirs(directory, exist_ok=True)
+    if requestResponse.status_code != 200:
+        print(f"Warning: API request failed for {ticker}. Status Code: {requestResponse.status_code}")
+        return False
+
+    json_data = requestResponse.json()
+
+    if not json_data:
+        # Nothing to store, but nothing to retry either
+        print(f"No data returned for {ticker}")
+        return True
 
-    for i in range(min(num_stocks, len(df)) if num_stocks != -1 else len(df)):
+    if bucket_name:
+        # Upload to S3 if bucket specified
         try:
-            try:
-                ticker = df['ticker'][i].lower()
-            except:
-                ticker = df['ticker'][i]
-            headers = {'Content-Type': 'application/json'}
-
-            # Request fundamentals data
-            requestResponse = requests.get(
-                f"https://api.tiingo.com/tiingo/fundamentals/{ticker}/daily?token={api_token}",
-                headers=headers,
-                timeout=10
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=f"fundimental_data/{ticker}_data.json",
+                Body=json.dumps(json_data, indent=4),
+                ContentType='application/json'
             )
+            print(f"Successfully uploaded {ticker}_data.json to S3.")
+        except NoCredentialsError:
+            print("Error: AWS credentials not found.")
+            return False
+    else:
+        # Save locally if no bucket
+        with open(os.path.join(directory, f"{ticker}_data.json"), "w") as f:
+            json.dump(json_data, f, indent=4)
+            print(f"Successfully saved {ticker}_data.json locally.")
+
+    return True
+
+def download_fundamental_data(api_token, directory, num_stocks, access_key, secret_key, bucket_name,
+                              resume=False, retries=3, active_as_of=None):
+    os.makedirs(directory, exist_ok=True)
 
-            if requestResponse.status_code != 200:
-                print(f"Warning: API request failed for {ticker}. Status Code: {requestResponse.status_code}")
-                continue
-
-            json_data = requestResponse.json()
-
-            if not json_data:
-                print(f"No data returned for {ticker}")
-                continue
-
-            if bucket_name:
-                # Upload to S3 if bucket specified
-                s3 = boto3.client('s3')
-                try:
-                    s3.put_object(
-                        Bucket=bucket_name,
-                        Key=f"fundimental_data/{ticker}_data.json",
-                        Body=json.dumps(json_data, indent=4),
-                        ContentType='application/json'
-                    )
-                    print(f"Successfully uploaded {ticker}_data.json to S3.")
-                except NoCredentialsError:
-                    print("Error: AWS credentials not found.")
-            else:
-                # Save locally if no bucket
-                with open(os.path.join(directory, f"{ticker}_data.json"), "w") as f:
-                    json.dump(json_data, f, indent=4)
-                    print(f"Successfully saved {ticker}_data.json locally.")
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data for {ticker}: {e}")
-            continue
+    checkpoint_path = os.path.join(directory, CHECKPOINT_NAME)
+    checkpoint = Checkpoint.load(checkpoint_path) if resume else None
+
+    if checkpoint is None:
+        if resume:
+            print(f"No checkpoint found at {checkpoint_path}, starting a full run.")
+
+        tickers = load_universe(active_as_of)
+        if tickers is None:
+            return
+        if num_stocks != -1:
+            tickers = tickers[:num_stocks]
+
+        checkpoint = Checkpoint(checkpoint_path, tickers)
+        checkpoint.save()
+    else:
+        print(f"Resuming from {checkpoint_path}: {len(checkpoint.completed)} of {len(checkpoint.universe)} "
+              f"tickers done, {len(checkpoint.failed)} failed tickers to retry.")
+
+    # Tickers that failed in an earlier run are retried with exponential backoff
+    retry_tickers = set(checkpoint.failed)
+    s3 = get_s3_client() if bucket_name else None
+
+    def worker(ticker):
+        fetch = lambda: fetch_fundamentals(ticker, api_token, directory, bucket_name, s3)
+        if ticker in retry_tickers:
+            return retry_with_backoff(fetch, retries)
+        return fetch()
+
+    stats = run_pool(checkpoint.pending(), worker, checkpoint=checkpoint)
+    stats.report()
+    return stats
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download fundamental stock data from Tiingo.")
     parser.add_argument("-api_token", type=str, required=True, help="API token for authentication")
     parser.add_argument("-dir", type=str, required=True, help="Directory to save data")
     parser.add_argument("-num_stocks", type=int, default=-1, help="Number of stocks to download (-1 for all)")
+    parser.add_argument("-active_as_of", type=str, help="Only tickers with data on or after this date (YYYY-MM-DD, default: Jan 1 of this year)")
 
     # AWS credentials and bucket name (optional)
     parser.add_argument("-access_key", type=str, help="AWS Access Key ID (optional)")
     parser.add_argument("-secret_key", type=str, help="AWS Secret Access Key (optional)")
     parser.add_argument("-bucket", type=str, help="S3 Bucket name (optional)")
 
+    # Checkpointing
+    parser.add_argument("-resume", "--resume", action="store_true", help="Skip tickers finished by the last run and retry its failures")
+    parser.add_argument("-retries", type=int, default=3, help="Retries with exponential backoff for previously failed tickers")
+
     args = parser.parse_args()
-    download_fundamental_data(args.api_token, args.dir, args.num_stocks, args.access_key, args.secret_key, args.bucket)
+    download_fundamental_data(args.api_token, args.dir, args.num_stocks, args.access_key, args.secret_key, args.bucket,
+                              args.resume, args.retries, args.active_as_of)
@@ -0,0 +1,245 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from correlation_engine import eligible_columns, window_returns
+from correlation_matrix import BLOCK_SIZE, _block_stats, correlation_block
+from price_panel import PANEL_DIR, PricePanel, open_panel
+from universe import SECTORS_PATH, sector_tickers
+
+PAIRS_DIR = os.environ.get("STONKS_PAIRS_DIR", os.path.join(os.path.expanduser("~"), ".stonks", "pairs"))
+DEFAULT_MIN_CORRELATION = 0.5
+# Most correlated partners of each ticker that go on to the cointegration test
+DEFAULT_NEIGHBOURS = 5
+DEFAULT_ALPHA = 0.05
+# Pairs need this many common bars in the window to be tested
+MIN_OBSERVATIONS = 100
+# Pairs per process-pool task
+PAIR_CHUNK = 25
+# Workers start from a clean server process rather than a fork of a threaded caller (e.g. the app)
+POOL_CONTEXT = "forkserver"
+
+_worker_panels = {}
+
+
+def candidate_pairs(returns, tickers, min_correlation=DEFAULT_MIN_CORRELATION, neighbours=DEFAULT_NEIGHBOURS,
+                    block_size=BLOCK_SIZE):
+    """
+    Prefilter pairs by correlation of daily returns.
+
+    Each ticker keeps its `neighbours` most correlated partners at or above min_correlation, and
+    a pair survives if either side keeps it. Correlations are computed one row block at a time,
+    as in compute_matrix, so memory stays at a strip even for a large universe.
+
+    :param returns: T x N returns of the candidate tickers, NaN where there is no return
+    :param tickers: the N ticker names
+    :return: dict of (column a, column b) -> correlation, with tickers[a] < tickers[b]
+    """
+    n = len(tickers)
+    pairs = {}
+    blocks = [slice(lo, min(lo + block_size, n)) for lo in range(0, n, block_size)]
+    for rows_block in blocks:
+        a = _block_stats(returns, rows_block)
+        strip = np.empty((rows_block.stop - rows_block.start, n))
+        for cols_block in blocks:
+            strip[:, cols_block] = correlation_block(a, _block_stats(returns, cols_block))
+        strip[np.arange(strip.shape[0]), np.arange(rows_block.start, rows_block.stop)] = np.nan
+        ranked = np.where(np.isnan(strip) | (strip < min_correlation), -np.inf, strip)
+
+        k = min(neighbours, n - 1)
+        if k <= 0:
+            break
+        top = np.argpartition(-ranked, k - 1, axis=1)[:, :k]
+        for offset, partners in enumerate(top):
+            i = rows_block.start + offset
+            for j in partners:
+                if np.isfinite(ranked[offset, j]):
+                    key = (i, j) if tickers[i] < tickers[j] else (j, i)
+                    pairs[key] = float(strip[offset, j])
+    return pairs
+
+
+def half_life(spread):
+    """
+    Mean-reversion half-life of a spread in bars, from regressing its change on its last level.
+
+    :return: half-life, or None if the spread does not revert
+    """
+    lagged = spread[:-1]
+    design = np.column_stack([np.ones(len(lagged)), lagged])
+    (_, slope), *_ = np.linalg.lstsq(design, np.diff(spread), rcond=None)
+    if not slope < 0:
+        return None
+    return float(-np.log(2) / slope)
+
+
+def _open_version(path):
+    # Workers map the exact panel version the scan was planned on, once per process
+    panel = _worker_panels.get(path)
+    if panel is None:
+        panel = _worker_panels[path] = PricePanel(path)
+    return panel
+
+
+def cointegrate_pairs(panel_path, rows, pairs, min_observations=MIN_OBSERVATIONS):
+    """
+    Engle-Granger cointegration test of each pair's closes, as /pairs_trading runs it.
+
+    :param panel_path: panel version folder
+    :param rows: (start, stop) rows of the window
+    :param pairs: list of (column 1, column 2, return correlation); column 1 is the dependent series
+    :return: list of result dicts; pairs with too few common bars or a failed test are left out
+    """
+    from statsmodels.tsa.stattools import coint
+
+    panel = _open_version(panel_path)
+    window = slice(*rows)
+    results = []
+    for col1, col2, correlation in pairs:
+        y = np.asarray(panel.close[window, col1])
+        x = np.asarray(panel.close[window, col2])
+        both = ~np.isnan(y) & ~np.isnan(x)
+        if both.sum() < min_observations:
+            continue
+        y, x = y[both], x[both]
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                t_stat, p_value, _ = coint(y, x)
+        except Exception as e:
+            print(f"Skipping {panel.tickers[col1]}/{panel.tickers[col2]}: {e}")
+            continue
+
+        (_, hedge_ratio), *_ = np.linalg.lstsq(np.column_stack([np.ones(len(x)), x]), y, rcond=None)
+        results.append({
+            "ticker1": panel.tickers[col1].upper(),
+            "ticker2": panel.tickers[col2].upper(),
+            "correlation": correlation,
+            "p_value": float(p_value),
+            "t_stat": float(t_stat),
+            "hedge_ratio": float(hedge_ratio),
+            "half_life": half_life(y - hedge_ratio * x),
+            "observations": int(both.sum())
+        })
+    return results
+
+
+def rank_pairs(results, alpha=DEFAULT_ALPHA):
+    """Cointegrated pairs (p-value below alpha) first, fastest mean reversion first; then the rest by p-value."""
+    for pair in results:
+        pair["cointegrated"] = pair["p_value"] < alpha
+
+    def key(pair):
+        if pair["cointegrated"]:
+            return (0, pair["half_life"] if pair["half_life"] is not None else np.inf, pair["p_value"])
+        return (1, pair["p_value"], 0)
+
+    return sorted(results, key=key)
+
+
+def scan_pairs(min_date, max_date, tickers=None, sector=None, out_dir=PAIRS_DIR, panel_dir=PANEL_DIR,
+               min_correlation=DEFAULT_MIN_CORRELATION, neighbours=DEFAULT_NEIGHBOURS, alpha=DEFAULT_ALPHA,
+               max_workers=None, name=None, sectors_path=SECTORS_PATH):
+    """
+    Find cointegrated pairs in a universe over [min_date, max_date].
+
+    Candidates are prefiltered by correlation of daily returns on the price panel, then each
+    surviving pair gets the Engle-Granger test on a process pool (workers map the same panel
+    version, so its pages are shared). Pairs are named in ticker order and the first ticker is
+    the dependent series, the order /pairs_trading tests ticker 1 against ticker 2 in.
+
+    :param tickers: universe to scan; with neither tickers nor sector the whole panel is scanned
+    :param sector: sector of the sector map (see universe.load_sector_map) to scan
+    :param neighbours: most correlated partners per ticker to test
+    :param max_workers: worker processes (default: CPU count; 1 tests in this process)
+    :param name: result file name, defaults to a timestamp
+    :return: path of the stored result (see load_scan)
+    """
+    start = time.monotonic()
+    panel = open_panel(panel_dir)
+    rows, returns = window_returns(panel, min_date, max_date)
+    keep = eligible_columns(panel, rows, returns, min_date)
+
+    if sector:
+        tickers = (tickers or []) + sector_tickers(sector, sectors_path)
+        if not tickers:
+            raise ValueError(f"No tickers found for sector '{sector}'")
+    if tickers:
+        universe = {t.lower().strip() for t in tickers}
+        keep &= np.array([t in universe for t in panel.tickers], dtype=bool)
+    columns = np.nonzero(keep)[0]
+    names = [panel.tickers[j] for j in columns]
+
+    candidates = candidate_pairs(returns[:, columns], names, min_correlation, neighbours)
+    pairs = [(int(columns[a]), int(columns[b]), corr) for (a, b), corr in sorted(candidates.items())]
+    chunks = [pairs[i:i + PAIR_CHUNK] for i in range(0, len(pairs), PAIR_CHUNK)]
+    window = (rows.start, rows.stop)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    results = []
+    if max_workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            results += cointegrate_pairs(panel.path, window, chunk)
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(chunks)),
+                                 mp_context=multiprocessing.get_context(POOL_CONTEXT)) as executor:
+            for chunk_results in executor.map(cointegrate_pairs, [panel.path] * len(chunks), [window] * len(chunks), chunks):
+                results += chunk_results
+
+    ranked = rank_pairs(results, alpha)
+    meta = {"min_date": str(min_date), "max_date": str(max_date), "sector": sector, "tickers": len(names),
+            "candidates": len(pairs), "tested": len(results), "cointegrated": sum(p["cointegrated"] for p in ranked),
+            "min_correlation": min_correlation, "neighbours": neighbours, "alpha": alpha,
+            "panel": os.path.basename(panel.path), "seconds": round(time.monotonic() - start, 3)}
+
+    os.makedirs(out_dir, exist_ok=True)
+    name = name or f"pairs-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(out_dir, f"{name}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"meta": meta, "pairs": ranked}, f)
+    os.replace(tmp_path, path)
+
+    print(f"Tested {len(results)} pairs of {len(names)} tickers in {meta['seconds']:.1f}s: "
+          f"{meta['cointegrated']} cointegrated, {path}")
+    return path
+
+
+def load_scan(name, out_dir=PAIRS_DIR):
+    """Stored scan result {"meta", "pairs"} by name (or file name) in out_dir, or None if there is none."""
+    name = os.path.basename(name)
+    path = os.path.join(out_dir, name if name.endswith(".json") else f"{name}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan a universe for cointegrated pairs.")
+    parser.add_argument("-min_date", type=str, required=True, help="Window start (YYYY-MM-DD)")
+    parser.add_argument("-max_date", type=str, required=True, help="Window end (YYYY-MM-DD)")
+    parser.add_argument("-tickers", nargs="+", help="Tickers to scan")
+    parser.add_argument("-sector", type=str, help="Sector of the sector map to scan")
+    parser.add_argument("-panel_dir", type=str, default=PANEL_DIR, help="Price panel folder")
+    parser.add_argument("-out", type=str, default=PAIRS_DIR, help="Result folder")
+    parser.add_argument("-min_correlation", type=float, default=DEFAULT_MIN_CORRELATION, help="Prefilter threshold")
+    parser.add_argument("-neighbours", type=int, default=DEFAULT_NEIGHBOURS, help="Partners tested per ticker")
+    parser.add_argument("-alpha", type=float, default=DEFAULT_ALPHA, help="Cointegration p-value threshold")
+    parser.add_argument("-workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("-top", type=int, default=20, help="Pairs to print")
+
+    args = parser.parse_args()
+    path = scan_pairs(args.min_date, args.max_date, args.tickers, args.sector, args.out, args.panel_dir,
+                      args.min_correlation, args.neighbours, args.alpha, args.workers)
+    for pair in load_scan(path, args.out)["pairs"][:args.top]:
+        half = "n/a" if pair["half_life"] is None else f"{pair['half_life']:.1f}"
+        print(f"{pair['ticker1']}/{pair['ticker2']}: p={pair['p_value']:.4f}, half-life={half} days, "
+              f"hedge={pair['hedge_ratio']:.3f}, corr={pair['correlation']:.3f}")
@@ -0,0 +1,390 @@
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from aws_clients import get_s3_client
+from price_store import load_prices
+from schedules import normalize_rule, rule_transactions
+from transaction_logger import load_transactions
+
+S3_BUCKET = 'stonks-1'
+# A trade on a day without a bar fills at the next bar up to this many days later
+MAX_FILL_DAYS = 10
+DAY_NS = 24 * 60 * 60 * 10**9
+PRICE_COLUMNS = ['open', 'close', 'cumulativeFactor']
+# Expanded rule schedules kept in memory, keyed by rule and price data version
+SCHEDULE_CACHE_SIZE = 256
+
+_schedules = OrderedDict()
+_schedules_lock = threading.Lock()
+
+# transactions: the file as loaded; ledger: one dict per transaction, in file order (trades carry
+# the running totals, rejected transactions an "error" message); daily: Date / Total Invested /
+# Total Money per calendar day; holdings: final position per stock
+PortfolioResult = namedtuple(
+    "PortfolioResult",
+    ["transactions", "ledger", "daily", "holdings", "cash", "total_input", "total_value"]
+)
+
+
+def _trade_days_ns(trade_dates):
+    """Calendar day of each trade date string, as int64 ns at midnight."""
+    try:
+        parsed = pd.DatetimeIndex(pd.to_datetime(list(trade_dates), format="mixed"))
+        if parsed.tz is not None:
+            parsed = parsed.tz_localize(None)
+    except (ValueError, TypeError):
+        # Mixed time zones do not fit one index, parse them one by one
+        parsed = pd.DatetimeIndex([pd.to_datetime(d).strftime('%Y-%m-%d') for d in trade_dates])
+    return parsed.normalize().as_unit("ns").asi8
+
+
+def resolve_trade_dates(dates, trade_dates, max_days=MAX_FILL_DAYS):
+    """
+    Row of the first bar on or after each trade date, at most max_days later.
+
+    Bars are matched on whole days (midnight UTC timestamps), and all trade dates are looked up
+    with one searchsorted over the sorted bar dates. Equal dates resolve to the earliest row.
+
+    :param dates: UTC 'date' column of a price frame
+    :param trade_dates: trade date strings
+    :param max_days: days after the trade date to look for a bar
+    :return: int64 array of row positions in the frame, -1 where no bar falls in the window
+    """
+    targets = _trade_days_ns(trade_dates)
+    bar_ns = dates.to_numpy(dtype="datetime64[ns]").astype("int64")
+    midnight = np.flatnonzero(bar_ns % DAY_NS == 0)
+    order = midnight[np.argsort(bar_ns[midnight], kind="stable")]
+    sorted_ns = bar_ns[order]
+    if len(sorted_ns) == 0:
+        return np.full(len(targets), -1, dtype="int64")
+
+    pos = np.searchsorted(sorted_ns, targets, side="left")
+    clipped = np.minimum(pos, len(sorted_ns) - 1)
+    found = (pos < len(sorted_ns)) & (sorted_ns[clipped] <= targets + max_days * DAY_NS)
+    return np.where(found, order[clipped], -1)
+
+
+def resolve_trades(transactions, frames):
+    """
+    Row of each transaction's bar in its stock's price frame, one batched lookup per stock.
+
+    :param transactions: list of transaction dicts
+    :param frames: tx['stock'] -> price frame
+    :return: list of row positions, -1 where no bar is within MAX_FILL_DAYS
+    """
+    by_stock = {}
+    for i, tx in enumerate(transactions):
+        by_stock.setdefault(tx['stock'], []).append(i)
+
+    rows = [-1] * len(transactions)
+    for stock, indices in by_stock.items():
+        found = resolve_trade_dates(frames[stock]['date'], [transactions[i]['date'] for i in indices])
+        for i, row in zip(indices, found.tolist()):
+            rows[i] = row
+    return rows
+
+
+def daily_portfolio_values(trades, frames, date_range):
+    """
+    Total Invested and Total Money on every day of date_range, computed as one sweep.
+
+    Trades apply on the calendar day of their Date, in date order. Holdings are a cumulative sum
+    of each stock's split-adjusted quantity changes, and each day is valued at the stock's last
+    bar on or before it (forward filled onto the grid with searchsorted), so the cost is
+    O(days x stocks) array work instead of a frame filter per day and stock.
+
+    :param trades: executed trades with Date (UTC), Buy Date, Stock, Action, Quantity and Price columns
+    :param frames: lower-case stock -> price frame with date, adjustedOpen and cumulativeFactor
+    :param date_range: daily UTC DatetimeIndex to value
+    :return: (total invested, total money) arrays aligned with date_range
+    """
+    n_days = len(date_range)
+    trades = trades.sort_values("Date", kind="stable")
+    first_day = date_range[0].normalize().value
+    trade_day = (trades["Date"].dt.normalize().to_numpy(dtype="datetime64[ns]").astype("int64") - first_day) // DAY_NS
+    # A trade only counts once the sweep reaches its day
+    applied = trade_day < n_days
+    grid_ns = date_range.as_unit("ns").asi8
+    bar_dates = {stock: df["date"].to_numpy(dtype="datetime64[ns]") for stock, df in frames.items()}
+
+    # Cash and total invested change trade by trade and carry over to the following days
+    cash_after = np.zeros(len(trades))
+    input_after = np.zeros(len(trades))
+    cash = 0.0
+    total_input = 0.0
+    deltas = {stock: np.zeros(n_days) for stock in frames}
+    for i, (stock, action, quantity, price, buy_date, day) in enumerate(zip(
+            trades["Stock"].str.lower(), trades["Action"], trades["Quantity"], trades["Price"],
+            trades["Buy Date"], trade_day)):
+        if not applied[i]:
+            break
+        # Factor of the trade's bar (the last bar on or before the buy date)
+        bar = np.searchsorted(bar_dates[stock], np.datetime64(buy_date, "ns"), side="right") - 1
+        factor = frames[stock]["cumulativeFactor"].iloc[bar]
+        total_cost = price * quantity
+        if action == "buy":
+            if total_cost > cash:
+                total_input += total_cost - cash
+                cash = 0
+            else:
+                cash -= total_cost
+            deltas[stock][day] += quantity * factor
+        elif action == "sell":
+            cash += total_cost
+            deltas[stock][day] -= quantity * factor
+        cash_after[i] = cash
+        input_after[i] = total_input
+
+    # State after the last trade on or before each day
+    last_trade = np.searchsorted(trade_day[applied], np.arange(n_days), side="right") - 1
+    traded = last_trade >= 0
+    cash_daily = np.where(traded, cash_after[last_trade], 0.0)
+    invested_daily = np.where(traded, input_after[last_trade], 0.0)
+
+    portfolio = np.zeros(n_days)
+    for stock, df in frames.items():
+        bar = np.searchsorted(bar_dates[stock].astype("int64"), grid_ns, side="right") - 1
+        has_bar = bar >= 0
+        bar = np.maximum(bar, 0)
+        adj_qty = np.cumsum(deltas[stock])
+        prices = df["adjustedOpen"].to_numpy(dtype="float64")[bar]
+        factors = df["cumulativeFactor"].to_numpy(dtype="float64")[bar]
+        portfolio += np.where(has_bar, adj_qty / factors * prices, 0.0)
+
+    return invested_daily, portfolio + cash_daily
+
+
+def _data_version(df):
+    """Version of the data behind a price frame: the stored object's version when load_prices set it."""
+    version = df.attrs.get("version")
+    if version is None:
+        version = (len(df), str(df['date'].iloc[-1]) if len(df) else None)
+    return version
+
+
+def rule_schedule(rule, df):
+    """
+    Transactions of a normalized rule over df, memoized per rule and price data version.
+
+    New bars change the data version, so open-ended rules extend as data arrives.
+    """
+    key = (json.dumps(rule, sort_keys=True), _data_version(df))
+    with _schedules_lock:
+        cached = _schedules.get(key)
+        if cached is not None:
+            _schedules.move_to_end(key)
+            return list(cached)
+
+    transactions = rule_transactions(rule, df)
+    with _schedules_lock:
+        _schedules[key] = transactions
+        while len(_schedules) > SCHEDULE_CACHE_SIZE:
+            _schedules.popitem(last=False)
+    return list(transactions)
+
+
+def transaction_stock(tx):
+    """Stock a transactions file entry needs prices for; None for a rule reference that is not a valid rule."""
+    if "rule" not in tx:
+        return tx['stock']
+    try:
+        return normalize_rule(tx["rule"])["stock"]
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def _date_order(transactions):
+    """Stable order of transactions by parsed date (UTC); unparseable dates go last."""
+    dates = pd.to_datetime([str(tx.get('date')) for tx in transactions], utc=True, format="mixed", errors="coerce")
+    keys = np.where(dates.isna(), np.iinfo("int64").max, dates.as_unit("ns").asi8)
+    return [transactions[i] for i in np.argsort(keys, kind="stable")]
+
+
+def expand_rules(transactions, frames):
+    """
+    Transactions with each rule reference ({"rule": {...}}) replaced by the buys it schedules.
+
+    Rules are expanded at evaluation time instead of being stored as transaction lists, so they
+    never go stale. A file with rule references is replayed in date order (stable), so rule buys
+    interleave with the file's own trades; files without any are returned unchanged. A reference
+    that is not a valid rule is kept, with an "error" message, for the ledger to report.
+
+    :param transactions: transactions file entries
+    :param frames: stock -> price frame with date and close (rule stocks in lower case)
+    """
+    if not any("rule" in tx for tx in transactions):
+        return transactions
+    expanded = []
+    for tx in transactions:
+        if "rule" in tx:
+            try:
+                rule = normalize_rule(tx["rule"])
+            except (ValueError, TypeError, AttributeError) as e:
+                expanded.append(dict(tx, error=f"Invalid rule {tx['rule']}: {e}"))
+                continue
+            expanded += rule_schedule(rule, frames[rule["stock"]])
+        else:
+            expanded.append(tx)
+    return _date_order(expanded)
+
+
+def build_portfolio(transactions, frames):
+    """
+    Replay a transactions file once: the trade ledger, the daily equity curve and final holdings.
+
+    Buys draw on cash first and count the rest as money invested; sells add to cash. Quantities
+    are tracked split-adjusted (quantity x cumulativeFactor of the trade's bar), so splits between
+    trades are accounted for.
+
+    :param transactions: list of {stock, date, action, quantity} dicts or rule references, in file order
+    :param frames: stock (see transaction_stock) -> price frame with date, open, close and cumulativeFactor
+    :return: PortfolioResult, whose transactions are the entries as given
+    """
+    file_entries = transactions
+    transactions = expand_rules(transactions, frames)
+    holdings = {}
+    for tx in transactions:
+        if "error" in tx:
+            continue
+        stock = tx['stock']
+        if stock not in holdings:
+            df = frames[stock]
+            df['adjustedOpen'] = df['open']
+            holdings[stock] = {
+                'adj_quantity': 0.0,
+                'df': df,
+                'prices': df['adjustedOpen'].to_numpy(),
+                'factors': df['cumulativeFactor'].to_numpy(),
+                'dates': df['date']
+            }
+
+    rows = iter(resolve_trades([tx for tx in transactions if "error" not in tx],
+                               {stock: data['df'] for stock, data in holdings.items()}))
+
+    cash = 0.0
+    total_input = 0.0
+    ledger = []
+    for tx in transactions:
+        if "error" in tx:
+            ledger.append({"date": tx.get('date'), "stock": None, "action": "rule", "quantity": None,
+                           "error": tx["error"]})
+            continue
+        row = next(rows)
+        stock = tx['stock']
+        date = tx['date']
+        action = tx['action'].lower()
+        quantity = tx['quantity']
+        entry = {"date": date, "stock": stock.upper(), "action": action, "quantity": quantity}
+        ledger.append(entry)
+
+        if row < 0:
+            entry["error"] = f"No data for {stock} from {date} within {MAX_FILL_DAYS} days"
+            continue
+
+        price = holdings[stock]['prices'][row]
+        factor = holdings[stock]['factors'][row]
+        raw_qty = holdings[stock]['adj_quantity'] / factor
+
+        if action == 'buy':
+            total_cost = price * quantity
+            if total_cost > cash:
+                total_input += total_cost - cash
+                cash = 0
+            else:
+                cash -= total_cost
+            holdings[stock]['adj_quantity'] += quantity * factor
+
+        elif action == 'sell':
+            if quantity > raw_qty:
+                entry["error"] = f"Cannot sell {quantity} shares of {stock.upper()} on {date}; only {raw_qty:.2f} available."
+                continue
+            cash += price * quantity
+            holdings[stock]['adj_quantity'] -= quantity * factor
+
+        else:
+            entry["error"] = f"Invalid action '{action}' for {stock.upper()} on {date}."
+            continue
+
+        raw_holdings = holdings[stock]['adj_quantity'] / factor
+        entry.update({
+            # Day of the bar the trade filled at
+            "buy_date": holdings[stock]['dates'].iloc[row].strftime('%Y-%m-%d'),
+            "price": float(price),
+            "total_stocks": float(raw_holdings),
+            "total_stock_value": float(raw_holdings * price),
+            "total_cash": float(cash),
+            "total_invested": float(total_input),
+            "unadjusted": float(holdings[stock]['adj_quantity'])
+        })
+
+    final_holdings = []
+    total_value = 0.0
+    for stock, data in holdings.items():
+        last_price = float(data['prices'][-1])
+        holding_value = data['adj_quantity'] * last_price
+        total_value += holding_value
+        final_holdings.append({"stock": stock.upper(), "shares": data['adj_quantity'],
+                               "price": last_price, "value": holding_value})
+
+    return PortfolioResult(file_entries, ledger, _daily_curve(ledger, holdings), final_holdings,
+                           cash, total_input, total_value)
+
+
+def _daily_curve(ledger, holdings):
+    trades = pd.DataFrame(
+        [[e["date"], e["buy_date"], e["stock"], e["action"], e["quantity"], e["price"]]
+         for e in ledger if "error" not in e],
+        columns=["Date", "Buy Date", "Stock", "Action", "Quantity", "Price"]
+    )
+    if trades.empty:
+        return pd.DataFrame(columns=["Date", "Total Invested", "Total Money"])
+    trades["Date"] = pd.to_datetime(trades["Date"], utc=True)
+
+    start_date = trades["Date"].min()
+    end_date = max(data['df']["date"].max() for data in holdings.values())
+    date_range = pd.date_range(start=start_date, end=end_date, freq="D")
+    frames = {stock.lower(): data['df'] for stock, data in holdings.items()}
+    invested, money = daily_portfolio_values(trades, frames, date_range)
+    return pd.DataFrame({"Date": date_range, "Total Invested": invested, "Total Money": money})
+
+
+def result_to_dict(result):
+    """JSON-ready form of a PortfolioResult (dates of the daily curve as YYYY-MM-DD)."""
+    daily = result.daily
+    return {
+        "ledger": result.ledger,
+        "holdings": result.holdings,
+        "cash": result.cash,
+        "total_invested": result.total_input,
+        "total_value": result.total_value,
+        "total_money": result.total_value + result.cash,
+        "daily": [
+            {"date": date.strftime('%Y-%m-%d'), "total_invested": float(invested), "total_money": float(money)}
+            for date, invested, money in zip(daily["Date"], daily["Total Invested"], daily["Total Money"])
+        ]
+    }
+
+
+def load_portfolio(transactions_key, bucket_name=S3_BUCKET, s3=None):
+    """
+    Load a transactions file and the price history of each of its stocks once, and replay it.
+
+    Rule references in the file are expanded against the freshly loaded prices.
+
+    :param transactions_key: key of the transactions file in S3
+    :param bucket_name: bucket holding the transactions file and price objects
+    :param s3: boto3 S3 client (the shared one if omitted)
+    :return: PortfolioResult
+    """
+    s3 = s3 or get_s3_client()
+    transactions = load_transactions(bucket_name, transactions_key)
+    frames = {}
+    for tx in transactions:
+        stock = transaction_stock(tx)
+        if stock is not None and stock not in frames:
+            frames[stock] = load_prices(stock, columns=PRICE_COLUMNS, bucket_name=bucket_name, s3=s3)
+    return build_portfolio(transactions, frames)
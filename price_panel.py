@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from aws_clients import get_s3_client
+from price_store import S3_BUCKET, list_tickers, load_prices
+
+PANEL_DIR = os.environ.get("STONKS_PANEL_DIR", os.path.join(os.path.expanduser("~"), ".stonks", "panel"))
+CURRENT_NAME = "CURRENT"
+KEEP_VERSIONS = 2
+
+_open_panels = {}
+_open_lock = threading.Lock()
+
+
+class PricePanel:
+    """
+    Dense date x ticker panel of closes and daily returns, memory-mapped read-only.
+
+    close[t, j] is ticker j's split-adjusted close on dates[t] (adjClose / cumulativeFactor, the
+    series the correlation scanner works on), returns[t, j] its change since ticker j's previous
+    bar and valid[t, j] whether ticker j traded on dates[t]. Every array is an np.memmap, so
+    processes opening the same panel share its pages through the OS page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "tickers.json"), "r") as f:
+            self.tickers = json.load(f)
+        self.ticker_index = {t: j for j, t in enumerate(self.tickers)}
+        self.dates = np.load(os.path.join(path, "dates.npy"), mmap_mode="r")
+        self.close = np.load(os.path.join(path, "close.npy"), mmap_mode="r")
+        self.returns = np.load(os.path.join(path, "returns.npy"), mmap_mode="r")
+        self.valid = np.load(os.path.join(path, "valid.npy"), mmap_mode="r")
+
+    def date_slice(self, min_date, max_date):
+        """Row slice covering min_date <= date <= max_date (both inclusive)."""
+        lo = np.searchsorted(self.dates, timestamp_ns(min_date), side="left")
+        hi = np.searchsorted(self.dates, timestamp_ns(max_date), side="right")
+        return slice(lo, hi)
+
+    def column(self, ticker):
+        """Column index of a ticker, or None if it is not in the panel."""
+        return self.ticker_index.get(ticker.lower())
+
+    def date_index(self, rows=slice(None)):
+        return pd.DatetimeIndex(np.asarray(self.dates[rows]).astype("datetime64[ns]")).tz_localize("UTC")
+
+
+def timestamp_ns(value):
+    """Nanoseconds since the epoch for a date string or Timestamp, naive values taken as UTC."""
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("UTC")
+    return ts.value
+
+
+def _load_close(ticker, directory, bucket_name, s3):
+    try:
+        df = load_prices(ticker, columns=["adjClose", "cumulativeFactor"], directory=directory,
+                         bucket_name=bucket_name, s3=s3)
+    except Exception as e:
+        print(f"Skipping {ticker}: {e}")
+        return None
+    if df.empty or "adjClose" not in df.columns or "cumulativeFactor" not in df.columns:
+        return None
+    dates = df["date"].to_numpy(dtype="datetime64[ns]").astype("int64")
+    close = df["adjClose"].to_numpy(dtype="float64") / df["cumulativeFactor"].to_numpy(dtype="float64")
+    return dates, close
+
+
+def build_panel(out_dir=PANEL_DIR, directory=None, bucket_name=S3_BUCKET, tickers=None, s3=None, max_workers=8):
+    """
+    Build a new panel version from the price store and make it current.
+
+    Versions live in their own folder and the CURRENT file is switched atomically, so readers
+    that already mapped the previous version keep working.
+
+    :param out_dir: panel root folder
+    :param directory: local price folder (S3 is used when omitted)
+    :param bucket_name: S3 bucket holding stock_data/
+    :param tickers: tickers to include, defaults to every stored ticker
+    :param max_workers: concurrent loaders
+    :return: path of the new panel version
+    """
+    start = time.monotonic()
+    os.makedirs(out_dir, exist_ok=True)
+    if directory is None:
+        s3 = s3 or get_s3_client()
+    if tickers is None:
+        tickers = list_tickers(directory, bucket_name, s3)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        loaded = list(executor.map(lambda t: _load_close(t, directory, bucket_name, s3), tickers))
+    series = [(t.lower(), s) for t, s in zip(tickers, loaded) if s is not None and len(s[0])]
+
+    dates = np.unique(np.concatenate([s[0] for _, s in series])) if series else np.array([], dtype="int64")
+    n_dates, n_tickers = len(dates), len(series)
+
+    version = os.path.join(out_dir, f"panel-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}")
+    os.makedirs(version)
+
+    np.save(os.path.join(version, "dates.npy"), dates)
+    shape = (n_dates, n_tickers)
+    close = np.lib.format.open_memmap(os.path.join(version, "close.npy"), mode="w+", dtype="float64", shape=shape)
+    returns = np.lib.format.open_memmap(os.path.join(version, "returns.npy"), mode="w+", dtype="float64", shape=shape)
+    valid = np.lib.format.open_memmap(os.path.join(version, "valid.npy"), mode="w+", dtype="bool", shape=shape)
+    close[:] = np.nan
+    returns[:] = np.nan
+
+    for j, (_, (ticker_dates, ticker_close)) in enumerate(series):
+        rows = np.searchsorted(dates, ticker_dates)
+        ticker_returns = np.full(len(ticker_close), np.nan)
+        ticker_returns[1:] = ticker_close[1:] / ticker_close[:-1] - 1
+        close[rows, j] = ticker_close
+        returns[rows, j] = ticker_returns
+        valid[rows, j] = ~np.isnan(ticker_close)
+
+    for array in (close, returns, valid):
+        array.flush()
+    del close, returns, valid
+
+    with open(os.path.join(version, "tickers.json"), "w") as f:
+        json.dump([t for t, _ in series], f)
+
+    current_tmp = os.path.join(out_dir, f"{CURRENT_NAME}.{os.getpid()}.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(os.path.basename(version))
+    os.replace(current_tmp, os.path.join(out_dir, CURRENT_NAME))
+
+    # Old versions may still be mapped by running workers; unlinking keeps their pages alive until they reopen
+    versions = sorted(v for v in os.listdir(out_dir) if v.startswith("panel-"))
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(out_dir, old), ignore_errors=True)
+
+    print(f"Built panel of {n_tickers} tickers x {n_dates} dates in {time.monotonic() - start:.1f}s: {version}")
+    return version
+
+
+def open_panel(panel_dir=PANEL_DIR):
+    """Open the current panel version, reusing this process's mapping if it is still current."""
+    with open(os.path.join(panel_dir, CURRENT_NAME), "r") as f:
+        path = os.path.join(panel_dir, f.read().strip())
+
+    with _open_lock:
+        panel = _open_panels.get(panel_dir)
+        if panel is None or panel.path != path:
+            panel = PricePanel(path)
+            _open_panels[panel_dir] = panel
+        return panel
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped date x ticker price panel.")
+    parser.add_argument("-out", type=str, default=PANEL_DIR, help="Panel folder")
+    parser.add_argument("-dir", type=str, help="Local folder with stock data (S3 is used when omitted)")
+    parser.add_argument("-bucket", type=str, default=S3_BUCKET, help="S3 bucket holding stock_data/")
+    parser.add_argument("-workers", type=int, default=8, help="Number of tickers to load concurrently")
+
+    args = parser.parse_args()
+    build_panel(args.out, args.dir, args.bucket, max_workers=args.workers)
@@ -0,0 +1,334 @@
+import io
+import json
+import os
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from aws_clients import get_s3_client
+from frame_cache import FRAME_CACHE
+from shared_price_cache import SHARED_CACHE
+from s3_cache import get_object_bytes, invalidate, object_etag
+from split_adjust import DERIVED_COLUMNS, SPLIT_ADJUSTED_COLUMNS, add_split_adjustment, ensure_split_adjustment
+
+S3_BUCKET = 'stonks-1'
+STOCK_DATA_PREFIX = 'stock_data/'
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
+DEFAULT_FORMATS = ("json", "parquet")
+MANIFEST_NAME = '_manifest.json'
+FULL_HISTORY_START = '1970-01-02'
+S3_CACHE_ENABLED = os.environ.get("STONKS_S3_CACHE", "1") != "0"
+
+
+def _s3_key(name, prefix=STOCK_DATA_PREFIX):
+    return f"{prefix.rstrip('/')}/{name}" if prefix else name
+
+
+def bars_to_frame(data):
+    """Build a typed, date-sorted DataFrame (UTC dates, float prices) from a list of bar dicts."""
+    df = pd.DataFrame(data)
+    if "date" not in df.columns:
+        return df
+    df["date"] = pd.to_datetime(df["date"], utc=True).astype("datetime64[ns, UTC]")
+    for col in df.columns:
+        if col != "date":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    return df.sort_values(by="date").reset_index(drop=True)
+
+
+def frame_to_bars(df):
+    """Inverse of bars_to_frame: list of bar dicts with the provider's ISO date strings."""
+    df = df.copy()
+    df["date"] = df["date"].dt.strftime(DATE_FORMAT)
+    return df.to_dict(orient="records")
+
+
+def read_price_object(name, directory=None, bucket_name=S3_BUCKET, s3=None, prefix=STOCK_DATA_PREFIX):
+    """
+    Raw bytes of a stored object, from S3 under prefix or from the local directory when one is given.
+
+    S3 reads go through the local disk cache in s3_cache unless STONKS_S3_CACHE=0.
+    """
+    if not directory:
+        if S3_CACHE_ENABLED:
+            return get_object_bytes(bucket_name, _s3_key(name, prefix), s3)
+        s3 = s3 or get_s3_client()
+        return s3.get_object(Bucket=bucket_name, Key=_s3_key(name, prefix))['Body'].read()
+    with open(os.path.join(directory, name), "rb") as f:
+        return f.read()
+
+
+def parse_prices(name, body, columns=None):
+    """
+    Decode a stored {ticker}_data.parquet or {ticker}_data.json object into a date-sorted DataFrame.
+
+    Only the requested columns are decoded from Parquet. The split columns (cumulativeFactor,
+    splitAdjOpen, ...) are computed on the fly for objects written before they were stored.
+
+    :param name: object name, its suffix selects the format
+    :param body: object bytes
+    :param columns: columns to return besides date, or None for all
+    :return: DataFrame with a UTC 'date' column
+    """
+    if name.endswith(".parquet"):
+        if columns is None:
+            df = pd.read_parquet(io.BytesIO(body))
+        else:
+            available = set(pq.read_schema(io.BytesIO(body)).names)
+            wanted = [c for c in _columns_needed(columns, available) if c in available]
+            df = pd.read_parquet(io.BytesIO(body), columns=wanted)
+    else:
+        data = json.loads(body)
+        if isinstance(data, dict):
+            data = data.get("data", [])
+        df = bars_to_frame(data)
+
+    # Older objects do not carry the split columns yet
+    if "splitFactor" in df.columns and (columns is None or any(c in DERIVED_COLUMNS for c in columns)):
+        df = ensure_split_adjustment(df)
+
+    if columns is not None:
+        df = df[[c for c in ["date"] + [c for c in columns if c != "date"] if c in df.columns]]
+    return df
+
+
+def object_version(name, directory=None, bucket_name=S3_BUCKET, s3=None, prefix=STOCK_DATA_PREFIX):
+    """Version stamp of a stored object: its ETag in S3, or mtime and size locally. Raises if it does not exist."""
+    if not directory:
+        key = _s3_key(name, prefix)
+        if S3_CACHE_ENABLED:
+            return object_etag(bucket_name, key, s3)
+        s3 = s3 or get_s3_client()
+        return s3.head_object(Bucket=bucket_name, Key=key)['ETag']
+    st = os.stat(os.path.join(directory, name))
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def load_frame(name, directory=None, bucket_name=S3_BUCKET, s3=None, prefix=STOCK_DATA_PREFIX, stage_timings=None):
+    """
+    Fully prepared frame (every stored column plus the split columns) of a stored price object.
+
+    Frames are cached in this process (FRAME_CACHE) and across worker processes (SHARED_CACHE,
+    memory-mapped files), both keyed by the object's version, so repeated loads of an unchanged
+    object skip decoding, date parsing and split adjustment.
+
+    :param stage_timings: optional object with add(stage, seconds), given fetch and parse times on a miss
+    """
+    source = directory or f"s3://{bucket_name}/{_s3_key('', prefix)}"
+    version = object_version(name, directory, bucket_name, s3, prefix)
+    key = (source, name, version)
+    df = FRAME_CACHE.get(key)
+    if df is not None:
+        return df
+
+    shared_key = f"{source}{name}"
+    df = SHARED_CACHE.get(shared_key, version) if SHARED_CACHE else None
+    if df is None:
+        start = time.perf_counter()
+        body = read_price_object(name, directory, bucket_name, s3, prefix)
+        fetched = time.perf_counter()
+        df = parse_prices(name, body)
+        if stage_timings is not None:
+            stage_timings.add("fetch", fetched - start)
+            stage_timings.add("parse", time.perf_counter() - fetched)
+        if SHARED_CACHE:
+            # Publish for the other workers, then map the shared copy here too
+            SHARED_CACHE.put(shared_key, version, df)
+            shared = SHARED_CACHE.get(shared_key, version)
+            df = shared if shared is not None else df
+    # Lets callers memoize results derived from this exact data (see portfolio.expand_rules)
+    df.attrs["version"] = f"{source}|{name}|{version}"
+    return FRAME_CACHE.put(key, df)
+
+
+def load_prices(ticker, columns=None, directory=None, bucket_name=S3_BUCKET, s3=None, prefix=STOCK_DATA_PREFIX):
+    """
+    Load a ticker's price history as a typed DataFrame sorted by date.
+
+    Reads {ticker}_data.parquet when it exists and falls back to the legacy {ticker}_data.json.
+    Parsed frames are cached in memory per object version (see load_frame).
+
+    :param ticker: ticker symbol (any case)
+    :param columns: columns to return besides date, or None for all
+    :param directory: local folder to read from instead of S3
+    :param bucket_name: S3 bucket holding the price objects
+    :param s3: boto3 S3 client (one is created if omitted)
+    :param prefix: S3 key prefix of the price objects
+    :return: DataFrame with a UTC 'date' column
+    """
+    ticker = ticker.lower()
+    if not directory:
+        s3 = s3 or get_s3_client()
+
+    try:
+        df = load_frame(f"{ticker}_data.parquet", directory, bucket_name, s3, prefix)
+    except Exception:
+        df = load_frame(f"{ticker}_data.json", directory, bucket_name, s3, prefix)
+
+    if columns is not None:
+        df = df[[c for c in ["date"] + [c for c in columns if c != "date"] if c in df.columns]]
+    return df
+
+
+def _columns_needed(columns, available):
+    """Requested columns plus whatever is needed to derive split columns the object does not store."""
+    needed = ["date"] + [c for c in columns if c != "date"]
+    if any(c in DERIVED_COLUMNS and c not in available for c in columns):
+        needed.append("splitFactor")
+        needed += [raw for raw, adjusted in SPLIT_ADJUSTED_COLUMNS.items() if adjusted in columns]
+    return list(dict.fromkeys(needed))
+
+
+def list_price_objects(directory=None, bucket_name=S3_BUCKET, s3=None, prefix=STOCK_DATA_PREFIX):
+    """
+    Stored price object of every ticker in a local folder or under prefix in S3, preferring Parquet.
+
+    :return: dict of lowercase ticker -> object name (relative to the folder or prefix)
+    """
+    if directory:
+        names = os.listdir(directory)
+    else:
+        s3 = s3 or get_s3_client()
+        key_prefix = _s3_key("", prefix)
+        names = []
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=key_prefix):
+            names += [obj['Key'][len(key_prefix):] for obj in page.get('Contents', [])]
+
+    objects = {}
+    for suffix in ("_data.json", "_data.parquet"):
+        for name in names:
+            if name.endswith(suffix):
+                objects[name[:-len(suffix)].lower()] = name
+    return objects
+
+
+def list_tickers(directory=None, bucket_name=S3_BUCKET, s3=None, prefix=STOCK_DATA_PREFIX):
+    """Tickers with a stored price file (Parquet or JSON) in a local folder or under prefix in S3."""
+    return sorted(list_price_objects(directory, bucket_name, s3, prefix))
+
+
+def read_history(ticker, directory=None, bucket_name=None, s3=None):
+    """
+    Read a ticker's stored daily bars.
+
+    :param ticker: lowercase ticker symbol
+    :param directory: local folder holding the ticker's data files (used when no bucket is given)
+    :param bucket_name: S3 bucket holding stock_data/
+    :param s3: boto3 S3 client, required with bucket_name
+    :return: list of bar dicts, or None if nothing is stored yet
+    """
+    try:
+        # Like write_history, the bucket takes precedence over the local folder
+        df = load_prices(ticker, directory=None if bucket_name else directory, bucket_name=bucket_name, s3=s3)
+        return frame_to_bars(df.drop(columns=[c for c in DERIVED_COLUMNS if c in df.columns]))
+    except Exception as e:
+        print(f"No stored history for {ticker}: {e}")
+        return None
+
+
+def write_history(ticker, data, directory=None, bucket_name=None, s3=None, formats=DEFAULT_FORMATS):
+    """
+    Write a ticker's daily bars to S3 when a bucket is given, otherwise to the local folder.
+
+    :param formats: any of "parquet" (typed, columnar) and "json" (legacy {ticker}_data.json)
+    """
+    objects = []
+    if "parquet" in formats:
+        buf = io.BytesIO()
+        # Split columns are computed once here so readers never have to
+        add_split_adjustment(bars_to_frame(data)).to_parquet(buf, index=False, compression="zstd")
+        objects.append((f"{ticker}_data.parquet", buf.getvalue(), "application/vnd.apache.parquet"))
+    if "json" in formats:
+        objects.append((f"{ticker}_data.json", json.dumps(data, indent=4).encode("utf-8"), "application/json"))
+
+    for name, body, content_type in objects:
+        if bucket_name:
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=_s3_key(name),
+                Body=body,
+                ContentType=content_type
+            )
+            invalidate(bucket_name, _s3_key(name))
+        else:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(body)
+
+
+def load_manifest(directory=None, bucket_name=None, s3=None):
+    """Load the {ticker: {last_date, last_adjClose, rows}} manifest, or an empty one if none exists."""
+    try:
+        if bucket_name:
+            obj = s3.get_object(Bucket=bucket_name, Key=_s3_key(MANIFEST_NAME))
+            return json.loads(obj['Body'].read().decode('utf-8'))
+        with open(os.path.join(directory, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def save_manifest(manifest, directory=None, bucket_name=None, s3=None):
+    body = json.dumps(manifest, indent=2, sort_keys=True)
+    if bucket_name:
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=_s3_key(MANIFEST_NAME),
+            Body=body,
+            ContentType='application/json'
+        )
+    else:
+        # Write then rename so an interrupted run never leaves a truncated manifest behind
+        path = os.path.join(directory, MANIFEST_NAME)
+        with open(path + ".tmp", "w") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+
+
+def manifest_entry(data):
+    """Summarize stored bars into the manifest entry used to plan the next incremental request."""
+    last = data[-1]
+    return {
+        "last_date": last["date"],
+        "last_adjClose": last.get("adjClose"),
+        "rows": len(data)
+    }
+
+
+def incremental_start_date(entry):
+    """First date to request: the last stored bar (re-fetched as an overlap check), or the full history."""
+    if not entry:
+        return FULL_HISTORY_START
+    return entry["last_date"][:10]
+
+
+def merge_incremental(existing, new_bars, entry):
+    """
+    Append bars newer than the stored history.
+
+    The provider re-adjusts every historical adjClose when a split (or dividend) lands, so the
+    stored adjusted series is only reusable when no new bar carries a split and the overlapping
+    last bar still has the adjClose we stored.
+
+    :param existing: stored list of bars
+    :param new_bars: bars returned for the range starting at the last stored date
+    :param entry: manifest entry for the ticker
+    :return: merged list of bars, or None when a full refetch is required
+    """
+    if not existing or not entry:
+        return None
+
+    last_date = existing[-1]["date"]
+    appended = [bar for bar in new_bars if bar["date"] > last_date]
+
+    if any(bar.get("splitFactor", 1.0) != 1.0 for bar in appended):
+        return None
+
+    overlap = next((bar for bar in new_bars if bar["date"] == last_date), None)
+    stored_adj = entry.get("last_adjClose")
+    if (overlap is not None and entry.get("last_date") == last_date
+            and stored_adj is not None and overlap.get("adjClose") is not None):
+        if abs(overlap["adjClose"] - stored_adj) > 1e-6 * max(1.0, abs(stored_adj)):
+            return None
+
+    return existing + appended
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_clients import get_s3_client
+
+S3_CACHE_DIR = os.environ.get("STONKS_S3_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".stonks", "s3cache"))
+S3_CACHE_MAX_MB = int(os.environ.get("STONKS_S3_CACHE_MB", "2048"))
+# Entries validated this recently are served without asking S3
+S3_CACHE_MAX_AGE = float(os.environ.get("STONKS_S3_CACHE_MAX_AGE", "60"))
+# Keep this fraction of the budget after an eviction pass so every write does not trigger one
+EVICT_TO = 0.9
+
+_evict_lock = threading.Lock()
+# Per cache folder estimate of its size, so the folder is only scanned when it may be over budget
+_approx_bytes = {}
+
+
+def _entry_path(bucket_name, key, cache_dir):
+    digest = hashlib.sha1(f"{bucket_name}/{key}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest[:2], f"{digest}.obj")
+
+
+def _read_entry(path, with_body=True):
+    """(header dict, body bytes or None) of a cache file, or None if there is no usable entry."""
+    try:
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            return header, f.read() if with_body else None
+    except (OSError, ValueError):
+        return None
+
+
+def _write_entry(path, header, body):
+    # Header and body share one file, so a reader never sees a body with another version's ETag
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def _touch(path, validated=False):
+    """Record a use (atime, for LRU) and optionally a successful validation (mtime, for max_age)."""
+    try:
+        now = time.time()
+        os.utime(path, (now, now if validated else os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+
+def _not_modified(error):
+    return (error.response.get("Error", {}).get("Code") in ("304", "NotModified")
+            or error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304)
+
+
+def get_object_bytes(bucket_name, key, s3=None, cache_dir=S3_CACHE_DIR, max_age=S3_CACHE_MAX_AGE,
+                     max_mb=S3_CACHE_MAX_MB):
+    """
+    Body of an S3 object, read through the local disk cache.
+
+    Entries validated within max_age seconds are returned without a request. Older entries are
+    revalidated with a conditional GET on their ETag, so an unchanged object costs a 304 and no
+    transfer. If S3 cannot be reached a cached copy is served as is. Errors such as NoSuchKey are
+    raised like a plain get_object, and a missing key is remembered for max_age as well.
+
+    :param max_mb: cache size budget, least recently used entries are evicted beyond it
+    :return: object bytes
+    """
+    return _cached_get(bucket_name, key, s3, cache_dir, max_age, max_mb, with_body=True)[1]
+
+
+def object_etag(bucket_name, key, s3=None, cache_dir=S3_CACHE_DIR, max_age=S3_CACHE_MAX_AGE,
+                max_mb=S3_CACHE_MAX_MB):
+    """
+    Current ETag of an S3 object, validated like get_object_bytes but without reading the cached body.
+
+    Lets callers that keep something derived from the object (e.g. a parsed frame) check it is
+    still current. The entry is fetched into the cache if needed.
+    """
+    return _cached_get(bucket_name, key, s3, cache_dir, max_age, max_mb, with_body=False)[0].get("etag")
+
+
+def _cached_get(bucket_name, key, s3, cache_dir, max_age, max_mb, with_body):
+    path = _entry_path(bucket_name, key, cache_dir)
+    cached = _read_entry(path, with_body)
+
+    if cached is not None:
+        try:
+            fresh = time.time() - os.stat(path).st_mtime < max_age
+        except OSError:
+            fresh = False
+        if fresh:
+            _touch(path)
+            if cached[0].get("missing"):
+                raise FileNotFoundError(f"s3://{bucket_name}/{key} does not exist")
+            return cached
+        if cached[0].get("missing"):
+            cached = None
+
+    s3 = s3 or get_s3_client()
+    try:
+        if cached is not None and cached[0].get("etag"):
+            response = s3.get_object(Bucket=bucket_name, Key=key, IfNoneMatch=cached[0]["etag"])
+        else:
+            response = s3.get_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if cached is not None and _not_modified(e):
+            _touch(path, validated=True)
+            return cached
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            # Remember misses too, load_prices probes for Parquet before falling back to JSON
+            _write_entry(path, {"bucket": bucket_name, "key": key, "missing": True}, b"")
+        raise
+    except Exception as e:
+        if cached is None:
+            raise
+        print(f"Serving cached {key}, S3 is unavailable: {e}")
+        return cached
+
+    body = response["Body"].read()
+    header = {"bucket": bucket_name, "key": key, "etag": response.get("ETag")}
+    _write_entry(path, header, body)
+    with _evict_lock:
+        estimate = _approx_bytes.get(cache_dir)
+        if estimate is not None:
+            _approx_bytes[cache_dir] = estimate + len(body)
+    if estimate is None or estimate + len(body) > max_mb * 1024 * 1024:
+        evict(cache_dir, max_mb)
+    return header, body
+
+
+def invalidate(bucket_name, key, cache_dir=S3_CACHE_DIR):
+    """Drop a cached object, e.g. after this process rewrote it."""
+    try:
+        os.remove(_entry_path(bucket_name, key, cache_dir))
+    except OSError:
+        pass
+
+
+def evict(cache_dir=S3_CACHE_DIR, max_mb=S3_CACHE_MAX_MB):
+    """Delete least recently used entries until the cache fits in max_mb."""
+    max_bytes = max_mb * 1024 * 1024
+    with _evict_lock:
+        entries = []
+        total = 0
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if not name.endswith(".obj"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, os.path.join(root, name)))
+                total += st.st_size
+
+        if total > max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        _approx_bytes[cache_dir] = total
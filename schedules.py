@@ -0,0 +1,140 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+FREQUENCIES = ("weekly", "biweekly", "monthly", "quarterly")
+# Months between calendar-based buys
+_MONTH_STEPS = {"monthly": 1, "quarterly": 3}
+# Weeks between week-based buys
+_WEEK_STEPS = {"weekly": 1, "biweekly": 2}
+
+# dates: 'YYYY-MM-DD' trading day of each buy; prices: that day's price
+Schedule = namedtuple("Schedule", ["dates", "prices"])
+
+
+def schedule_rows(dates, frequency, start_date, end_date):
+    """
+    Row of the trading day each scheduled buy lands on, found with one searchsorted.
+
+    weekly / biweekly: every Sunday (every other Sunday) after start_date up to end_date and the
+    last trading day, each filled at the first trading day on or after it.
+    monthly / quarterly: the first trading day of every month (Jan/Apr/Jul/Oct for quarterly) of
+    the years start_date.year to end_date.year. A month is skipped when its 1st falls outside
+    the price history or it has no trading day.
+
+    :param dates: UTC 'date' column of a price frame
+    :param frequency: one of FREQUENCIES
+    :param start_date: UTC timestamp the schedule starts from
+    :param end_date: UTC timestamp the schedule ends at
+    :return: int64 array of row positions in the frame, in schedule order
+    """
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency '{frequency}', expected one of {', '.join(FREQUENCIES)}")
+
+    bar_ns = dates.to_numpy(dtype="datetime64[ns]").astype("int64")
+    if len(bar_ns) == 0:
+        return np.array([], dtype="int64")
+    # Stable, so equal dates resolve to the earliest row
+    order = np.argsort(bar_ns, kind="stable")
+    sorted_ns = bar_ns[order]
+    first_ns, last_ns = sorted_ns[0], sorted_ns[-1]
+
+    if frequency in _WEEK_STEPS:
+        first_sunday = start_date + pd.offsets.Week(weekday=6)
+        targets = pd.date_range(first_sunday, end_date, freq=f"{7 * _WEEK_STEPS[frequency]}D").as_unit("ns").asi8
+        targets = targets[targets <= last_ns]
+        return order[np.searchsorted(sorted_ns, targets, side="left")]
+
+    step = _MONTH_STEPS[frequency]
+    months = pd.date_range(f"{start_date.year}-01-01", f"{end_date.year}-12-01", freq=f"{step}MS", tz="UTC")
+    starts = months.as_unit("ns").asi8
+    month_ends = (months + pd.offsets.MonthBegin(1)).as_unit("ns").asi8
+    keep = (starts >= first_ns) & (starts <= last_ns)
+    starts, month_ends = starts[keep], month_ends[keep]
+
+    pos = np.searchsorted(sorted_ns, starts, side="left")
+    clipped = np.minimum(pos, len(sorted_ns) - 1)
+    traded = (pos < len(sorted_ns)) & (sorted_ns[clipped] < month_ends)
+    return order[clipped[traded]]
+
+
+def build_schedule(df, frequency, start_date, end_date, price_column='close'):
+    """
+    Trading days and prices of a buy schedule over a price frame.
+
+    :param df: price frame with a UTC 'date' column and price_column
+    :param frequency: one of FREQUENCIES
+    :param start_date: UTC timestamp the schedule starts from
+    :param end_date: UTC timestamp the schedule ends at
+    :param price_column: column the buys are priced at
+    :return: Schedule of aligned arrays
+    """
+    rows = schedule_rows(df['date'], frequency, start_date, end_date)
+    buy_dates = df['date'].iloc[rows].dt.strftime("%Y-%m-%d").to_numpy()
+    return Schedule(buy_dates, df[price_column].to_numpy(dtype="float64")[rows])
+
+
+def dca_transactions(stock, df, dollar_amount, frequency, start_date, end_date):
+    """Buys of a fixed dollar amount (quantity rounded to 6 decimals) on every scheduled day."""
+    schedule = build_schedule(df, frequency, start_date, end_date)
+    return [
+        {"stock": stock, "date": date, "action": "buy", "quantity": round(dollar_amount / price, 6)}
+        for date, price in zip(schedule.dates.tolist(), schedule.prices.tolist())
+    ]
+
+
+def fqr_transactions(stock, df, quantity, frequency, start_date, end_date):
+    """Buys of a fixed quantity on every scheduled day, with the price and cost they were planned at."""
+    schedule = build_schedule(df, frequency, start_date, end_date)
+    return [
+        {"stock": stock, "date": date, "action": "buy", "quantity": quantity,
+         "price": price, "total_cost": round(quantity * price, 2)}
+        for date, price in zip(schedule.dates.tolist(), schedule.prices.tolist())
+    ]
+
+
+def normalize_rule(spec):
+    """
+    Validated rule in the stored manifest format, from a request spec or a stored rule reference.
+
+    {"type": "dca", "stock", "fixed_dollar_amount", "frequency", "start_date", "end_date"}, or
+    "fqr" with "fixed_quantity". dollar_amount / quantity are accepted as short names. An
+    end_date given as null or "" makes the rule open-ended: it runs up to the latest bar.
+
+    :raise ValueError: on an unknown type or frequency, or missing fields
+    """
+    rule_type = str(spec.get("type", "dca")).lower()
+    if rule_type not in ("dca", "fqr"):
+        raise ValueError(f"Unknown rule type '{rule_type}', expected dca or fqr")
+    if not spec.get("stock"):
+        raise ValueError("Rule is missing 'stock'")
+    frequency = spec.get("frequency", "weekly")
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency '{frequency}', expected one of {', '.join(FREQUENCIES)}")
+
+    rule = {
+        "type": rule_type,
+        "stock": str(spec["stock"]).lower().strip(),
+        "frequency": frequency,
+        "start_date": str(pd.to_datetime(spec.get("start_date", "2020-01-01"), utc=True)),
+        "end_date": None
+    }
+    end_date = spec.get("end_date", "2025-01-01")
+    if end_date:
+        rule["end_date"] = str(pd.to_datetime(end_date, utc=True))
+    if rule_type == "dca":
+        rule["fixed_dollar_amount"] = float(spec.get("fixed_dollar_amount", spec.get("dollar_amount", 100)))
+    else:
+        rule["fixed_quantity"] = float(spec.get("fixed_quantity", spec.get("quantity", 1)))
+    return rule
+
+
+def rule_transactions(rule, df):
+    """Transactions of a normalized rule over its stock's price frame (needs date and close)."""
+    start_date = pd.to_datetime(rule["start_date"], utc=True)
+    # Open-ended rules run up to the latest bar
+    end_date = pd.to_datetime(rule["end_date"], utc=True) if rule.get("end_date") else df['date'].max()
+    if rule["type"] == "dca":
+        return dca_transactions(rule["stock"], df, rule["fixed_dollar_amount"], rule["frequency"], start_date, end_date)
+    return fqr_transactions(rule["stock"], df, rule["fixed_quantity"], rule["frequency"], start_date, end_date)
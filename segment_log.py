@@ -0,0 +1,258 @@
+import json
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from aws_clients import get_s3_client
+
+SEGMENTS_SUFFIX = ".segments/"
+COMPACTED_THROUGH = "compacted-through"
+# Compact once a read sees this many segments past the snapshot
+COMPACT_AFTER = 50
+# Segments younger than this are never compacted, so a slow writer (or a writer whose clock is
+# a little behind) cannot land a segment below the snapshot's compacted-through mark
+COMPACT_GRACE_SECONDS = 300
+# Reads restarted when a listed segment was compacted away before it could be fetched
+STATE_ATTEMPTS = 3
+
+
+def _error_code(error):
+    return error.response.get("Error", {}).get("Code")
+
+
+class SegmentLog:
+    """
+    Append-only list of records stored as a snapshot plus immutable segment objects.
+
+    The snapshot lives at key and keeps its original format (a JSON list, or a dict holding the
+    list under field), so existing files are valid logs. Each append writes one small object
+    {key}.segments/{time_ns}-{uuid}.json with IfNoneMatch='*', so appends are O(1) and never
+    overwrite each other. A segment holds {"op": "append", "record": ...} or a delete
+    tombstone {"op": "delete", "match": {...}}. Readers apply the segments named after the
+    snapshot's compacted-through metadata, in name order.
+
+    compact() folds old segments into the snapshot with IfMatch on the snapshot's ETag, so two
+    compactions cannot overwrite each other, then deletes the folded segments.
+
+    Segment bodies are cached on the instance, since they never change; keep one instance per
+    log to make repeated reads cost a listing plus a conditional GET of the snapshot. An
+    instance can be shared between threads.
+    """
+
+    def __init__(self, bucket_name, key, field=None, s3=None):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.field = field
+        self.s3 = s3
+        self._snapshot = None  # (etag, records, compacted_through, raw document)
+        self._segments = {}
+        self._lock = threading.RLock()
+
+    def _client(self):
+        return self.s3 or get_s3_client()
+
+    @property
+    def segment_prefix(self):
+        return f"{self.key}{SEGMENTS_SUFFIX}"
+
+    def _list_segments(self):
+        names = []
+        paginator = self._client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.segment_prefix):
+            names += [obj['Key'][len(self.segment_prefix):] for obj in page.get('Contents', [])]
+        return sorted(names)
+
+    def _read_snapshot(self):
+        """(etag, records, compacted_through, document); etag is None if there is no snapshot yet."""
+        s3 = self._client()
+        try:
+            if self._snapshot and self._snapshot[0]:
+                response = s3.get_object(Bucket=self.bucket_name, Key=self.key, IfNoneMatch=self._snapshot[0])
+            else:
+                response = s3.get_object(Bucket=self.bucket_name, Key=self.key)
+        except ClientError as e:
+            if self._snapshot and e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304:
+                return self._snapshot
+            if _error_code(e) in ("NoSuchKey", "404"):
+                self._snapshot = (None, [], "", None)
+                return self._snapshot
+            raise
+
+        document = json.loads(response['Body'].read().decode('utf-8') or "null")
+        if self.field:
+            records = (document or {}).get(self.field, [])
+        else:
+            records = document or []
+        through = response.get('Metadata', {}).get(COMPACTED_THROUGH, "")
+        self._snapshot = (response.get('ETag'), records, through, document)
+        return self._snapshot
+
+    def _read_segment(self, name):
+        if name not in self._segments:
+            obj = self._client().get_object(Bucket=self.bucket_name, Key=f"{self.segment_prefix}{name}")
+            self._segments[name] = json.loads(obj['Body'].read().decode('utf-8'))
+        return self._segments[name]
+
+    def _state(self):
+        for attempt in range(STATE_ATTEMPTS):
+            try:
+                return self._state_once()
+            except ClientError as e:
+                # A compaction elsewhere deleted a listed segment; its record is in the new snapshot
+                if _error_code(e) not in ("NoSuchKey", "404") or attempt == STATE_ATTEMPTS - 1:
+                    raise
+                self._snapshot = None
+
+    def _state_once(self):
+        # Listing before reading the snapshot means a concurrent compaction can only make the
+        # snapshot newer than the listing, never leave folded segments out of both
+        names = self._list_segments()
+        etag, records, through, document = self._read_snapshot()
+        tail = [n for n in names if n > through]
+        records = list(records)
+        for name in tail:
+            apply_op(records, self._read_segment(name))
+        for name in list(self._segments):
+            if name <= through:
+                del self._segments[name]
+        return records, tail, etag, through, document
+
+    def read(self):
+        """Current records: the snapshot with every later segment applied. Compacts when the tail is long."""
+        with self._lock:
+            records, tail, _, _, _ = self._state()
+            if len(tail) >= COMPACT_AFTER:
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"[WARN] Could not compact {self.key}: {e}")
+        return records
+
+    def append(self, record):
+        """Add a record with one small conditional put."""
+        self._put_segment({"op": "append", "record": record})
+
+    def delete(self, match):
+        """Remove every record whose fields equal match (a tombstone applied in order by readers)."""
+        self._put_segment({"op": "delete", "match": match})
+
+    def _put_segment(self, op):
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+        self._client().put_object(
+            Bucket=self.bucket_name,
+            Key=f"{self.segment_prefix}{name}",
+            Body=json.dumps(op).encode('utf-8'),
+            ContentType='application/json',
+            IfNoneMatch='*'
+        )
+        self._segments[name] = op
+
+    def compact(self):
+        """
+        Fold segments older than COMPACT_GRACE_SECONDS into the snapshot and delete them.
+
+        :return: True if the snapshot was rewritten, False if there was nothing to fold or
+                 another process changed the snapshot first
+        """
+        with self._lock:
+            self._snapshot = None  # compaction must start from the latest snapshot, not a cached one
+            _, tail, etag, through, document = self._state()
+            cutoff = f"{time.time_ns() - COMPACT_GRACE_SECONDS * 1_000_000_000:020d}"
+            folded = [n for n in tail if n < cutoff]
+            if not folded:
+                return False
+
+            records = list(self._snapshot[1])
+            for name in folded:
+                apply_op(records, self._read_segment(name))
+            if self.field:
+                document = dict(document or {})
+                document[self.field] = records
+            else:
+                document = records
+
+            put = dict(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                Body=json.dumps(document, indent=2).encode('utf-8'),
+                ContentType='application/json',
+                Metadata={COMPACTED_THROUGH: folded[-1]}
+            )
+            if etag:
+                put["IfMatch"] = etag
+            else:
+                put["IfNoneMatch"] = '*'
+            try:
+                self._client().put_object(**put)
+            except ClientError as e:
+                if _error_code(e) in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409"):
+                    return False
+                raise
+            self._snapshot = None
+
+            for name in folded:
+                try:
+                    self._client().delete_object(Bucket=self.bucket_name, Key=f"{self.segment_prefix}{name}")
+                except Exception as e:
+                    print(f"[WARN] Could not delete compacted segment {name}: {e}")
+                self._segments.pop(name, None)
+            return True
+
+    def reset(self, records=()):
+        """
+        Replace every record with records: a new snapshot whose compacted-through mark covers all
+        existing segments, so none of them is applied again, then those segments are deleted.
+
+        The snapshot is written with IfNoneMatch='*' when the log does not exist yet and IfMatch
+        on its ETag otherwise, retrying if another writer changes it in between.
+        """
+        with self._lock:
+            for _ in range(STATE_ATTEMPTS):
+                self._snapshot = None
+                names = self._list_segments()
+                etag, _, through, document = self._read_snapshot()
+                records = list(records)
+                if self.field:
+                    document = dict(document or {})
+                    document[self.field] = records
+                else:
+                    document = records
+
+                put = dict(
+                    Bucket=self.bucket_name,
+                    Key=self.key,
+                    Body=json.dumps(document, indent=2).encode('utf-8'),
+                    ContentType='application/json',
+                    Metadata={COMPACTED_THROUGH: max(names[-1] if names else "", through)}
+                )
+                if etag:
+                    put["IfMatch"] = etag
+                else:
+                    put["IfNoneMatch"] = '*'
+                try:
+                    self._client().put_object(**put)
+                    break
+                except ClientError as e:
+                    if _error_code(e) not in ("PreconditionFailed", "ConditionalRequestConflict", "412", "409"):
+                        raise
+            else:
+                raise RuntimeError(f"{self.key} kept changing while it was being reset")
+            self._snapshot = None
+
+            for name in names:
+                try:
+                    self._client().delete_object(Bucket=self.bucket_name, Key=f"{self.segment_prefix}{name}")
+                except Exception as e:
+                    print(f"[WARN] Could not delete reset segment {name}: {e}")
+                self._segments.pop(name, None)
+
+
+def apply_op(records, op):
+    """Apply one segment operation to a list of records in place."""
+    if op.get("op") == "append":
+        records.append(op["record"])
+    elif op.get("op") == "delete" and op.get("match"):
+        match = op["match"]
+        records[:] = [r for r in records if any(r.get(k) != v for k, v in match.items())]
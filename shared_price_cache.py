@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, the cache stays off
+    fcntl = None
+
+_SHM = "/dev/shm"
+SHARED_CACHE_DIR = os.environ.get(
+    "STONKS_SHARED_CACHE_DIR",
+    os.path.join(_SHM if os.path.isdir(_SHM) else tempfile.gettempdir(), "stonks-prices")
+)
+SHARED_CACHE_MB = int(os.environ.get("STONKS_SHARED_CACHE_MB", "1024"))
+SHARED_CACHE_ENABLED = fcntl is not None and os.environ.get("STONKS_SHARED_CACHE", "1") != "0"
+INDEX_NAME = "index.json"
+LOCK_NAME = "index.lock"
+
+
+class SharedPriceCache:
+    """
+    Price frames shared between worker processes through memory-mapped .npy files.
+
+    The first process to load an object writes its columns once under cache_dir (tmpfs at
+    /dev/shm by default); every other process maps the same pages read-only instead of parsing
+    its own copy. index.json maps each object to its current entry and the version stamp
+    (ETag or mtime) it was built from, so an object rewritten by ingestion is simply a miss.
+    The index is only changed under an exclusive flock and replaced atomically.
+    """
+
+    def __init__(self, cache_dir=SHARED_CACHE_DIR, max_mb=SHARED_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self._index = {}
+        self._index_mtime = None
+        self._lock = threading.Lock()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, INDEX_NAME)
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        """The index as last written by any process, re-read only when the file changed."""
+        try:
+            mtime = os.stat(self._index_path()).st_mtime_ns
+        except OSError:
+            return {}
+        with self._lock:
+            if mtime != self._index_mtime:
+                try:
+                    with open(self._index_path(), "r") as f:
+                        self._index = json.load(f)
+                    self._index_mtime = mtime
+                except (OSError, ValueError):
+                    return {}
+            return self._index
+
+    def _write_index(self, index):
+        tmp_path = f"{self._index_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def get(self, key, version):
+        """
+        Frame for key if the shared copy was built from this version, else None.
+
+        Price columns are read-only memory maps of the shared files; under copy-on-write a caller
+        modifying them gets a private copy.
+        """
+        entry = self._read_index().get(key)
+        if entry is None or entry["version"] != version:
+            return None
+        path = os.path.join(self.cache_dir, entry["dir"])
+        try:
+            dates = np.load(os.path.join(path, "dates.npy"))
+            values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+            os.utime(path)
+        except OSError:
+            return None
+        df = pd.DataFrame(values.T, columns=entry["columns"], copy=False)
+        df.insert(0, "date", pd.DatetimeIndex(dates.view("datetime64[ns]")).tz_localize("UTC"))
+        return df
+
+    def put(self, key, version, df):
+        """Publish a date + float columns frame for other processes. Frames of other shapes are skipped."""
+        columns = [c for c in df.columns if c != "date"]
+        if "date" not in df.columns or any(df[c].dtype != "float64" for c in columns):
+            return
+        values = np.ascontiguousarray(df[columns].to_numpy(dtype="float64").T)
+        dates = df["date"].to_numpy(dtype="datetime64[ns]").astype("int64")
+
+        digest = hashlib.sha1(f"{key}@{version}".encode("utf-8")).hexdigest()
+        entry_dir = f"{digest}-{os.getpid()}-{threading.get_ident()}"
+        tmp_dir = os.path.join(self.cache_dir, f".{entry_dir}.tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, "dates.npy"), dates)
+        np.save(os.path.join(tmp_dir, "values.npy"), values)
+        os.rename(tmp_dir, os.path.join(self.cache_dir, entry_dir))
+
+        with self._locked():
+            index = dict(self._read_index())
+            stale = index.get(key)
+            index[key] = {"version": version, "dir": entry_dir, "columns": columns,
+                          "bytes": int(values.nbytes + dates.nbytes)}
+            removed = [stale["dir"]] if stale else []
+            removed += self._evict(index, keep=key)
+            self._write_index(index)
+
+        # Processes that already mapped a removed entry keep its pages until they drop the frame
+        for old_dir in removed:
+            shutil.rmtree(os.path.join(self.cache_dir, old_dir), ignore_errors=True)
+
+    def _evict(self, index, keep):
+        """Drop least recently read entries (directory mtime) from index until it fits, return their folders."""
+        total = sum(e["bytes"] for e in index.values())
+        if total <= self.max_bytes:
+            return []
+
+        def last_used(item):
+            try:
+                return os.stat(os.path.join(self.cache_dir, item[1]["dir"])).st_mtime
+            except OSError:
+                return 0
+
+        removed = []
+        for key, entry in sorted(index.items(), key=last_used):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            del index[key]
+            total -= entry["bytes"]
+            removed.append(entry["dir"])
+        return removed
+
+    def stats(self):
+        index = self._read_index()
+        return {
+            "entries": len(index),
+            "mb": round(sum(e["bytes"] for e in index.values()) / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "dir": self.cache_dir
+        }
+
+
+SHARED_CACHE = SharedPriceCache() if SHARED_CACHE_ENABLED else None
@@ -0,0 +1,46 @@
+import numpy as np
+
+# Raw price column -> split-adjusted column stored alongside it
+SPLIT_ADJUSTED_COLUMNS = {
+    "open": "splitAdjOpen",
+    "high": "splitAdjHigh",
+    "low": "splitAdjLow",
+    "close": "splitAdjClose"
+}
+DERIVED_COLUMNS = ["cumulativeFactor"] + list(SPLIT_ADJUSTED_COLUMNS.values())
+
+
+def cumulative_split_factor(split_factors):
+    """
+    Product of the split factors from each bar to the end of the history (the bar's own included).
+
+    This is the factor transactions use to turn a quantity bought on that bar into today's shares.
+    """
+    factors = np.nan_to_num(np.asarray(split_factors, dtype="float64"), nan=1.0)
+    return np.cumprod(factors[::-1])[::-1]
+
+
+def add_split_adjustment(df):
+    """
+    Add cumulativeFactor and split-adjusted OHLC columns to a date-sorted frame of raw bars.
+
+    A bar's own split factor is already reflected in its price, so adjusted prices are divided
+    only by the splits that happen after it.
+    """
+    split_factors = np.nan_to_num(df["splitFactor"].to_numpy(dtype="float64"), nan=1.0)
+    cumulative = cumulative_split_factor(split_factors)
+    scale = split_factors / cumulative
+
+    df["cumulativeFactor"] = cumulative
+    for raw, adjusted in SPLIT_ADJUSTED_COLUMNS.items():
+        if raw in df.columns:
+            df[adjusted] = df[raw].to_numpy(dtype="float64") * scale
+    return df
+
+
+def ensure_split_adjustment(df):
+    """Compute the split columns only if the stored data does not already carry them."""
+    missing = "cumulativeFactor" not in df.columns or any(
+        adjusted not in df.columns for raw, adjusted in SPLIT_ADJUSTED_COLUMNS.items() if raw in df.columns
+    )
+    return add_split_adjustment(df) if missing else df
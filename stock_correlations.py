@@ -1,27 +1,61 @@
 import os
-import json
 import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-
-def load_stock_data(file_path):
-    """Load stock data from a JSON file and return a DataFrame."""
-    with open(file_path, "r") as f:
-        data = json.load(f)
-
-    if isinstance(data, dict):
-        data = data.get("data", [])
-
-    if not isinstance(data, list):
-        print(f"Skipping {file_path}: Unexpected JSON format.")
+from aws_clients import S3_MAX_POOL_CONNECTIONS, get_s3_client
+from correlation_engine import top_correlations
+from price_panel import open_panel
+from price_store import STOCK_DATA_PREFIX, list_price_objects, load_frame
+from split_adjust import cumulative_split_factor
+from universe import load_universe
+
+CORRELATION_COLUMNS = ["adjClose", "adjOpen", "adjHigh", "adjLow", "splitFactor", "cumulativeFactor"]
+LOAD_WORKERS = 16
+
+class StageTimings:
+    """Seconds spent per stage, summed across the loader threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+def load_stock_data(ticker, data_folder=None, bucket_name=None, data_prefix=STOCK_DATA_PREFIX, s3=None, name=None,
+                    stage_timings=None):
+    """
+    Load a ticker's stock data (Parquet or legacy JSON) from the data folder or S3 and return a DataFrame.
+
+    :param name: stored object name, looked up (Parquet first) when omitted
+    :param stage_timings: optional StageTimings to add fetch and parse seconds to
+    """
+    try:
+        if name is None:
+            try:
+                df = load_frame(f"{ticker}_data.parquet", data_folder, bucket_name, s3, data_prefix, stage_timings)
+            except Exception:
+                df = load_frame(f"{ticker}_data.json", data_folder, bucket_name, s3, data_prefix, stage_timings)
+        else:
+            df = load_frame(name, data_folder, bucket_name, s3, data_prefix, stage_timings)
+    except Exception as e:
+        print(f"Skipping {ticker}: {e}")
         return None
 
-    df = pd.DataFrame(data)
-
     if "date" not in df.columns:
-        print(f"Skipping {file_path}: 'date' column missing.")
+        print(f"Skipping {ticker}: 'date' column missing.")
         return None
 
-    return df
+    return df[[c for c in ["date"] + CORRELATION_COLUMNS if c in df.columns]]
+
+def load_stock_data_s3(bucket_name, object_key, s3=None):
+    """Load stock data directly from an S3 Parquet or JSON object into a DataFrame."""
+    prefix, _, name = object_key.rpartition("/")
+    ticker = name.split("_data.")[0].lower()
+    return load_stock_data(ticker, bucket_name=bucket_name, data_prefix=prefix, s3=s3, name=name)
 
 def preprocess_stock_data(df, min_date, max_date):
     """Preprocess stock data by adjusting for splits and computing daily percent change."""
@@ -35,14 +69,12 @@ def preprocess_stock_data(df, min_date, max_date):
         print("Skipping: Required columns missing.")
         return None
 
-    df["splitFactor"] = df["splitFactor"].fillna(1)
-    df["cumulative_split"] = df["splitFactor"][::-1].cumprod()[::-1]
+    if "cumulativeFactor" not in df.columns:
+        df["cumulativeFactor"] = cumulative_split_factor(df["splitFactor"])
 
     for col in ["adjClose", "adjOpen", "adjHigh", "adjLow"]:
         if col in df.columns:
-            df[col] = df[col] / df["cumulative_split"]
-
-    df.drop(columns=["cumulative_split"], inplace=True)
+            df[col] = df[col] / df["cumulativeFactor"]
 
     df = df.loc[(df.index >= min_date) & (df.index <= max_date)].copy()
     df["pct_change"] = df["adjClose"].pct_change()
@@ -50,35 +82,71 @@ def preprocess_stock_data(df, min_date, max_date):
 
     return df
 
-def find_top_correlations(stock_to_compare, num_stocks, min_date, max_date, data_folder):
-    """Find top correlated stocks with the target stock."""
-    correlations = {}
+def find_top_correlations(stock_to_compare, num_stocks, min_date, max_date, data_folder=None, tickers=None,
+                          panel_dir=None, bucket_name=None, data_prefix=STOCK_DATA_PREFIX, s3=None,
+                          max_workers=LOAD_WORKERS, timings=None, use_universe=True):
+    """
+    Find top correlated stocks with the target stock among a ticker universe.
+
+    Unless tickers are given, the candidates are the cached universe (see universe.load_universe,
+    read without revalidating the zip). use_universe=False compares against every stored ticker,
+    as does a missing universe.
+
+    Prices are read from data_folder, or from S3 when bucket_name is given (objects listed under
+    data_prefix with pagination and fetched concurrently through one shared client). With
+    panel_dir the memory-mapped price panel is used instead and every ticker is compared in one
+    vectorized pass.
+
+    :param timings: optional dict filled with seconds per stage: list, load, compute and total wall
+                    time, plus fetch and parse summed across the max_workers loader threads
+    :return: list of (TICKER, correlation), highest first
+    """
+    start = time.perf_counter()
+    if tickers is None and use_universe:
+        tickers = load_universe(refresh=False)
+        if tickers is None:
+            print("No cached ticker universe; comparing against every stored ticker")
+    if panel_dir:
+        top_correlated_stocks = top_correlations(open_panel(panel_dir), stock_to_compare, num_stocks,
+                                                 min_date, max_date, tickers)
+        if timings is not None:
+            timings.update({"compute": time.perf_counter() - start, "total": time.perf_counter() - start})
+        print_correlations(stock_to_compare, num_stocks, top_correlated_stocks)
+        return top_correlated_stocks
+
+    if bucket_name:
+        data_folder = None
+        s3 = s3 or get_s3_client(max_pool_connections=max(S3_MAX_POOL_CONNECTIONS, max_workers))
+    elif not data_folder:
+        raise ValueError("Error: a data folder or an S3 bucket is required.")
+
+    universe = {t.lower() for t in tickers} if tickers is not None else None
+    target = stock_to_compare.lower()
 
     min_date = pd.to_datetime(min_date).tz_localize("UTC")
     max_date = pd.to_datetime(max_date).tz_localize("UTC")
 
-    comparison_file = os.path.join(data_folder, f"{stock_to_compare.lower()}_data.json")
-    compared_stock_df = load_stock_data(comparison_file)
+    objects = list_price_objects(data_folder, bucket_name, s3, data_prefix)
+    listed = time.perf_counter()
+    stage_timings = StageTimings()
 
-    if compared_stock_df is None:
-        raise ValueError(f"Error: {stock_to_compare} data could not be loaded.")
+    def load_window(ticker):
+        df = load_stock_data(ticker, data_folder, bucket_name, data_prefix, s3, objects[ticker], stage_timings)
+        return None if df is None else preprocess_stock_data(df, min_date, max_date)
 
-    compared_stock_df = preprocess_stock_data(compared_stock_df, min_date, max_date)
+    if target not in objects:
+        raise ValueError(f"Error: {stock_to_compare} data could not be loaded.")
+    compared_stock_df = load_window(target)
     if compared_stock_df is None:
-        raise ValueError(f"Error: {stock_to_compare} data missing required columns.")
+        raise ValueError(f"Error: {stock_to_compare} data could not be loaded or is missing required columns.")
 
-    for file in os.listdir(data_folder):
-        if not file.endswith("_data.json") or file.lower() == f"{stock_to_compare.lower()}_data.json":
-            continue
+    candidates = [t for t in sorted(objects) if t != target and (universe is None or t in universe)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        loaded = list(executor.map(load_window, candidates))
+    fetched = time.perf_counter()
 
-        stock_name = file.split("_")[0].upper()
-        stock_file = os.path.join(data_folder, file)
-
-        stock_df = load_stock_data(stock_file)
-        if stock_df is None:
-            continue
-
-        stock_df = preprocess_stock_data(stock_df, min_date, max_date)
+    correlations = {}
+    for ticker, stock_df in zip(candidates, loaded):
         if stock_df is None or stock_df.empty:
             continue
 
@@ -92,10 +160,22 @@ def find_top_correlations(stock_to_compare, num_stocks, min_date, max_date, data
 
         correlation = combined_df["pct_change_aapl"].corr(combined_df["pct_change_stock"])
         if pd.notna(correlation):
-            correlations[stock_name] = correlation
+            correlations[ticker.upper()] = float(correlation)
 
     top_correlated_stocks = sorted(correlations.items(), key=lambda x: x[1], reverse=True)[:num_stocks]
+    done = time.perf_counter()
+
+    stages = {"list": listed - start, "load": fetched - listed, **stage_timings.seconds,
+              "compute": done - fetched, "total": done - start}
+    print(f"Compared {len(candidates)} stocks in {stages['total']:.2f}s (" +
+          ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages.items() if stage != "total") + ")")
+    if timings is not None:
+        timings.update(stages)
+
+    print_correlations(stock_to_compare, num_stocks, top_correlated_stocks)
+    return top_correlated_stocks
 
+def print_correlations(stock_to_compare, num_stocks, top_correlated_stocks):
     print(f"Top {num_stocks} correlated stocks with {stock_to_compare.upper()}:")
     for stock, corr in top_correlated_stocks:
         print(f"{stock}: {corr:.4f}")
@@ -106,15 +186,24 @@ if __name__ == "__main__":
     parser.add_argument("--num_stocks", type=int, required=True, help="Number of top correlated stocks to output")
     parser.add_argument("--min_date", type=str, required=True, help="Start date (YYYY-MM-DD)")
     parser.add_argument("--max_date", type=str, required=True, help="End date (YYYY-MM-DD)")
-    parser.add_argument("--data_folder", type=str, required=True, help="Folder containing stock data JSON files")
+    parser.add_argument("--data_folder", type=str, help="Folder containing stock data Parquet/JSON files")
+    parser.add_argument("--panel_dir", type=str, help="Use the memory-mapped price panel in this folder instead of the data folder")
+    parser.add_argument("--all_tickers", action="store_true", help="Compare against every stored ticker, not just the cached universe")
+    parser.add_argument("--active_as_of", type=str, help="Universe activity cutoff (YYYY-MM-DD, default: Jan 1 of this year)")
 
     args = parser.parse_args()
+    if not args.data_folder and not args.panel_dir:
+        parser.error("one of --data_folder or --panel_dir is required")
+    tickers = None if args.all_tickers else load_universe(args.active_as_of)
 
     find_top_correlations(
         stock_to_compare=args.stock_to_compare,
         num_stocks=args.num_stocks,
         min_date=args.min_date,
         max_date=args.max_date,
-        data_folder=args.data_folder
+        data_folder=args.data_folder,
+        tickers=tickers,
+        panel_dir=args.panel_dir,
+        use_universe=not args.all_tickers
     )
 
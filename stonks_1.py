@@ -1,63 +1,35 @@
 import argparse
 import requests
-import zipfile
-import io
-import pandas as pd
-import json
 import os
+from price_store import load_manifest, save_manifest
+from stonks_1_aws import fetch_ticker
+from universe import load_universe
 
-def download_stock_data(api_token, directory, num_stocks):
-    url = "https://apimedia.tiingo.com/docs/tiingo/daily/supported_tickers.zip"
-
-    response = requests.get(url)
-    if response.status_code == 200:
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            file_names = z.namelist()
-            with z.open(file_names[0]) as csv_file:
-                df = pd.read_csv(csv_file)
-    else:
-        print(f"Failed to download file: {response.status_code}")
+def download_stock_data(api_token, directory, num_stocks, incremental=False, active_as_of=None):
+    tickers = load_universe(active_as_of)
+    if tickers is None:
         return
-
-    df = df[df['priceCurrency'] == 'USD']
-    df = df[df['exchange'].isin(['NASDAQ', 'NYSE'])]
-    df = df[df['startDate'].notna()]
-    df = df[df['endDate'].notna()]
-    df = df[df['endDate'].str[:4] == '2025']
-    df = df.reset_index(drop=True)
+    if num_stocks != -1:
+        tickers = tickers[:num_stocks]
 
     os.makedirs(directory, exist_ok=True)
 
-    for i in range(min(num_stocks, len(df)) if num_stocks != -1 else len(df)):
-        ticker = df['ticker'][i].lower()
-
-        headers = {'Content-Type': 'application/json'}
-
-        try:
-            requestResponse = requests.get(
-                f"https://api.tiingo.com/tiingo/daily/{ticker}/prices?startDate=1970-01-02&token={api_token}", 
-                headers=headers,
-                timeout=10  
-            )
-
-            if requestResponse.status_code != 200:
-                print(f"Warning: API request failed for {ticker}. Status Code: {requestResponse.status_code}")
-                continue  
-
-            json_data = requestResponse.json()
+    session = requests.Session()
+    manifest = load_manifest(directory) if incremental else None
 
-            with open(os.path.join(directory, f"{ticker}_data.json"), "w") as f:
-                json.dump(json_data, f, indent=4)
+    for ticker in tickers:
+        fetch_ticker(ticker, api_token, directory, None, session, None, manifest=manifest)
 
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data for {ticker}: {e}")
-            continue  
+    if manifest is not None:
+        save_manifest(manifest, directory)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download stock data from Tiingo.")
     parser.add_argument("-api_token", type=str, required=True, help="API token for authentication")
     parser.add_argument("-dir", type=str, required=True, help="Directory to save data")
     parser.add_argument("-num_stocks", type=int, default=-1, help="Number of stocks to download (-1 for all)")
+    parser.add_argument("-active_as_of", type=str, help="Only tickers with data on or after this date (YYYY-MM-DD, default: Jan 1 of this year)")
+    parser.add_argument("-incremental", action="store_true", help="Only fetch bars newer than the stored history")
 
     args = parser.parse_args()
-    download_stock_data(args.api_token, args.dir, args.num_stocks)
+    download_stock_data(args.api_token, args.dir, args.num_stocks, args.incremental, args.active_as_of)
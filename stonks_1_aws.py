@@ -1,90 +1,172 @@
 import argparse
 import requests
-import zipfile
-import io
-import pandas as pd
 import json
 import os
-import boto3
 from botocore.exceptions import NoCredentialsError
+from requests.adapters import HTTPAdapter
+from aws_clients import S3_MAX_POOL_CONNECTIONS, get_s3_client
+from checkpoint import Checkpoint
+from download_pool import TokenBucket, retry_with_backoff, run_pool
+from price_store import (DEFAULT_FORMATS, FULL_HISTORY_START, incremental_start_date, load_manifest,
+                         manifest_entry, merge_incremental, read_history, save_manifest, write_history)
+from universe import load_universe
 
-def download_stock_data(api_token, directory, num_stocks, access_key, secret_key, bucket_name):
-    url = "https://apimedia.tiingo.com/docs/tiingo/daily/supported_tickers.zip"
+def request_prices(session, ticker, api_token, start_date, rate_limiter=None):
+    """Request daily bars for a ticker from start_date onwards. Returns the list of bars, or None on failure."""
+    headers = {'Content-Type': 'application/json'}
 
-    response = requests.get(url)
-    if response.status_code == 200:
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            file_names = z.namelist()
-            with z.open(file_names[0]) as csv_file:
-                df = pd.read_csv(csv_file)
+    if rate_limiter:
+        rate_limiter.acquire()
+
+    try:
+        requestResponse = session.get(
+            f"https://api.tiingo.com/tiingo/daily/{ticker}/prices?startDate={start_date}&token={api_token}", 
+            headers=headers,
+            timeout=10  
+        )
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data for {ticker}: {e}")
+        return None
+
+    if requestResponse.status_code != 200:
+        print(f"Warning: API request failed for {ticker}. Status Code: {requestResponse.status_code}")
+        return None
+
+    return requestResponse.json()
+
+def fetch_ticker(ticker, api_token, directory, bucket_name, session, s3, rate_limiter=None, manifest=None,
+                 formats=DEFAULT_FORMATS):
+    """
+    Download one ticker's price history and store it in S3 or locally. Returns True on success.
+
+    When a manifest dict is given the ticker is refreshed incrementally: only bars since the last
+    stored date are requested and appended, unless a new split forces a full refetch.
+    """
+    entry = None
+    existing = None
+    if manifest is not None:
+        entry = manifest.get(ticker)
+        if entry is None:
+            # No manifest entry yet, fall back to the last date of the stored object
+            existing = read_history(ticker, directory, bucket_name, s3)
+            if existing:
+                entry = manifest_entry(existing)
+
+    json_data = request_prices(session, ticker, api_token, incremental_start_date(entry), rate_limiter)
+    if json_data is None:
+        return False
+
+    if entry:
+        if existing is None:
+            existing = read_history(ticker, directory, bucket_name, s3)
+        merged = merge_incremental(existing, json_data, entry)
+        if merged is None:
+            print(f"Stored history for {ticker} is stale (new split or re-adjustment), refetching full history.")
+            json_data = request_prices(session, ticker, api_token, FULL_HISTORY_START, rate_limiter)
+            if json_data is None:
+                return False
+        elif len(merged) == len(existing):
+            print(f"{ticker} is already up to date.")
+            manifest[ticker] = entry
+            return True
+        else:
+            json_data = merged
+
+    try:
+        write_history(ticker, json_data, directory, bucket_name, s3, formats)
+    except NoCredentialsError:
+        print("Error: AWS credentials not found.")
+        return False
+
+    if bucket_name:
+        print(f"Successfully uploaded {ticker} ({', '.join(formats)}) to S3.")
     else:
-        print(f"Failed to download file: {response.status_code}")
-        return
+        print(f"Successfully saved {ticker} ({', '.join(formats)}) locally.")
+
+    if manifest is not None and json_data:
+        manifest[ticker] = manifest_entry(json_data)
 
-    df = df[df['priceCurrency'] == 'USD']
-    df = df[df['exchange'].isin(['NASDAQ', 'NYSE'])]
-    df = df[df['startDate'].notna()]
-    df = df[df['endDate'].notna()]
-    df = df[df['endDate'].str[:4] == '2025']
-    df = df.reset_index(drop=True)
+    return True
 
+CHECKPOINT_NAME = "_checkpoint_prices.json"
+
+def download_stock_data(api_token, directory, num_stocks, access_key, secret_key, bucket_name,
+                        max_workers=1, rate_limit=None, burst=None, incremental=False, resume=False, retries=3,
+                        active_as_of=None, formats=DEFAULT_FORMATS):
     os.makedirs(directory, exist_ok=True)
 
-    for i in range(min(num_stocks, len(df)) if num_stocks != -1 else len(df)):
-        try: 
-            try:
-                ticker = df['ticker'][i].lower()
-            except Exception as e:
-                print(f"Error accessing ticker at index {i}: {e}")
-                continue
-            
-            headers = {'Content-Type': 'application/json'}
-
-            requestResponse = requests.get(
-                f"https://api.tiingo.com/tiingo/daily/{ticker}/prices?startDate=1970-01-02&token={api_token}", 
-                headers=headers,
-                timeout=10  
-            )
-
-            if requestResponse.status_code != 200:
-                print(f"Warning: API request failed for {ticker}. Status Code: {requestResponse.status_code}")
-                continue  
-
-            json_data = requestResponse.json()
-
-            if bucket_name:
-                # If AWS credentials are provided, upload to S3
-                s3 = boto3.client('s3')
-                try:
-                    s3.put_object(
-                        Bucket=bucket_name,
-                        Key=f"stock_data/{ticker}_data.json",
-                        Body=json.dumps(json_data, indent=4),
-                        ContentType='application/json'
-                    )
-                    print(f"Successfully uploaded {ticker}_data.json to S3.")
-                except NoCredentialsError:
-                    print("Error: AWS credentials not found.")
-            else:
-                # If no AWS credentials are provided, save the file locally
-                with open(os.path.join(directory, f"{ticker}_data.json"), "w") as f:
-                    json.dump(json_data, f, indent=4)
-                    print(f"Successfully saved {ticker}_data.json locally.")
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data for {ticker}: {e}")
-            continue  
+    checkpoint_path = os.path.join(directory, CHECKPOINT_NAME)
+    checkpoint = Checkpoint.load(checkpoint_path) if resume else None
+
+    if checkpoint is None:
+        if resume:
+            print(f"No checkpoint found at {checkpoint_path}, starting a full run.")
+
+        tickers = load_universe(active_as_of)
+        if tickers is None:
+            return
+        if num_stocks != -1:
+            tickers = tickers[:num_stocks]
+
+        checkpoint = Checkpoint(checkpoint_path, tickers)
+        checkpoint.save()
+    else:
+        print(f"Resuming from {checkpoint_path}: {len(checkpoint.completed)} of {len(checkpoint.universe)} "
+              f"tickers done, {len(checkpoint.failed)} failed tickers to retry.")
+
+    # Tickers that failed in an earlier run are retried with exponential backoff
+    retry_tickers = set(checkpoint.failed)
+
+    # One HTTP session and one S3 client shared by every worker, with enough pooled connections for all of them
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=max(10, max_workers)))
+
+    s3 = None
+    if bucket_name:
+        s3 = get_s3_client(access_key, secret_key, max(S3_MAX_POOL_CONNECTIONS, max_workers))
+
+    rate_limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+    manifest = load_manifest(directory, bucket_name, s3) if incremental else None
+
+    def worker(ticker):
+        fetch = lambda: fetch_ticker(ticker, api_token, directory, bucket_name, session, s3, rate_limiter, manifest,
+                                     formats)
+        if ticker in retry_tickers:
+            return retry_with_backoff(fetch, retries)
+        return fetch()
+
+    stats = run_pool(checkpoint.pending(), worker, max_workers=max_workers, checkpoint=checkpoint)
+    stats.report()
+
+    if manifest is not None:
+        save_manifest(manifest, directory, bucket_name, s3)
+
+    return stats
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download stock data from Tiingo.")
     parser.add_argument("-api_token", type=str, required=True, help="API token for authentication")
     parser.add_argument("-dir", type=str, required=True, help="Directory to save data")
     parser.add_argument("-num_stocks", type=int, default=-1, help="Number of stocks to download (-1 for all)")
+    parser.add_argument("-active_as_of", type=str, help="Only tickers with data on or after this date (YYYY-MM-DD, default: Jan 1 of this year)")
 
     # AWS credentials and bucket name (optional)
     parser.add_argument("-access_key", type=str, help="AWS Access Key ID (optional)")
     parser.add_argument("-secret_key", type=str, help="AWS Secret Access Key (optional)")
     parser.add_argument("-bucket", type=str, help="S3 Bucket name (optional)")
 
+    # Concurrency and provider quota
+    parser.add_argument("-workers", type=int, default=1, help="Number of tickers to download concurrently")
+    parser.add_argument("-rate_limit", type=float, help="Maximum API requests per second (optional)")
+    parser.add_argument("-burst", type=float, help="Maximum burst of API requests above the rate limit (optional)")
+    parser.add_argument("-incremental", action="store_true", help="Only fetch bars newer than the stored history")
+    parser.add_argument("-formats", type=str, default=",".join(DEFAULT_FORMATS), help="Comma-separated storage formats: parquet, json")
+
+    # Checkpointing
+    parser.add_argument("-resume", "--resume", action="store_true", help="Skip tickers finished by the last run and retry its failures")
+    parser.add_argument("-retries", type=int, default=3, help="Retries with exponential backoff for previously failed tickers")
+
     args = parser.parse_args()
-    download_stock_data(args.api_token, args.dir, args.num_stocks, args.access_key, args.secret_key, args.bucket)
+    download_stock_data(args.api_token, args.dir, args.num_stocks, args.access_key, args.secret_key, args.bucket,
+                        args.workers, args.rate_limit, args.burst, args.incremental,
+                        args.resume, args.retries, args.active_as_of, args.formats.split(","))
@@ -0,0 +1,307 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from price_store import S3_BUCKET, load_prices
+from schedules import FREQUENCIES, schedule_rows
+
+LOAD_WORKERS = 16
+# Combinations evaluated per task; a task ships its ticker's arrays once
+CHUNK_SIZE = 200
+YEAR_NS = 365.25 * 24 * 60 * 60 * 10**9
+# IRR search: rounds of narrowing a bracket split into this many points (about 1e-7 precision)
+IRR_ROUNDS = 5
+IRR_GRID = 33
+SWEEP_COLUMNS = ['open', 'close', 'cumulativeFactor']
+# Workers start from a clean server process rather than a fork of a threaded caller (e.g. the app)
+POOL_CONTEXT = "forkserver"
+
+
+def _grid_values(grid, name, default):
+    # A single value (or a comma separated string) stands for a list of one
+    values = grid.get(name, default)
+    if isinstance(values, str):
+        values = [v for v in values.replace(" ", "").split(",") if v]
+    elif isinstance(values, (int, float)):
+        values = [values]
+    elif not isinstance(values, (list, tuple)):
+        raise ValueError(f"'{name}' must be a list")
+    return list(dict.fromkeys(values))
+
+
+def _grid_date(value, name):
+    try:
+        date = pd.to_datetime(value, utc=True)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name} '{value}'")
+    if pd.isna(date):
+        raise ValueError(f"Invalid {name} '{value}'")
+    return date.strftime("%Y-%m-%d") if date == date.normalize() else date.isoformat()
+
+
+def expand_grid(grid):
+    """
+    Every (ticker, rule) combination of a sweep grid.
+
+    grid keys: tickers, types (dca / fqr), frequencies, start_dates, end_date (None or "" runs to
+    the latest bar), dollar_amounts (dca) and quantities (fqr). Lists may be given as a single
+    value or a comma separated string; repeated values are swept once.
+
+    :return: list of (ticker, rule dict) pairs
+    :raise ValueError: on an empty or invalid grid
+    """
+    if not isinstance(grid, dict):
+        raise ValueError("The sweep grid must be an object")
+    tickers = list(dict.fromkeys(str(t).lower().strip() for t in _grid_values(grid, "tickers", [])))
+    frequencies = _grid_values(grid, "frequencies", ["weekly", "monthly"])
+    start_dates = _grid_values(grid, "start_dates", ["2020-01-01"])
+    start_dates = list(dict.fromkeys(_grid_date(d, "start date") for d in start_dates))
+    end_date = grid.get("end_date") or None
+    if end_date is not None:
+        end_date = _grid_date(end_date, "end date")
+    if not tickers or not all(tickers):
+        raise ValueError("The sweep grid needs at least one ticker")
+    if not start_dates:
+        raise ValueError("The sweep grid needs at least one start date")
+    for frequency in frequencies:
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Unknown frequency '{frequency}', expected one of {', '.join(FREQUENCIES)}")
+
+    amounts = []
+    for rule_type in _grid_values(grid, "types", ["dca"]):
+        if rule_type == "dca":
+            amounts += [("dca", float(a)) for a in _grid_values(grid, "dollar_amounts", [100])]
+        elif rule_type == "fqr":
+            amounts += [("fqr", float(q)) for q in _grid_values(grid, "quantities", [1])]
+        else:
+            raise ValueError(f"Unknown rule type '{rule_type}', expected dca or fqr")
+    amounts = list(dict.fromkeys(amounts))
+
+    return [
+        (ticker, {"type": rule_type, "amount": amount, "frequency": frequency,
+                  "start_date": start_date, "end_date": end_date})
+        for ticker, (rule_type, amount), frequency, start_date
+        in itertools.product(tickers, amounts, frequencies, start_dates)
+    ]
+
+
+def _irr(horizon, costs, final_value):
+    """
+    Annual rate at which buys costing costs, held for horizon years each, grow to final_value;
+    NaN if there is none in (-99.99%, 10000%).
+
+    The future value of the buys rises with the rate, so the root is bracketed on a grid of
+    log growth rates and the bracket narrowed a few times, all as array operations.
+    """
+    if final_value <= 0 or horizon.max() <= 0:
+        return float("nan")
+    low, high = np.log(1e-4), np.log(101.0)
+    for _ in range(IRR_ROUNDS):
+        x = np.linspace(low, high, IRR_GRID)
+        surplus = final_value - np.exp(np.outer(x, horizon)) @ costs
+        above = np.flatnonzero(surplus >= 0)
+        if len(above) == 0 or above[-1] == IRR_GRID - 1:
+            return float("nan")
+        low, high = x[above[-1]], x[above[-1] + 1]
+    return float(np.expm1((low + high) / 2))
+
+
+def evaluate_rule(arrays, rule, rows=None):
+    """
+    Outcome of one DCA / FQR rule over a ticker's price arrays, with the transactions engine's rules.
+
+    Buys fill at the open of their scheduled trading day; DCA quantities are sized on that day's
+    close (rounded to 6 decimals). Holdings are tracked split-adjusted and valued at every bar,
+    so the cash and holdings math is a handful of cumulative sums.
+
+    :param arrays: (dates as int64 ns, open, close, cumulativeFactor) of one ticker, sorted by date
+    :param rule: rule from expand_grid
+    :param rows: the rule's schedule rows, when already computed
+    :return: dict with buys, shares, invested, final_value, avg_cost, irr and max_drawdown
+    """
+    dates_ns, opens, closes, factors = arrays
+    if rows is None:
+        rows = rule_rows(pd.Series(dates_ns.view("datetime64[ns]")), rule)
+
+    result = {"buys": int(len(rows)), "shares": 0.0, "invested": 0.0, "final_value": 0.0,
+              "avg_cost": float("nan"), "irr": float("nan"), "max_drawdown": float("nan")}
+    if len(rows) == 0:
+        return result
+
+    if rule["type"] == "dca":
+        quantity = np.round(rule["amount"] / closes[rows], 6)
+    else:
+        quantity = np.full(len(rows), rule["amount"])
+    cost = opens[rows] * quantity
+
+    n = len(dates_ns)
+    flows = np.bincount(rows, weights=cost, minlength=n)
+    adj_quantity = np.cumsum(np.bincount(rows, weights=quantity * factors[rows], minlength=n))
+    value = adj_quantity / factors * opens
+
+    first = int(rows.min())
+    shares = adj_quantity[-1] / factors[-1]
+    invested = float(cost.sum())
+    result.update(shares=float(shares), invested=invested, final_value=float(value[-1]),
+                  avg_cost=float(invested / shares) if shares else float("nan"))
+
+    # Drawdown of the time-weighted unit value, so new money does not hide losses
+    held = value[first:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        growth = (held[1:] - flows[first + 1:]) / held[:-1]
+    nav = np.concatenate([[1.0], np.cumprod(np.where(np.isfinite(growth), growth, 1.0))])
+    result["max_drawdown"] = float(np.min(nav / np.maximum.accumulate(nav) - 1))
+
+    # Money-weighted return: buys out, the final value back on the last bar
+    result["irr"] = _irr((dates_ns[-1] - dates_ns[rows]) / YEAR_NS, cost, value[-1])
+    return result
+
+
+def rule_rows(dates, rule):
+    """Schedule rows of a rule over a ticker's dates (a datetime64 Series); open-ended rules run to the latest bar."""
+    start_date = pd.to_datetime(rule["start_date"], utc=True)
+    end_date = pd.to_datetime(rule["end_date"], utc=True) if rule["end_date"] else pd.Timestamp(dates.iloc[-1], tz="UTC")
+    return schedule_rows(dates, rule["frequency"], start_date, end_date)
+
+
+def _evaluate_chunk(ticker, arrays, rules):
+    dates = pd.Series(arrays[0].view("datetime64[ns]"))
+    # Rules differing only in type or amount share a schedule
+    schedules = {}
+    rows = []
+    for rule in rules:
+        key = (rule["frequency"], rule["start_date"], rule["end_date"])
+        if key not in schedules:
+            schedules[key] = rule_rows(dates, rule)
+        outcome = evaluate_rule(arrays, rule, schedules[key])
+        # None rather than NaN, so rows serialize as JSON
+        outcome = {k: (None if isinstance(v, float) and not np.isfinite(v) else v) for k, v in outcome.items()}
+        rows.append({"ticker": ticker, "type": rule["type"], "amount": rule["amount"], "frequency": rule["frequency"],
+                     "start_date": rule["start_date"], "end_date": rule["end_date"], **outcome})
+    return rows
+
+
+def _price_arrays(df):
+    df = df.sort_values("date", kind="stable")
+    return (df["date"].to_numpy(dtype="datetime64[ns]").astype("int64"),
+            df["open"].to_numpy(dtype="float64"),
+            df["close"].to_numpy(dtype="float64"),
+            df["cumulativeFactor"].to_numpy(dtype="float64"))
+
+
+def run_sweep(grid, directory=None, bucket_name=S3_BUCKET, s3=None, max_workers=None):
+    """
+    Backtest every combination of a DCA / FQR parameter grid.
+
+    Each ticker's prices are loaded once (on a thread pool) and turned into plain arrays, then
+    the combinations are evaluated in chunks on a process pool, one ticker's arrays per chunk.
+
+    :param grid: see expand_grid
+    :param directory: local price folder instead of S3
+    :param max_workers: worker processes (default: CPU count; 1 evaluates in this process)
+    :return: dict with results (one row per combination, best IRR first; metrics that do not
+             exist, e.g. the IRR of a rule that never bought, are None), errors per ticker,
+             combinations and seconds
+    """
+    start = time.monotonic()
+    combinations = expand_grid(grid)
+    tickers = sorted({ticker for ticker, _ in combinations})
+
+    def load(ticker):
+        try:
+            df = load_prices(ticker, columns=SWEEP_COLUMNS, directory=directory, bucket_name=bucket_name, s3=s3)
+            return ticker, _price_arrays(df), None
+        except Exception as e:
+            return ticker, None, str(e)
+
+    arrays = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=min(LOAD_WORKERS, len(tickers))) as executor:
+        for ticker, ticker_arrays, error in executor.map(load, tickers):
+            if error is None and len(ticker_arrays[0]):
+                arrays[ticker] = ticker_arrays
+            else:
+                errors[ticker] = error or "No price data"
+
+    tasks = []
+    for ticker in arrays:
+        rules = sorted((rule for t, rule in combinations if t == ticker),
+                       key=lambda rule: (rule["frequency"], rule["start_date"]))
+        tasks += [(ticker, rules[i:i + CHUNK_SIZE]) for i in range(0, len(rules), CHUNK_SIZE)]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    results = []
+    if max_workers == 1 or len(tasks) <= 1:
+        for ticker, rules in tasks:
+            results += _evaluate_chunk(ticker, arrays[ticker], rules)
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)),
+                                 mp_context=multiprocessing.get_context(POOL_CONTEXT)) as executor:
+            futures = [executor.submit(_evaluate_chunk, ticker, arrays[ticker], rules) for ticker, rules in tasks]
+            for future in futures:
+                results += future.result()
+
+    results.sort(key=lambda row: -row["irr"] if row["irr"] is not None else np.inf)
+    return {"results": results, "errors": errors, "combinations": len(combinations),
+            "seconds": round(time.monotonic() - start, 3)}
+
+
+def best_by(results, field, metric="irr", lowest=False):
+    """Best row for each value of field (e.g. frequency or start_date), by metric."""
+    best = {}
+    for row in results:
+        value = row[metric]
+        if value is None:
+            continue
+        current = best.get(row[field])
+        if current is None or (value < current[metric] if lowest else value > current[metric]):
+            best[row[field]] = row
+    return best
+
+
+def _number(value, scale=1, suffix=""):
+    return "n/a" if value is None else f"{value * scale:.2f}{suffix}"
+
+
+def print_sweep(sweep, top=20):
+    print(f"Evaluated {sweep['combinations']} combinations in {sweep['seconds']:.2f} seconds")
+    for ticker, error in sweep["errors"].items():
+        print(f"[ERROR] {ticker}: {error}")
+    print("Ticker, Type, Amount, Frequency, Start, Buys, Invested, Final Value, Avg Cost, IRR, Max Drawdown")
+    for row in sweep["results"][:top]:
+        print(f"{row['ticker'].upper()}, {row['type']}, {row['amount']:.2f}, {row['frequency']}, {row['start_date']}, "
+              f"{row['buys']}, {row['invested']:.2f}, {row['final_value']:.2f}, {_number(row['avg_cost'])}, "
+              f"{_number(row['irr'], 100, '%')}, {_number(row['max_drawdown'], 100, '%')}")
+
+    print("\nLowest average cost by frequency:")
+    for frequency, row in best_by(sweep["results"], "frequency", "avg_cost", lowest=True).items():
+        print(f"{frequency}: {row['ticker'].upper()} from {row['start_date']} at {row['avg_cost']:.2f}")
+    print("\nBest IRR by start date:")
+    for start_date, row in best_by(sweep["results"], "start_date").items():
+        print(f"{start_date}: {row['ticker'].upper()} {row['frequency']} at {row['irr'] * 100:.2f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest a grid of DCA / fixed-quantity rules across tickers.")
+    parser.add_argument("-tickers", nargs="+", required=True, help="Tickers to sweep")
+    parser.add_argument("-types", nargs="+", default=["dca"], help="Rule types: dca, fqr")
+    parser.add_argument("-frequencies", nargs="+", default=["weekly", "monthly"], help=f"Any of {', '.join(FREQUENCIES)}")
+    parser.add_argument("-start_dates", nargs="+", default=["2020-01-01"], help="Start dates (YYYY-MM-DD)")
+    parser.add_argument("-end_date", type=str, default=None, help="End date (YYYY-MM-DD), latest bar when omitted")
+    parser.add_argument("-dollar_amounts", nargs="+", type=float, default=[100], help="DCA amounts")
+    parser.add_argument("-quantities", nargs="+", type=float, default=[1], help="FQR quantities")
+    parser.add_argument("-data_folder", type=str, help="Local price folder (S3 when omitted)")
+    parser.add_argument("-workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("-top", type=int, default=20, help="Rows to print")
+
+    args = parser.parse_args()
+    grid = {"tickers": args.tickers, "types": args.types, "frequencies": args.frequencies,
+            "start_dates": args.start_dates, "end_date": args.end_date,
+            "dollar_amounts": args.dollar_amounts, "quantities": args.quantities}
+    print_sweep(run_sweep(grid, directory=args.data_folder, max_workers=args.workers), args.top)
@@ -1,34 +1,18 @@
 # token_manager.py
-import boto3
-import json
+from token_store import TOKEN_STORE, TOKENS_BUCKET, TOKENS_KEY
 import uuid
 from datetime import datetime, timezone
 
-S3_BUCKET = 'stonk-api-storage'
-TOKENS_KEY = 'tokens.json'
+S3_BUCKET = TOKENS_BUCKET
 
 def load_tokens():
-    s3 = boto3.client('s3')
-    response = s3.get_object(Bucket=S3_BUCKET, Key=TOKENS_KEY)
-    return json.loads(response['Body'].read())
-
-def save_tokens(data):
-    s3 = boto3.client('s3')
-    s3.put_object(
-        Bucket=S3_BUCKET,
-        Key=TOKENS_KEY,
-        Body=json.dumps(data, indent=2).encode('utf-8')
-    )
+    return {"tokens": TOKEN_STORE.log.read()}
 
 def add_token(username, token_type, valid_from, expires_at):
     now = datetime.now(timezone.utc).isoformat()
     new_token = str(uuid.uuid4())
 
-    data = load_tokens()
-    if "tokens" not in data:
-        data["tokens"] = []
-
-    data["tokens"].append({
+    TOKEN_STORE.log.append({
         "token": new_token,
         "username": username,
         "type": token_type,
@@ -36,13 +20,10 @@ def add_token(username, token_type, valid_from, expires_at):
         "valid_from": valid_from,
         "expires_at": expires_at
     })
-
-    save_tokens(data)
+    # Auth checks in this process see the change right away
+    TOKEN_STORE.invalidate()
     return new_token
 
 def delete_token(token_to_remove):
-    data = load_tokens()
-    tokens = data.get("tokens", [])
-    tokens = [t for t in tokens if t["token"] != token_to_remove]
-    data["tokens"] = tokens
-    save_tokens(data)
+    TOKEN_STORE.log.delete({"token": token_to_remove})
+    TOKEN_STORE.invalidate()
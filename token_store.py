@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from segment_log import SegmentLog
+
+TOKENS_BUCKET = 'stonk-api-storage'
+TOKENS_KEY = 'tokens.json'
+# Seconds between revalidations of tokens.json against S3
+TOKENS_TTL = 30
+# Seconds the last loaded tokens stay in use while S3 cannot be reached; after that every token is rejected
+TOKENS_MAX_STALE = 5 * TOKENS_TTL
+
+# record is the stored token dict; valid_from / expires_at are parsed, or None if unparseable
+TokenEntry = namedtuple("TokenEntry", ["record", "valid_from", "expires_at"])
+
+
+# Parses datetime string into datetime object with UTC timezone.
+# This is necessary, since the user input from the browser is set to local timezone,
+# this function helps normalize the time zones between the token json data and browser timezones.
+# Example testcase:
+# dt_str = "2023-10-27T10:00:00Z" # ISO 8601 with 'Z' for UTC
+# expected_dt = datetime(2023, 10, 27, 10, 0, 0, tzinfo=timezone.utc)
+# self.assertEqual(parse_iso_utc(dt_str), expected_dt)
+def parse_iso_utc(dt_str):
+    if dt_str.endswith('Z'):
+        dt_str = dt_str[:-1] + '+00:00'
+    dt = datetime.fromisoformat(dt_str)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _entry(record):
+    try:
+        return TokenEntry(record, parse_iso_utc(record["valid_from"]), parse_iso_utc(record["expires_at"]))
+    except Exception:
+        return TokenEntry(record, None, None)
+
+
+class TokenStore:
+    """
+    In-memory index of the API tokens in S3, token -> TokenEntry with timestamps already parsed.
+
+    The tokens log (tokens.json plus its segments, see segment_log) is re-read at most every
+    ttl seconds: one listing and a conditional GET of the snapshot, and only new segments are
+    fetched. An auth check is a dict lookup. token_gen invalidates the store after each
+    change, so admin edits apply in this process at once; other processes see them within
+    ttl seconds.
+
+    If S3 cannot be reached the last loaded tokens stay in use for up to max_stale seconds
+    after the last successful load, then the store fails closed and rejects every token. A
+    token revoked in another process can therefore keep authenticating here for up to
+    max_stale seconds (ttl if S3 is reachable).
+    """
+
+    def __init__(self, bucket_name=TOKENS_BUCKET, key=TOKENS_KEY, ttl=TOKENS_TTL, max_stale=TOKENS_MAX_STALE, s3=None):
+        self.log = SegmentLog(bucket_name, key, field="tokens", s3=s3)
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._index = {}
+        self._records = []
+        self._checked_at = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+                return
+            try:
+                records = self.log.read()
+                # Built aside and swapped in, so concurrent lookups never see a half-built index; records
+                # without a token string are left out, so a missing token never matches one
+                self._index = {r["token"]: _entry(r) for r in records
+                               if isinstance(r.get("token"), str) and r["token"]}
+                self._records = records
+                self._loaded_at = time.monotonic()
+            except Exception as e:
+                print(f"Error loading API tokens from S3: {e}")
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_stale:
+                    self._index = {}
+                    self._records = []
+            self._checked_at = time.monotonic()
+
+    def lookup(self, token_value):
+        """TokenEntry for a token, or None if it does not exist."""
+        self._refresh()
+        return self._index.get(token_value)
+
+    def tokens(self):
+        """All token records, as stored."""
+        self._refresh()
+        return list(self._records)
+
+    def invalidate(self):
+        """Reload from S3 on the next lookup."""
+        with self._lock:
+            self._checked_at = None
+
+
+TOKEN_STORE = TokenStore()
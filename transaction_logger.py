@@ -1,22 +1,45 @@
-import json
-import boto3
+import threading
+from collections import OrderedDict
 
-s3_client = boto3.client('s3')
+from segment_log import SegmentLog
+
+# Transactions files whose SegmentLog (and its cached segment bodies) stays in memory
+LOG_CACHE_SIZE = 256
+
+_logs = OrderedDict()
+_logs_lock = threading.Lock()
+
+
+def transaction_log(bucket_name, transactions_key):
+    """
+    The shared SegmentLog of a transactions file.
+
+    One instance per file keeps its segment bodies cached between calls, so a read costs a
+    listing, a conditional GET of the snapshot and a GET per segment it has not seen yet.
+    """
+    with _logs_lock:
+        log = _logs.get((bucket_name, transactions_key))
+        if log is None:
+            log = _logs[(bucket_name, transactions_key)] = SegmentLog(bucket_name, transactions_key)
+            if len(_logs) > LOG_CACHE_SIZE:
+                _logs.popitem(last=False)
+        else:
+            _logs.move_to_end((bucket_name, transactions_key))
+        return log
 
 
 def load_transactions(bucket_name, transactions_key):
     """
     Load transactions from S3.
-    
+
+    The file is a segment log: the JSON list at transactions_key plus any appended segments.
+
     :param bucket_name: S3 bucket name
     :param transactions_key: Path/key to the transactions file in S3
     :return: list of transactions (empty list if file not found or error)
     """
     try:
-        obj = s3_client.get_object(Bucket=bucket_name, Key=transactions_key)
-        return json.loads(obj['Body'].read().decode('utf-8'))
-    except s3_client.exceptions.NoSuchKey:
-        return []  # no file yet
+        return transaction_log(bucket_name, transactions_key).read()
     except Exception as e:
         print(f"[ERROR] Could not load transactions: {e}")
         return []
@@ -24,23 +47,32 @@ def load_transactions(bucket_name, transactions_key):
 
 def save_transaction(bucket_name, transactions_key, transaction):
     """
-    Append a new transaction and save back to S3.
-    
+    Append a new transaction as its own segment object, without rewriting the file.
+
     :param bucket_name: S3 bucket name
     :param transactions_key: Path/key to the transactions file in S3
     :param transaction: dict representing the transaction to save
     :return: True if saved successfully, False otherwise
     """
-    transactions = load_transactions(bucket_name, transactions_key)
-    transactions.append(transaction)
-
     try:
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=transactions_key,
-            Body=json.dumps(transactions, indent=2)
-        )
+        transaction_log(bucket_name, transactions_key).append(transaction)
         return True
     except Exception as e:
         print(f"[ERROR] Could not save transaction: {e}")
         return False
+
+
+def reset_transactions(bucket_name, transactions_key):
+    """
+    Create an empty transactions file, or empty an existing one, segments included.
+
+    :param bucket_name: S3 bucket name
+    :param transactions_key: Path/key to the transactions file in S3
+    :return: True if the file is now empty, False otherwise
+    """
+    try:
+        transaction_log(bucket_name, transactions_key).reset()
+        return True
+    except Exception as e:
+        print(f"[ERROR] Could not reset transactions: {e}")
+        return False
@@ -2,6 +2,135 @@
 from app import parse_iso_utc
 import unittest
 from datetime import datetime, timezone
+import pandas as pd
+from split_adjust import add_split_adjustment
+import numpy as np
+from correlation_engine import pairwise_correlation, top_correlations
+from price_panel import PricePanel, build_panel, open_panel
+from correlation_matrix import CorrelationMatrix, _block_stats, compute_matrix, correlation_block
+import app
+from stock_correlations import find_top_correlations
+import s3_cache
+import threading
+from shared_price_cache import SharedPriceCache
+import json
+import os
+import tempfile
+import time
+from frame_cache import FrameCache
+from segment_log import apply_op, SegmentLog, COMPACTED_THROUGH
+from token_store import TokenStore
+from unittest import mock
+from portfolio import resolve_trade_dates, build_portfolio, expand_rules, transaction_stock
+from transactions import format_report
+from schedules import schedule_rows, normalize_rule
+from sweep import evaluate_rule, expand_grid, _irr
+from pairs_scan import candidate_pairs, half_life
+import hashlib
+import io
+from botocore.exceptions import ClientError
+
+
+def client_error(code, status):
+    return ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "S3")
+
+
+def write_panel(panel_dir, closes):
+    """Write a closes frame (UTC dates x tickers, NaN where a ticker did not trade) as the current panel."""
+    path = os.path.join(panel_dir, "panel-test")
+    os.makedirs(path, exist_ok=True)
+    close = closes.to_numpy(dtype="float64")
+    returns = np.full(close.shape, np.nan)
+    for j in range(close.shape[1]):
+        rows = np.flatnonzero(~np.isnan(close[:, j]))
+        returns[rows[1:], j] = close[rows[1:], j] / close[rows[:-1], j] - 1
+    np.save(os.path.join(path, "dates.npy"), closes.index.as_unit("ns").asi8)
+    np.save(os.path.join(path, "close.npy"), close)
+    np.save(os.path.join(path, "returns.npy"), returns)
+    np.save(os.path.join(path, "valid.npy"), ~np.isnan(close))
+    with open(os.path.join(path, "tickers.json"), "w") as f:
+        json.dump([c.lower() for c in closes.columns], f)
+    with open(os.path.join(panel_dir, "CURRENT"), "w") as f:
+        f.write("panel-test")
+    return path
+
+
+def random_closes(days=60, tickers=4, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2021-01-01", periods=days, tz="UTC")
+    closes = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (days, tickers)), axis=0)), index=dates,
+                          columns=[f"t{j}" for j in range(tickers)])
+    closes.iloc[rng.random((days, tickers)) < 0.1] = np.nan
+    return closes
+
+
+def app_client(test):
+    """Flask test client whose token store holds token "t" for user "u"."""
+    s3 = StubS3()
+    s3.objects["tokens.json"] = (json.dumps({"tokens": [{
+        "token": "t", "username": "u", "type": "user",
+        "valid_from": "2000-01-01T00:00:00Z", "expires_at": "2100-01-01T00:00:00Z"
+    }]}).encode(), {})
+    patcher = mock.patch("app.TOKEN_STORE", TokenStore("bucket", "tokens.json", s3=s3))
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return app.app.test_client()
+
+
+class StubS3:
+    """Dict-backed S3 client with the conditional requests the stores use."""
+
+    def __init__(self):
+        self.objects = {}  # key -> (body, metadata)
+        self.calls = []
+        self.on_get = None
+        self.fail = False
+
+    def _etag(self, body):
+        return '"%s"' % hashlib.md5(body).hexdigest()
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self.calls.append(("get", Key))
+        if self.fail:
+            raise client_error("InternalError", 500)
+        if self.on_get:
+            self.on_get(Key)
+        if Key not in self.objects:
+            raise client_error("NoSuchKey", 404)
+        body, metadata = self.objects[Key]
+        if IfNoneMatch and IfNoneMatch == self._etag(body):
+            raise client_error("304", 304)
+        return {"Body": io.BytesIO(body), "ETag": self._etag(body), "ContentLength": len(body), "Metadata": metadata}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.calls.append(("head", Key))
+        if Key not in self.objects:
+            raise client_error("404", 404)
+        body, metadata = self.objects[Key]
+        return {"ETag": self._etag(body), "ContentLength": len(body), "Metadata": metadata}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, Metadata=None, **kwargs):
+        self.calls.append(("put", Key))
+        body = Body.encode() if isinstance(Body, str) else Body
+        current = self.objects.get(Key)
+        if (IfNoneMatch == "*" and current) or (IfMatch and (not current or self._etag(current[0]) != IfMatch)):
+            raise client_error("PreconditionFailed", 412)
+        self.objects[Key] = (body, Metadata or {})
+        return {"ETag": self._etag(body)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop(Key, None)
+
+    def get_paginator(self, name):
+        stub = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix="", **kwargs):
+                keys = sorted(k for k in stub.objects if k.startswith(Prefix))
+                yield {"Contents": [{"Key": k} for k in keys]} if keys else {}
+
+        return Paginator()
+
 
 # Unit test class
 class TestParseIsoUtc(unittest.TestCase):
@@ -34,6 +163,524 @@ class TestParseIsoUtc(unittest.TestCase):
         with self.assertRaises(ValueError):
             parse_iso_utc(dt_str)
 
+class TestSplitAdjustment(unittest.TestCase):
+    def test_cumulative_factor_includes_own_split(self):
+        df = pd.DataFrame({"open": [200.0, 100.0, 50.0], "splitFactor": [1.0, 2.0, 2.0]})
+        df = add_split_adjustment(df)
+        self.assertEqual(df["cumulativeFactor"].tolist(), [4.0, 4.0, 2.0])
+
+    def test_adjusted_open_only_divides_by_later_splits(self):
+        df = pd.DataFrame({"open": [200.0, 100.0, 50.0], "splitFactor": [1.0, 2.0, 2.0]})
+        df = add_split_adjustment(df)
+        self.assertEqual(df["splitAdjOpen"].tolist(), [50.0, 50.0, 50.0])
+
+    def test_missing_split_factor_treated_as_one(self):
+        df = pd.DataFrame({"close": [10.0, 10.0], "splitFactor": [None, 1.0]})
+        df = add_split_adjustment(df)
+        self.assertEqual(df["cumulativeFactor"].tolist(), [1.0, 1.0])
+        self.assertEqual(df["splitAdjClose"].tolist(), [10.0, 10.0])
+
+class TestBuildPanel(unittest.TestCase):
+    def test_aligns_tickers_on_the_union_of_dates(self):
+        prices = {
+            "aaa": [("2021-01-04", 10.0), ("2021-01-05", 11.0), ("2021-01-07", 12.1)],
+            "bbb": [("2021-01-05", 20.0), ("2021-01-06", None), ("2021-01-07", 22.0)],
+        }
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        for ticker, bars in prices.items():
+            with open(os.path.join(data_dir.name, f"{ticker}_data.json"), "w") as f:
+                json.dump([{"date": f"{d}T00:00:00.000Z", "close": c, "adjClose": c, "splitFactor": 1.0}
+                           for d, c in bars], f)
+        panel_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(panel_dir.cleanup)
+
+        with mock.patch("price_store.SHARED_CACHE", None):
+            path = build_panel(out_dir=panel_dir.name, directory=data_dir.name, tickers=["AAA", "bbb", "ccc"])
+        panel = open_panel(panel_dir.name)
+        self.assertEqual(panel.path, path)
+        self.assertEqual(panel.tickers, ["aaa", "bbb"])
+        self.assertEqual(list(panel.date_index().strftime("%Y-%m-%d")),
+                         ["2021-01-04", "2021-01-05", "2021-01-06", "2021-01-07"])
+        nan = np.nan
+        np.testing.assert_allclose(panel.close, [[10.0, nan], [11.0, 20.0], [nan, nan], [12.1, 22.0]])
+        # Each ticker against its own previous bar; a missing close leaves the next return undefined
+        np.testing.assert_allclose(panel.returns, [[nan, nan], [0.1, nan], [nan, nan], [0.1, nan]])
+        np.testing.assert_array_equal(panel.valid, [[True, False], [True, True], [False, False], [True, True]])
+
+class TestPairwiseCorrelation(unittest.TestCase):
+    def test_matches_pandas_on_pairwise_complete_rows(self):
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(50, 3))
+        X[rng.random((50, 3)) < 0.2] = np.nan
+        y = X[:, 0] + rng.normal(size=50)
+        y[:5] = np.nan
+        expected = [pd.Series(y).corr(pd.Series(X[:, j])) for j in range(3)]
+        np.testing.assert_allclose(pairwise_correlation(y, X), expected)
+
+    def test_empty_window_has_no_correlations(self):
+        with tempfile.TemporaryDirectory() as panel_dir:
+            panel = PricePanel(write_panel(panel_dir, random_closes()))
+            self.assertEqual(top_correlations(panel, "t0", 3, "2022-01-01", "2022-02-01"), [])
+            self.assertEqual(top_correlations(panel, "t0", 3, "2021-02-01", "2021-01-01"), [])
+
+class TestCorrelationUniverse(unittest.TestCase):
+    def test_scanner_reads_the_cached_universe_by_default(self):
+        with tempfile.TemporaryDirectory() as panel_dir:
+            write_panel(panel_dir, random_closes(tickers=5))
+            with mock.patch("stock_correlations.load_universe", return_value=["t1", "t2"]) as load:
+                found = find_top_correlations("t0", 10, "2021-01-01", "2021-03-01", panel_dir=panel_dir)
+                self.assertEqual(sorted(t for t, _ in found), ["T1", "T2"])
+                found = find_top_correlations("t0", 10, "2021-01-01", "2021-03-01", panel_dir=panel_dir,
+                                              use_universe=False)
+                self.assertEqual(len(found), 4)
+                self.assertEqual(load.call_count, 1)
+
+class TestCorrelationMatrix(unittest.TestCase):
+    def setUp(self):
+        self.closes = random_closes(days=80, tickers=6)
+        panel_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(panel_dir.cleanup)
+        self.panel_dir = panel_dir.name
+        write_panel(self.panel_dir, self.closes)
+        out_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(out_dir.cleanup)
+        self.out_dir = out_dir.name
+        # Returns taken within the window, each ticker against its own previous bar
+        window = self.closes.loc["2021-01-10":"2021-03-10"]
+        self.expected = window.apply(lambda c: c.dropna().pct_change()).corr()
+
+    def test_block_matches_pandas(self):
+        returns = self.closes.pct_change(fill_method=None).to_numpy()
+        stats = _block_stats(returns, slice(0, 6))
+        np.testing.assert_allclose(correlation_block(stats, stats),
+                                   pd.DataFrame(returns).corr().to_numpy(), atol=1e-12)
+
+    def test_dense_and_top_k_match_pandas(self):
+        dense = CorrelationMatrix(compute_matrix("2021-01-10", "2021-03-10", self.out_dir, self.panel_dir,
+                                                 top_k=0, block_size=4, name="dense"))
+        self.assertEqual(dense.tickers, list(self.expected.columns))
+        np.testing.assert_allclose(dense.corr, self.expected.to_numpy(), atol=1e-6)
+
+        sparse = CorrelationMatrix(compute_matrix("2021-01-10", "2021-03-10", self.out_dir, self.panel_dir,
+                                                  top_k=2, block_size=4, name="sparse"))
+        expected = self.expected["t0"].drop("t0").sort_values(ascending=False)[:2]
+        self.assertEqual([t for t, _ in sparse.top("t0")], [t.upper() for t in expected.index])
+        np.testing.assert_allclose([c for _, c in sparse.top("t0")], expected.to_numpy(), atol=1e-6)
+
+    def test_empty_window_writes_an_empty_matrix(self):
+        matrix = CorrelationMatrix(compute_matrix("2022-01-01", "2022-02-01", self.out_dir, self.panel_dir, name="empty"))
+        self.assertEqual(matrix.tickers, [])
+        self.assertIsNone(matrix.top("t0"))
+
+    def test_stored_matrix_is_queryable_without_the_job(self):
+        compute_matrix("2021-01-10", "2021-03-10", self.out_dir, self.panel_dir, top_k=2, name="job-1")
+        client = app_client(self)
+        with mock.patch("app.MATRIX_DIR", self.out_dir):
+            response = client.get("/correlation/matrix/job-1/t0?token=t")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.get_json()["correlations"]), 2)
+            self.assertEqual(client.get("/correlation/matrix/job-2/t0?token=t").status_code, 404)
+            for top in ("x", "-1"):
+                self.assertEqual(client.get(f"/correlation/matrix/job-1/t0?token=t&top={top}").status_code, 400)
+        for top_k in ("x", "-1"):
+            self.assertEqual(client.get(f"/correlation/matrix/submit?token=t&top_k={top_k}").status_code, 400)
+
+class TestFrameCache(unittest.TestCase):
+    def test_evicts_least_recently_used_past_budget(self):
+        cache = FrameCache(max_mb=1)
+        frame = pd.DataFrame({"close": np.zeros(50000)})  # ~0.4 MB
+        cache.put("a", frame)
+        cache.put("b", frame)
+        cache.get("a")
+        cache.put("c", frame)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_callers_cannot_modify_cached_frame(self):
+        cache = FrameCache()
+        cache.put("a", pd.DataFrame({"close": [1.0, 2.0]}))
+        df = cache.get("a")
+        df.loc[0, "close"] = 99.0
+        self.assertEqual(cache.get("a")["close"].tolist(), [1.0, 2.0])
+
+class TestSegmentLogOps(unittest.TestCase):
+    def test_append_then_delete_in_order(self):
+        records = [{"token": "a"}]
+        apply_op(records, {"op": "append", "record": {"token": "b"}})
+        apply_op(records, {"op": "delete", "match": {"token": "a"}})
+        apply_op(records, {"op": "append", "record": {"token": "a"}})
+        self.assertEqual(records, [{"token": "b"}, {"token": "a"}])
+
+    def test_empty_match_deletes_nothing(self):
+        records = [{"token": "a"}]
+        apply_op(records, {"op": "delete", "match": {}})
+        self.assertEqual(records, [{"token": "a"}])
+
+class TestSegmentLog(unittest.TestCase):
+    def setUp(self):
+        self.s3 = StubS3()
+        self.log = SegmentLog("bucket", "tx.json", s3=self.s3)
+
+    def test_reset_truncates_segments(self):
+        self.log.reset()
+        self.log.append({"stock": "a"})
+        SegmentLog("bucket", "tx.json", s3=self.s3).append({"stock": "b"})
+        self.assertEqual(len(self.log.read()), 2)
+        self.log.reset()
+        self.assertEqual(self.log.read(), [])
+        self.assertEqual(SegmentLog("bucket", "tx.json", s3=self.s3).read(), [])
+
+    def test_read_survives_a_concurrent_compaction(self):
+        SegmentLog("bucket", "tx.json", s3=self.s3).append({"stock": "a"})
+        name = next(k for k in self.s3.objects if ".segments/" in k)
+
+        def compact_elsewhere(key):
+            # Another process folds the segment into the snapshot just before it is fetched
+            if key == name:
+                self.s3.on_get = None
+                self.s3.objects["tx.json"] = (b'[{"stock": "a"}]', {COMPACTED_THROUGH: name.rsplit("/", 1)[1]})
+                del self.s3.objects[name]
+
+        self.s3.on_get = compact_elsewhere
+        self.assertEqual(self.log.read(), [{"stock": "a"}])
+
+class TestTokenStore(unittest.TestCase):
+    def setUp(self):
+        self.s3 = StubS3()
+        self.s3.objects["tokens.json"] = (b'{"tokens": [{"token": "a"}]}', {})
+        self.store = TokenStore("bucket", "tokens.json", ttl=30, max_stale=150, s3=self.s3)
+        self.now = 1000.0
+        patcher = mock.patch("token_store.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ttl_refresh_and_invalidate(self):
+        self.assertIsNotNone(self.store.lookup("a"))
+        self.store.log.delete({"token": "a"})
+        # Cached until the TTL runs out, unless invalidated
+        self.now += 10
+        self.assertIsNotNone(self.store.lookup("a"))
+        self.store.invalidate()
+        self.assertIsNone(self.store.lookup("a"))
+
+        SegmentLog("bucket", "tokens.json", field="tokens", s3=self.s3).append({"token": "b"})
+        self.assertIsNone(self.store.lookup("b"))
+        self.now += 31
+        self.assertIsNotNone(self.store.lookup("b"))
+
+    def test_s3_errors_fail_closed_after_max_stale(self):
+        self.assertIsNotNone(self.store.lookup("a"))
+        self.s3.fail = True
+        self.now += 100
+        self.assertIsNotNone(self.store.lookup("a"))
+        self.now += 100
+        self.assertIsNone(self.store.lookup("a"))
+        self.assertEqual(TokenStore("bucket", "tokens.json", s3=self.s3).tokens(), [])
+
+    def test_records_without_a_token_never_match(self):
+        self.s3.objects["tokens.json"] = (b'{"tokens": [{"type": "admin"}, {"token": "", "type": "admin"}]}', {})
+        store = TokenStore("bucket", "tokens.json", s3=self.s3)
+        for token in (None, ""):
+            self.assertIsNone(store.lookup(token))
+        self.assertEqual(len(store.tokens()), 2)
+
+        client = app.app.test_client()
+        with mock.patch("app.TOKEN_STORE", store), mock.patch("app.add_token") as add, \
+                mock.patch("app.delete_token") as delete:
+            self.assertEqual(client.post("/admin/add_token", data={"username": "x"}).status_code, 403)
+            self.assertEqual(client.post("/admin/delete_token", data={"token": "a"}).status_code, 403)
+        add.assert_not_called()
+        delete.assert_not_called()
+
+class TestS3Cache(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        self.s3 = StubS3()
+
+    def get(self, key, **kwargs):
+        return s3_cache.get_object_bytes("bucket", key, s3=self.s3, cache_dir=self.cache_dir, **kwargs)
+
+    def test_stale_entry_is_revalidated_with_a_304(self):
+        self.s3.objects["a"] = (b"body", {})
+        self.assertEqual(self.get("a", max_age=0), b"body")
+        with mock.patch.object(self.s3, "get_object", wraps=self.s3.get_object) as get:
+            self.assertEqual(self.get("a", max_age=0), b"body")
+            self.assertEqual(get.call_args.kwargs["IfNoneMatch"], self.s3._etag(b"body"))
+        # A fresh entry costs no request at all
+        calls = len(self.s3.calls)
+        self.assertEqual(self.get("a", max_age=60), b"body")
+        self.assertEqual(len(self.s3.calls), calls)
+
+    def test_least_recently_used_entries_are_evicted_past_the_cap(self):
+        for key in "abc":
+            self.s3.objects[key] = (key.encode() * 500, {})
+        paths = {key: s3_cache._entry_path("bucket", key, self.cache_dir) for key in "abc"}
+        cap_mb = 1300 / (1024 * 1024)
+        for age, key in ((300, "a"), (200, "b")):
+            self.get(key, max_mb=cap_mb)
+            os.utime(paths[key], (time.time() - age, time.time()))
+        self.get("c", max_mb=cap_mb)
+        self.assertFalse(os.path.exists(paths["a"]))
+        self.assertTrue(os.path.exists(paths["b"]) and os.path.exists(paths["c"]))
+
+    def test_missing_key_is_cached_as_a_negative_entry(self):
+        with self.assertRaises(ClientError):
+            self.get("missing")
+        calls = len(self.s3.calls)
+        with self.assertRaises(FileNotFoundError):
+            self.get("missing")
+        self.assertEqual(len(self.s3.calls), calls)
+
+def mapped_file(array):
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    return None if array is None else array.filename
+
+
+class TestSharedPriceCache(unittest.TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        self.frame = pd.DataFrame({"date": pd.date_range("2021-01-01", periods=3, tz="UTC"), "close": [1.0, 2.0, 3.0]})
+
+    def test_new_version_invalidates_the_entry(self):
+        cache = SharedPriceCache(self.cache_dir)
+        cache.put("a", "v1", self.frame)
+        self.assertIsNone(cache.get("a", "v2"))
+        rewritten = self.frame.assign(close=[4.0, 5.0, 6.0])
+        SharedPriceCache(self.cache_dir).put("a", "v2", rewritten)
+        self.assertIsNone(cache.get("a", "v1"))
+        self.assertEqual(cache.get("a", "v2")["close"].tolist(), [4.0, 5.0, 6.0])
+        # The v1 files are gone, only the v2 entry is left
+        self.assertEqual(len([d for d in os.listdir(self.cache_dir) if not d.startswith("index")]), 1)
+
+    def test_loads_map_the_same_file(self):
+        SharedPriceCache(self.cache_dir).put("a", "v1", self.frame)
+        # Separate instances stand in for separate worker processes
+        first = SharedPriceCache(self.cache_dir).get("a", "v1")["close"].to_numpy()
+        second = SharedPriceCache(self.cache_dir).get("a", "v1")["close"].to_numpy()
+        self.assertIsNotNone(mapped_file(first))
+        self.assertEqual(mapped_file(first), mapped_file(second))
+        self.assertFalse(first.flags.writeable)
+
+    def test_concurrent_puts_keep_every_entry(self):
+        def put(key):
+            SharedPriceCache(self.cache_dir).put(key, "v1", self.frame)
+
+        threads = [threading.Thread(target=put, args=(f"k{i}",)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(SharedPriceCache(self.cache_dir).stats()["entries"], 8)
+
+class TestResolveTradeDates(unittest.TestCase):
+    def test_next_bar_within_ten_days(self):
+        dates = pd.Series(pd.to_datetime(["2020-01-02", "2020-01-03", "2020-01-20"], utc=True))
+        rows = resolve_trade_dates(dates, ["2020-01-02", "2020-01-01", "2020-01-04", "2020-01-10", "2020-02-01"])
+        self.assertEqual(rows.tolist(), [0, 0, -1, 2, -1])
+
+class TestBuildPortfolio(unittest.TestCase):
+    def test_sell_after_split_uses_adjusted_quantity(self):
+        prices = pd.DataFrame({
+            "date": pd.to_datetime(["2020-01-02", "2020-01-03", "2020-01-06"], utc=True),
+            "open": [100.0, 50.0, 60.0],
+            "cumulativeFactor": [2.0, 1.0, 1.0]
+        })
+        transactions = [
+            {"stock": "abc", "date": "2020-01-02", "action": "buy", "quantity": 10},
+            {"stock": "abc", "date": "2020-01-04", "action": "sell", "quantity": 20},
+            {"stock": "abc", "date": "2020-01-06", "action": "sell", "quantity": 1}
+        ]
+        result = build_portfolio(transactions, {"abc": prices})
+        self.assertEqual(result.ledger[1]["buy_date"], "2020-01-06")
+        self.assertIn("Cannot sell 1", result.ledger[2]["error"])
+        self.assertEqual(result.cash, 1200.0)
+        self.assertEqual(result.total_input, 1000.0)
+        self.assertEqual(result.daily["Total Money"].tolist(), [1000.0, 1000.0, 1200.0, 1200.0, 1200.0])
+
+    def test_report_without_money_invested(self):
+        prices = pd.DataFrame({"date": pd.to_datetime(["2020-01-02"], utc=True), "open": [10.0], "cumulativeFactor": [1.0]})
+        result = build_portfolio([{"stock": "abc", "date": "2020-01-02", "action": "sell", "quantity": 1}], {"abc": prices})
+        report = format_report(result)
+        self.assertIn("[ERROR] Cannot sell 1 shares of ABC", report)
+        self.assertIn("Total Percentage gain: n/a", report)
+
+class TestExpandRules(unittest.TestCase):
+    def test_open_ended_rule_extends_with_new_bars(self):
+        days = pd.bdate_range("2021-01-01", "2021-03-31", tz="UTC")
+        prices = pd.DataFrame({"date": days, "close": np.full(len(days), 10.0)})
+        rule = {"type": "dca", "stock": "ABC", "dollar_amount": 100, "frequency": "monthly",
+                "start_date": "2021-01-01", "end_date": None}
+        entries = [{"rule": rule}, {"stock": "abc", "date": "2021-02-15", "action": "sell", "quantity": 1}]
+
+        expanded = expand_rules(entries, {"abc": prices.iloc[:30]})
+        self.assertEqual([tx["date"] for tx in expanded], ["2021-01-01", "2021-02-01", "2021-02-15"])
+        expanded = expand_rules(entries, {"abc": prices})
+        self.assertEqual([tx["date"] for tx in expanded], ["2021-01-01", "2021-02-01", "2021-02-15", "2021-03-01"])
+
+    def test_sorts_on_parsed_dates(self):
+        days = pd.bdate_range("2021-01-01", "2021-03-31", tz="UTC")
+        prices = pd.DataFrame({"date": days, "open": 10.0, "close": 10.0, "cumulativeFactor": 1.0})
+        rule = {"type": "fqr", "stock": "abc", "quantity": 1, "frequency": "monthly",
+                "start_date": "2021-01-01", "end_date": "2021-03-31"}
+        entries = [{"rule": rule}, {"stock": "abc", "date": "2021-2-5", "action": "buy", "quantity": 1},
+                   {"stock": "abc", "date": "2021-01-31T23:00:00-05:00", "action": "buy", "quantity": 1}]
+        expanded = expand_rules(entries, {"abc": prices})
+        self.assertEqual([tx["date"] for tx in expanded],
+                         ["2021-01-01", "2021-02-01", "2021-01-31T23:00:00-05:00", "2021-2-5", "2021-03-01"])
+
+    def test_invalid_rule_is_a_ledger_error(self):
+        days = pd.bdate_range("2021-01-01", "2021-01-31", tz="UTC")
+        prices = pd.DataFrame({"date": days, "open": 10.0, "close": 10.0, "cumulativeFactor": 1.0})
+        entries = [{"rule": {"type": "dca", "stock": "abc", "frequency": "hourly"}},
+                   {"stock": "abc", "date": "2021-01-05", "action": "buy", "quantity": 2}]
+        self.assertIsNone(transaction_stock(entries[0]))
+        result = build_portfolio(entries, {"abc": prices})
+        self.assertEqual(len(result.ledger), 2)
+        self.assertIn("Unknown frequency 'hourly'", result.ledger[1]["error"])
+        self.assertEqual(result.ledger[0]["total_stocks"], 2.0)
+
+class TestScheduleRows(unittest.TestCase):
+    def setUp(self):
+        # Trading days 2021-01-04 .. 2021-03-31, with February missing
+        days = pd.bdate_range("2021-01-04", "2021-03-31", tz="UTC")
+        self.dates = pd.Series(days[(days.month != 2)])
+
+    def test_monthly_uses_first_trading_day_and_skips_empty_months(self):
+        start, end = pd.Timestamp("2021-01-01", tz="UTC"), pd.Timestamp("2021-12-31", tz="UTC")
+        rows = schedule_rows(self.dates, "monthly", start, end)
+        # January 1st is before the first bar, so only March is scheduled
+        self.assertEqual([d.strftime("%Y-%m-%d") for d in self.dates.iloc[rows]], ["2021-03-01"])
+
+    def test_weekly_fills_on_next_trading_day(self):
+        start, end = pd.Timestamp("2021-01-20", tz="UTC"), pd.Timestamp("2021-03-10", tz="UTC")
+        rows = schedule_rows(self.dates, "biweekly", start, end)
+        # Both Sundays in the February gap fill on March 1st
+        self.assertEqual([d.strftime("%Y-%m-%d") for d in self.dates.iloc[rows]],
+                         ["2021-01-25", "2021-03-01", "2021-03-01", "2021-03-08"])
+
+class TestNormalizeRule(unittest.TestCase):
+    def test_short_names_and_open_end(self):
+        rule = normalize_rule({"type": "FQR", "stock": " AAPL ", "quantity": "2", "frequency": "monthly",
+                               "start_date": "2021-01-01", "end_date": ""})
+        self.assertEqual(rule, {"type": "fqr", "stock": "aapl", "frequency": "monthly",
+                                "start_date": "2021-01-01 00:00:00+00:00", "end_date": None, "fixed_quantity": 2.0})
+
+    def test_invalid_specs_raise(self):
+        for spec in ({"type": "x", "stock": "a"}, {"stock": "a", "frequency": "daily"}, {"type": "dca"}):
+            with self.assertRaises(ValueError):
+                normalize_rule(spec)
+
+class TestRulesBatch(unittest.TestCase):
+    def setUp(self):
+        self.client = app_client(self)
+        self.s3 = StubS3()
+        dates = pd.bdate_range("2021-01-01", "2021-03-31", tz="UTC")
+        self.frames = {"aaa": pd.DataFrame({"date": dates, "close": 10.0}),
+                       "bbb": pd.DataFrame({"date": dates, "close": 20.0})}
+
+        def load_prices(stock, **kwargs):
+            if stock not in self.frames:
+                raise FileNotFoundError(stock)
+            return self.frames[stock]
+
+        for target, value in (("app.get_s3_client", lambda *a, **k: self.s3), ("app.load_prices", load_prices)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_merges_rules_into_one_date_sorted_file(self):
+        rules = [{"type": "dca", "stock": "aaa", "dollar_amount": 100, "frequency": "monthly",
+                  "start_date": "2021-01-01", "end_date": "2021-03-31"},
+                 {"type": "fqr", "stock": "BBB", "quantity": 1, "frequency": "monthly",
+                  "start_date": "2021-01-01", "end_date": "2021-03-31"},
+                 {"type": "dca", "stock": "zzz"}]
+        response = self.client.post("/rules/batch?token=t", json={"rules": rules})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual((body["rules"], body["transactions"]), (2, 6))
+        self.assertEqual(list(body["errors"]), ["ZZZ"])
+
+        transactions = json.loads(self.s3.objects[body["transactions_key"]][0])
+        self.assertEqual([t["date"] for t in transactions], sorted(t["date"] for t in transactions))
+        self.assertEqual([t["stock"] for t in transactions[:2]], ["aaa", "bbb"])
+        self.assertEqual(len(json.loads(self.s3.objects[body["manifest_key"]][0])), 2)
+
+    def test_bad_spec_is_rejected(self):
+        response = self.client.post("/rules/batch?token=t", json={"rules": [{"type": "dca", "stock": "aaa",
+                                                                             "frequency": "daily"}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post("/rules/batch?token=t", json={}).status_code, 400)
+        self.assertEqual(self.s3.calls, [])
+
+class TestSweepRule(unittest.TestCase):
+    def test_fixed_quantity_outcome(self):
+        # Opens of 10 in January, 5 in February and 20 in March; one share bought each month
+        days = pd.bdate_range("2021-01-01", "2021-03-31")
+        opens = np.select([days.month == 1, days.month == 2], [10.0, 5.0], 20.0)
+        arrays = (days.as_unit("ns").asi8, opens, opens, np.ones(len(days)))
+        rule = {"type": "fqr", "amount": 1.0, "frequency": "monthly", "start_date": "2021-01-01", "end_date": None}
+        result = evaluate_rule(arrays, rule)
+        self.assertEqual((result["buys"], result["shares"], result["invested"], result["final_value"]), (3, 3.0, 35.0, 60.0))
+        # February halves the first share; the new money does not hide it
+        self.assertAlmostEqual(result["max_drawdown"], -0.5)
+
+    def test_irr_of_a_single_buy(self):
+        self.assertAlmostEqual(_irr(np.array([1.0]), np.array([100.0]), 110.0), 0.10, places=6)
+
+    def test_grid_wraps_single_values_and_parses_dates(self):
+        combinations = expand_grid({"tickers": "aapl, AAPL,msft", "dollar_amounts": "100,100",
+                                    "frequencies": "monthly", "start_dates": ["2020-1-6", "2020-01-06"]})
+        self.assertEqual([(t, r["start_date"]) for t, r in combinations], [("aapl", "2020-01-06"), ("msft", "2020-01-06")])
+        for grid in ({"tickers": "a", "start_dates": ["someday"]}, {"tickers": "a", "end_date": "never"},
+                     {"tickers": {"a": 1}}):
+            with self.assertRaises(ValueError):
+                expand_grid(grid)
+
+        client = app_client(self)
+        response = client.post("/sweep/submit?token=t", json={"tickers": ["aapl"], "start_dates": ["someday"]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_validates_top(self):
+        client = app_client(self)
+        results = [{"frequency": "monthly", "start_date": "2021-01-01", "irr": 0.1}] * 3
+        with mock.patch.dict(app.job_statuses, {"sweep-test": "success"}), \
+                mock.patch.dict(app.job_results, {"sweep-test": {"combinations": 3, "seconds": 0.0, "errors": [],
+                                                                  "results": results}}):
+            self.assertEqual(len(client.get("/sweep/sweep-test?token=t&top=2").get_json()["results"]), 2)
+            for top in ("x", "-1"):
+                self.assertEqual(client.get(f"/sweep/sweep-test?token=t&top={top}").status_code, 400)
+
+class TestPairsScan(unittest.TestCase):
+    def test_half_life_of_geometric_decay(self):
+        # The spread closes 10% of its gap every bar
+        spread = 100 * 0.9 ** np.arange(50)
+        self.assertAlmostEqual(half_life(spread), np.log(2) / 0.1)
+        self.assertIsNone(half_life(100 * 1.1 ** np.arange(50)))
+
+    def test_candidates_keep_correlated_partners(self):
+        rng = np.random.default_rng(0)
+        base = rng.normal(size=200)
+        returns = np.column_stack([base, base + rng.normal(scale=0.1, size=200), rng.normal(size=200)])
+        pairs = candidate_pairs(returns, ["b", "a", "c"], min_correlation=0.5, neighbours=1)
+        # Named in ticker order; the uncorrelated ticker has no candidate
+        self.assertEqual(list(pairs), [(1, 0)])
+        self.assertGreater(pairs[(1, 0)], 0.9)
+
+    def test_query_validates_top(self):
+        client = app_client(self)
+        scan = {"meta": {"tickers": 2}, "pairs": [{"ticker1": "A", "ticker2": "B", "cointegrated": True}] * 3}
+        with mock.patch("app.load_scan", lambda name: scan):
+            self.assertEqual(len(client.get("/pairs/scan/pairs-test?token=t&top=2").get_json()["pairs"]), 2)
+            for top in ("x", "-1"):
+                self.assertEqual(client.get(f"/pairs/scan/pairs-test?token=t&top={top}").status_code, 400)
+
 # To run the tests
 if __name__ == "__main__":
     unittest.main()
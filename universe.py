@@ -0,0 +1,157 @@
+import argparse
+import os
+import zipfile
+from datetime import datetime, timezone
+
+import pandas as pd
+import requests
+
+SUPPORTED_TICKERS_URL = "https://apimedia.tiingo.com/docs/tiingo/daily/supported_tickers.zip"
+UNIVERSE_CACHE_DIR = os.environ.get(
+    "STONKS_UNIVERSE_CACHE", os.path.join(os.path.expanduser("~"), ".stonks", "universe")
+)
+ZIP_NAME = "supported_tickers.zip"
+VALIDATORS_NAME = "supported_tickers.validators"
+# ticker,sector CSV; the supported tickers list carries no sector, so this map is maintained by hand
+SECTORS_PATH = os.environ.get("STONKS_SECTORS", os.path.join(UNIVERSE_CACHE_DIR, "sectors.csv"))
+
+
+def default_active_as_of():
+    """Tickers are considered active if they have data this calendar year."""
+    return f"{datetime.now(timezone.utc).year}-01-01"
+
+
+def _read_validators(path):
+    validators = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                name, _, value = line.rstrip("\n").partition("=")
+                if value:
+                    validators[name] = value
+    return validators
+
+
+def _write_atomic(path, data, mode="wb"):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def fetch_supported_tickers(cache_dir=UNIVERSE_CACHE_DIR):
+    """
+    Make sure the cached supported_tickers.zip is current.
+
+    The download is conditional on the ETag / Last-Modified of the cached copy, so an unchanged
+    upstream file costs a single 304 response.
+
+    :return: path to the cached zip, or None if it could not be downloaded and no cached copy exists
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    zip_path = os.path.join(cache_dir, ZIP_NAME)
+    validators_path = os.path.join(cache_dir, VALIDATORS_NAME)
+
+    headers = {}
+    if os.path.exists(zip_path):
+        validators = _read_validators(validators_path)
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    try:
+        response = requests.get(SUPPORTED_TICKERS_URL, headers=headers, timeout=60)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to download file: {e}")
+        return zip_path if os.path.exists(zip_path) else None
+
+    if response.status_code == 304:
+        return zip_path
+
+    if response.status_code != 200:
+        print(f"Failed to download file: {response.status_code}")
+        return zip_path if os.path.exists(zip_path) else None
+
+    _write_atomic(zip_path, response.content)
+    validators = {
+        "etag": response.headers.get("ETag", ""),
+        "last_modified": response.headers.get("Last-Modified", "")
+    }
+    _write_atomic(validators_path, "".join(f"{k}={v}\n" for k, v in validators.items()), mode="w")
+    return zip_path
+
+
+def filter_universe(df, active_as_of):
+    """USD tickers on NASDAQ/NYSE with a known listing range that still had data on or after active_as_of."""
+    df = df[df['priceCurrency'] == 'USD']
+    df = df[df['exchange'].isin(['NASDAQ', 'NYSE'])]
+    df = df[df['startDate'].notna()]
+    df = df[df['endDate'].notna()]
+    df = df[df['endDate'] >= active_as_of]
+    return df.reset_index(drop=True)
+
+
+def load_universe(active_as_of=None, cache_dir=UNIVERSE_CACHE_DIR, refresh=True):
+    """
+    Load the filtered ticker universe.
+
+    The filtered list is kept next to the cached zip as universe_<active_as_of>.txt (one lowercase
+    ticker per line) and only rebuilt when the zip changes.
+
+    :param active_as_of: YYYY-MM-DD; tickers whose endDate is earlier are dropped (default: Jan 1 of this year)
+    :param cache_dir: cache folder for the zip and the filtered lists
+    :param refresh: revalidate the zip against the provider first
+    :return: list of lowercase tickers, or None if no universe is available
+    """
+    active_as_of = active_as_of or default_active_as_of()
+    zip_path = os.path.join(cache_dir, ZIP_NAME)
+    if refresh or not os.path.exists(zip_path):
+        zip_path = fetch_supported_tickers(cache_dir)
+        if zip_path is None:
+            return None
+
+    artifact_path = os.path.join(cache_dir, f"universe_{active_as_of}.txt")
+    if os.path.exists(artifact_path) and os.path.getmtime(artifact_path) >= os.path.getmtime(zip_path):
+        with open(artifact_path, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+
+    with zipfile.ZipFile(zip_path) as z:
+        file_names = z.namelist()
+        with z.open(file_names[0]) as csv_file:
+            # Only empty cells are missing values, so a ticker like "NA" is not read as NaN
+            df = pd.read_csv(csv_file, dtype=str, keep_default_na=False,
+                             na_values={'startDate': [''], 'endDate': ['']})
+
+    tickers = [t.lower() for t in filter_universe(df, active_as_of)['ticker']]
+    _write_atomic(artifact_path, "".join(f"{t}\n" for t in tickers), mode="w")
+    return tickers
+
+
+def load_sector_map(path=SECTORS_PATH):
+    """
+    Ticker -> sector map from a CSV with ticker and sector columns.
+
+    :return: dict of lowercase ticker to sector, empty if the file does not exist
+    """
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return {t.lower().strip(): s.strip() for t, s in zip(df['ticker'], df['sector']) if t.strip()}
+
+
+def sector_tickers(sector, path=SECTORS_PATH):
+    """Lowercase tickers of a sector (case-insensitive), in file order."""
+    sector = sector.lower().strip()
+    return [t for t, s in load_sector_map(path).items() if s.lower() == sector]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the cached ticker universe.")
+    parser.add_argument("-active_as_of", type=str, help="Keep tickers with data on or after this date (YYYY-MM-DD)")
+    parser.add_argument("-cache_dir", type=str, default=UNIVERSE_CACHE_DIR, help="Cache folder")
+
+    args = parser.parse_args()
+    tickers = load_universe(args.active_as_of, args.cache_dir)
+    if tickers is not None:
+        print(f"{len(tickers)} tickers in universe")